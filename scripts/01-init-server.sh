@@ -177,10 +177,15 @@ info "Настройка fail2ban..."
 # Копирование пользовательских конфигов
 cp "$PROJECT_DIR/configs/fail2ban/jail.local" /etc/fail2ban/jail.local
 
-# Создание фильтра для 3x-ui
-if [[ -f "$PROJECT_DIR/configs/fail2ban/filter.d/3x-ui.conf" ]]; then
-    cp "$PROJECT_DIR/configs/fail2ban/filter.d/3x-ui.conf" /etc/fail2ban/filter.d/3x-ui.conf
-fi
+# Создание фильтров для 3x-ui и анализатора логов Xray
+for filter in 3x-ui xray-abuse; do
+    if [[ -f "$PROJECT_DIR/configs/fail2ban/filter.d/$filter.conf" ]]; then
+        cp "$PROJECT_DIR/configs/fail2ban/filter.d/$filter.conf" "/etc/fail2ban/filter.d/$filter.conf"
+    fi
+done
+# fail2ban не запускается, если файла лога нет; кандидатов на бан пишет бот
+mkdir -p "$PROJECT_DIR/logs"
+touch "$PROJECT_DIR/logs/xray-abuse.log"
 
 # Обновление портов в конфиге jail
 sed -i "s/port     = 2222/port     = ${SSH_PORT}/" /etc/fail2ban/jail.local
@@ -77,25 +77,8 @@ fi
 # =============================================
 info "Подготовка конфигурации Hysteria2..."
 
-HYSTERIA_CONFIG="$PROJECT_DIR/hysteria2/config.yaml"
-
-# Створення робочої копії з шаблону (якщо він існує) або використання поточного як основи
-if [[ -f "${HYSTERIA_CONFIG}.template" ]]; then
-    cp "${HYSTERIA_CONFIG}.template" "${HYSTERIA_CONFIG}.tmp"
-else
-    # Якщо шаблону немає, створюємо його з поточного конфігу (для першого разу)
-    cp "$HYSTERIA_CONFIG" "${HYSTERIA_CONFIG}.tmp"
-fi
-
-# Замена плейсхолдеров
-sed -i "s|__HYSTERIA_PASSWORD__|${HYSTERIA_PASSWORD}|g" "${HYSTERIA_CONFIG}.tmp"
-sed -i "s|__HYSTERIA_UP__|${HYSTERIA_UP_MBPS:-100} mbps|g" "${HYSTERIA_CONFIG}.tmp"
-sed -i "s|__HYSTERIA_DOWN__|${HYSTERIA_DOWN_MBPS:-100} mbps|g" "${HYSTERIA_CONFIG}.tmp"
-sed -i "s|__HYSTERIA_MASQUERADE__|${REALITY_SNI:-www.microsoft.com}|g" "${HYSTERIA_CONFIG}.tmp"
-sed -i "s|__HYSTERIA_OBFS_PASSWORD__|${HYSTERIA_OBFS_PASSWORD:-}|g" "${HYSTERIA_CONFIG}.tmp"
-sed -i "s|__HYSTERIA_PORT__|${HYSTERIA_PORT:-443}|g" "${HYSTERIA_CONFIG}.tmp"
-
-mv "${HYSTERIA_CONFIG}.tmp" "$HYSTERIA_CONFIG"
+# Тот же типизированный рендер, что и у бота: иначе бот при первом запуске перепишет конфиг и перезапустит hysteria2
+python3 "$SCRIPT_DIR/bot/vpn_manager.py" --render-hysteria
 log "Конфиг Hysteria2 подготовлен"
 
 # =============================================
@@ -0,0 +1,269 @@
+import io
+import os
+import json
+import time
+import struct
+import sqlite3
+import hashlib
+import tarfile
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_EXTENSIONS = (".tar.zst", ".tar.gz")
+MANIFEST_NAME = "manifest.json"
+DB_PAGES_SUFFIX = ".pages"
+PAGE_RECORD = struct.Struct(">I")
+# SQLite side files that must never be copied next to a snapshot
+DB_SIDE_SUFFIXES = ("-wal", "-shm", "-journal")
+
+def default_compression():
+    return "zstd" if zstandard else "gzip"
+
+def archive_extension(compression):
+    return ".tar.zst" if compression == "zstd" else ".tar.gz"
+
+def strip_extension(path):
+    for ext in ARCHIVE_EXTENSIONS:
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+def sidecar_path(archive_path):
+    # Manifest copy kept next to the archive so incrementals never have to reopen the base
+    return f"{strip_extension(archive_path)}.manifest.json"
+
+@contextmanager
+def open_archive_writer(path, compression):
+    # Streams a tar straight into the compressor and the output file; nothing is staged.
+    # The archive only appears under its final name once fully written.
+    part_path = f"{path}.part"
+    f = open(part_path, "wb")
+    stream = None
+    try:
+        if compression == "zstd":
+            if not zstandard:
+                raise Exception("zstd compression requested but the zstandard module is not installed")
+            # threads=-1: one compression worker per CPU core
+            stream = zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(f, closefd=False)
+            tar = tarfile.open(fileobj=stream, mode="w|")
+        else:
+            tar = tarfile.open(fileobj=f, mode="w|gz")
+        yield tar
+        tar.close()
+        if stream is not None:
+            stream.close()
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        os.replace(part_path, path)
+    except BaseException:
+        f.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+@contextmanager
+def open_archive_reader(path):
+    if path.endswith(".tar.zst"):
+        if not zstandard:
+            raise Exception("Backup is zstd-compressed but the zstandard module is not installed")
+        with open(path, "rb") as f:
+            with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                with tarfile.open(fileobj=stream, mode="r|") as tar:
+                    yield tar
+    else:
+        with tarfile.open(path, "r:*") as tar:
+            yield tar
+
+class _HashingReader:
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+
+@contextmanager
+def sqlite_snapshot(db_path, temp_dir, busy_timeout=10):
+    # Consistent copy through SQLite's online backup API, taken while the panel keeps writing.
+    # The copy goes to a temp file in `temp_dir` (next to the archive) so the DB is never
+    # held in memory; yields (snapshot path, page size) and removes the file afterwards.
+    fd, snapshot_path = tempfile.mkstemp(dir=temp_dir, prefix=".x-ui-snapshot.", suffix=".db")
+    os.close(fd)
+    try:
+        src = sqlite3.connect(db_path, timeout=busy_timeout)
+        dst = sqlite3.connect(snapshot_path)
+        try:
+            src.backup(dst)
+            page_size = dst.execute("PRAGMA page_size").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+        yield snapshot_path, page_size
+    finally:
+        for suffix in ("",) + DB_SIDE_SUFFIXES:
+            if os.path.exists(snapshot_path + suffix):
+                os.remove(snapshot_path + suffix)
+
+def iter_pages(path, page_size):
+    with open(path, "rb") as f:
+        while True:
+            page = f.read(page_size)
+            if not page:
+                return
+            yield page
+
+def page_hashes(path, page_size):
+    return [hashlib.blake2b(page, digest_size=16).hexdigest() for page in iter_pages(path, page_size)]
+
+def _add_bytes(tar, arcname, data, mtime=None):
+    info = tarfile.TarInfo(arcname)
+    info.size = len(data)
+    info.mtime = int(mtime or time.time())
+    info.mode = 0o600
+    tar.addfile(info, io.BytesIO(data))
+
+def iter_files(sources):
+    # sources: [(arcname, path)] where path is a file or a directory
+    for arcname, path in sources:
+        if os.path.isfile(path):
+            yield arcname, path
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    yield os.path.join(arcname, os.path.relpath(full, path)), full
+
+def write_backup(archive_path, root_name, sources, db_path=None, compression=None, base_manifest=None):
+    # Writes a full backup, or an incremental one relative to `base_manifest` (a previous
+    # full backup's manifest): unchanged files are skipped and the DB is stored as a set
+    # of changed pages only.
+    compression = compression or default_compression()
+    manifest = {
+        "type": "incremental" if base_manifest else "full",
+        "name": root_name,
+        "base": base_manifest["name"] if base_manifest else None,
+        "created": int(time.time()),
+        "files": {},
+        "deleted": [],
+        "db": None,
+    }
+    base_files = base_manifest["files"] if base_manifest else {}
+
+    with open_archive_writer(archive_path, compression) as tar:
+        for arcname, path in iter_files(sources):
+            st = os.stat(path)
+            base_entry = base_files.get(arcname)
+            if base_entry and base_entry["size"] == st.st_size and base_entry["mtime_ns"] == st.st_mtime_ns:
+                manifest["files"][arcname] = base_entry
+                continue
+            info = tar.gettarinfo(path, arcname=f"{root_name}/{arcname}")
+            with open(path, "rb") as f:
+                reader = _HashingReader(f)
+                tar.addfile(info, reader)
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": reader.hash.hexdigest()}
+            if base_entry and base_entry.get("sha256") == entry["sha256"]:
+                entry["in_base"] = True
+            manifest["files"][arcname] = entry
+        manifest["deleted"] = sorted(set(base_files) - set(manifest["files"]))
+
+        if db_path and os.path.exists(db_path):
+            with sqlite_snapshot(db_path, os.path.dirname(os.path.abspath(archive_path))) as (snapshot_path, page_size):
+                hashes = page_hashes(snapshot_path, page_size)
+                db_name = os.path.basename(db_path)
+                base_db = base_manifest.get("db") if base_manifest else None
+                if base_db and base_db["page_size"] == page_size:
+                    old = base_db["pages"]
+                    changed = {i for i, h in enumerate(hashes) if i >= len(old) or old[i] != h}
+                    chunks = []
+                    for i, page in enumerate(iter_pages(snapshot_path, page_size)):
+                        if i in changed:
+                            chunks.append(PAGE_RECORD.pack(i))
+                            chunks.append(page)
+                    _add_bytes(tar, f"{root_name}/3xui-db/{db_name}{DB_PAGES_SUFFIX}", b"".join(chunks))
+                    manifest["db"] = {"name": db_name, "page_size": page_size, "page_count": len(hashes),
+                                      "pages": hashes, "changed_pages": len(changed)}
+                else:
+                    info = tar.gettarinfo(snapshot_path, arcname=f"{root_name}/3xui-db/{db_name}")
+                    info.mode = 0o600
+                    with open(snapshot_path, "rb") as f:
+                        tar.addfile(info, f)
+                    manifest["db"] = {"name": db_name, "page_size": page_size, "page_count": len(hashes), "pages": hashes}
+
+        manifest_bytes = json.dumps(manifest).encode()
+        _add_bytes(tar, f"{root_name}/{MANIFEST_NAME}", manifest_bytes)
+
+    with open(sidecar_path(archive_path), "wb") as f:
+        f.write(manifest_bytes)
+    return manifest
+
+def load_manifest(archive_path):
+    path = sidecar_path(archive_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+def extract_backup(archive_path, dest_dir):
+    # Returns (root directory, manifest or None for legacy archives)
+    with open_archive_reader(archive_path) as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(path=dest_dir, filter="data")
+        else:
+            tar.extractall(path=dest_dir)
+    inner_dirs = os.listdir(dest_dir)
+    if not inner_dirs:
+        raise Exception("Archive is empty")
+    root = os.path.join(dest_dir, inner_dirs[0])
+    manifest = None
+    if os.path.exists(os.path.join(root, MANIFEST_NAME)):
+        with open(os.path.join(root, MANIFEST_NAME), "r") as f:
+            manifest = json.load(f)
+    return root, manifest
+
+def apply_incremental(base_root, inc_root, manifest):
+    # Overlays an extracted incremental backup onto its extracted base, in place
+    for arcname in manifest["deleted"]:
+        path = os.path.join(base_root, arcname)
+        if os.path.exists(path):
+            os.remove(path)
+    for arcname, entry in manifest["files"].items():
+        src = os.path.join(inc_root, arcname)
+        if os.path.exists(src):
+            dest = os.path.join(base_root, arcname)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            os.replace(src, dest)
+
+    db = manifest.get("db")
+    if not db:
+        return
+    pages_path = os.path.join(inc_root, "3xui-db", db["name"] + DB_PAGES_SUFFIX)
+    db_path = os.path.join(base_root, "3xui-db", db["name"])
+    if not os.path.exists(pages_path):
+        # Page size changed since the base: the incremental carries the whole DB
+        full = os.path.join(inc_root, "3xui-db", db["name"])
+        if os.path.exists(full):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            os.replace(full, db_path)
+        return
+    page_size = db["page_size"]
+    with open(pages_path, "rb") as pages, open(db_path, "r+b") as out:
+        record = PAGE_RECORD.size + page_size
+        while True:
+            chunk = pages.read(record)
+            if len(chunk) < record:
+                break
+            (index,) = PAGE_RECORD.unpack(chunk[:PAGE_RECORD.size])
+            out.seek(index * page_size)
+            out.write(chunk[PAGE_RECORD.size:])
+        out.truncate(db["page_count"] * page_size)
+    if page_hashes(db_path, page_size) != db["pages"]:
+        raise Exception("Restored DB does not match the incremental backup's page hashes")
@@ -0,0 +1,444 @@
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import secrets
+import platform
+import tempfile
+import statistics
+import subprocess
+import threading
+import contextlib
+import socketserver
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+DEFAULT_SIZES = (1, 100, 1000)
+
+# --- Local stand-ins ---
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body leave in one write, so keep-alive requests don't hit delayed-ACK stalls
+    wbufsize = 1 << 16
+
+    def log_message(self, format, *args):
+        pass
+
+    def address_string(self):
+        return "local"
+
+    def _send(self, code, obj=None, raw=None, content_type="application/json", headers=None):
+        body = raw if raw is not None else (json.dumps(obj).encode() if obj is not None else b"")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+class _PanelHandler(_QuietHandler):
+    # The subset of the 3x-ui API VPNManager uses: cookie login, inbounds CRUD, addClient,
+    # the Xray template setting and restartXrayService
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def _ok(self, obj=None):
+        self._send(200, {"success": True, "msg": "", "obj": obj})
+
+    def _dispatch(self):
+        panel = self.server.panel
+        body = self._body()
+        path = urlsplit(self.path).path
+        if path == "/login":
+            form = parse_qs(body.decode())
+            if form.get("username", [""])[0] != panel.username or form.get("password", [""])[0] != panel.password:
+                return self._send(200, {"success": False, "msg": "wrong credentials"})
+            session = secrets.token_hex(16)
+            panel.sessions.add(session)
+            return self._send(200, {"success": True}, headers={"Set-Cookie": f"3x-ui={session}; Path=/; HttpOnly"})
+        cookie = self.headers.get("Cookie", "")
+        if not any(part.strip().startswith("3x-ui=") and part.strip()[6:] in panel.sessions for part in cookie.split(";")):
+            return self._send(401, {"success": False, "msg": "unauthorized"})
+
+        with panel.lock:
+            inbounds = panel.inbounds
+            if path == "/panel/api/inbounds/list":
+                return self._ok(list(inbounds.values()))
+            if path == "/panel/api/inbounds/add":
+                inbound = json.loads(body)
+                inbound["id"] = panel.next_id
+                panel.next_id += 1
+                inbounds[inbound["id"]] = inbound
+                return self._ok(inbound)
+            if path.startswith("/panel/api/inbounds/update/"):
+                inbound = json.loads(body)
+                inbound["id"] = int(path.rsplit("/", 1)[1])
+                inbounds[inbound["id"]] = inbound
+                return self._ok(inbound)
+            if path.startswith("/panel/api/inbounds/del/"):
+                inbounds.pop(int(path.rsplit("/", 1)[1]), None)
+                return self._ok()
+            if path == "/panel/api/inbounds/addClient":
+                data = json.loads(body)
+                inbound = inbounds[int(data["id"])]
+                settings = json.loads(inbound["settings"])
+                settings["clients"].extend(json.loads(data["settings"])["clients"])
+                inbound["settings"] = json.dumps(settings)
+                return self._ok()
+            if path == "/panel/api/inbounds/onlines":
+                return self._ok([])
+            if path == "/panel/xray/":
+                return self._ok(json.dumps({"xraySetting": panel.template, "inboundTags": []}))
+            if path == "/panel/xray/update":
+                panel.template = json.loads(parse_qs(body.decode())["xraySetting"][0])
+                return self._ok()
+            if path == "/server/restartXrayService":
+                return self._ok()
+        self._send(404, {"success": False, "msg": f"no route {path}"})
+
+class FakePanel:
+    def __init__(self, username="admin", password="admin"):
+        self.username = username
+        self.password = password
+        self.lock = threading.Lock()
+        self.sessions = set()
+        self.reset()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _PanelHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.panel = self
+        threading.Thread(target=self.httpd.serve_forever, name="fake-panel", daemon=True).start()
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def reset(self):
+        with self.lock:
+            self.inbounds = {}
+            self.next_id = 1
+            self.template = None
+            self.sessions.clear()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class _DockerHandler(_QuietHandler):
+    # Engine API endpoints used by docker_api.DockerAPI; restarts emit replayable start events
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        docker = self.server.docker
+        body = self._body()
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if url.path == "/_ping":
+            return self._send(200, raw=b"OK", content_type="text/plain")
+        if parts[0] == "volumes":
+            if parts[-1] == "create":
+                return self._send(201, {"Name": json.loads(body)["Name"]})
+            return self._send(200, {"Name": parts[-1], "Mountpoint": docker.volume_dir})
+        if url.path == "/containers/json":
+            labels = json.loads(query.get("filters", "{}")).get("label", [])
+            service = next((label.split("=", 1)[1] for label in labels if label.startswith("com.docker.compose.service=")), None)
+            names = [name for name in docker.containers if service in (None, name)]
+            return self._send(200, [{"Id": f"id-{name}", "Names": [f"/{name}"]} for name in names])
+        if parts[0] == "containers":
+            name, action = parts[1], parts[-1]
+            if action in ("restart", "start"):
+                docker.emit(name, "start")
+                return self._send(204)
+            if action == "stop":
+                return self._send(204)
+            if action == "top":
+                return self._send(200, {"Titles": ["COMMAND"], "Processes": [[p] for p in docker.containers.get(name, [])]})
+            if action == "exec":
+                exec_id = secrets.token_hex(16)
+                docker.execs[exec_id] = json.loads(body)["Cmd"]
+                return self._send(201, {"Id": exec_id})
+            if action == "archive":
+                return self._send(200)
+        if parts[0] == "exec":
+            if parts[-1] == "start":
+                return self._send(200, raw=b"", content_type="application/vnd.docker.raw-stream")
+            return self._send(200, {"ExitCode": 0})
+        if url.path == "/events":
+            return self._events(docker, json.loads(query.get("filters", "{}")), float(query.get("since", 0)), float(query.get("until", time.time() + 5)))
+        self._send(404, {"message": f"no route {url.path}"})
+
+    def _events(self, docker, filters, since, until):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        sent = 0
+        wanted = set(filters.get("container", []))
+        try:
+            while time.time() < until:
+                events = [e for e in docker.events if e["time"] >= since and e["Actor"]["Attributes"]["name"] in wanted]
+                for event in events[sent:]:
+                    line = (json.dumps(event) + "\n").encode()
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+                sent = len(events)
+                time.sleep(0.01)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class FakeDocker:
+    def __init__(self, sock_path, volume_dir):
+        self.sock_path = sock_path
+        self.volume_dir = volume_dir
+        # container name -> processes reported by /top
+        self.containers = {"3x-ui": ["x-ui", "xray-linux-amd64"], "hysteria2": ["hysteria"], "VPN-Warp": ["warp-svc"]}
+        self.execs = {}
+        self.events = []
+        self.server = _UnixServer(sock_path, _DockerHandler)
+        self.server.docker = self
+        threading.Thread(target=self.server.serve_forever, name="fake-docker", daemon=True).start()
+
+    def emit(self, name, action):
+        self.events.append({"Type": "container", "Action": action, "time": time.time(),
+                            "Actor": {"ID": f"id-{name}", "Attributes": {"name": name}}})
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def create_xui_db(path, clients):
+    # Same tables 3x-ui keeps; client_traffics grows with the roster like the real DB does
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT, password TEXT, login_secret TEXT);
+        CREATE TABLE settings (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT, value TEXT);
+        CREATE TABLE inbounds (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, up INTEGER, down INTEGER,
+            total INTEGER, remark TEXT, enable INTEGER, expiry_time INTEGER, listen TEXT, port INTEGER,
+            protocol TEXT, settings TEXT, stream_settings TEXT, tag TEXT, sniffing TEXT);
+        CREATE TABLE client_traffics (id INTEGER PRIMARY KEY AUTOINCREMENT, inbound_id INTEGER, enable INTEGER,
+            email TEXT, up INTEGER, down INTEGER, expiry_time INTEGER, total INTEGER, reset INTEGER);
+    """)
+    conn.execute("INSERT INTO users (username, password) VALUES ('admin', 'admin')")
+    conn.executemany("INSERT INTO settings (key, value) VALUES (?, ?)",
+                     [("webPort", "2053"), ("secret", secrets.token_hex(16)), ("xrayTemplateConfig", "{}")])
+    conn.executemany("INSERT INTO client_traffics (inbound_id, enable, email, up, down, expiry_time, total, reset) "
+                     "VALUES (1, 1, ?, ?, ?, 0, 0, 0)",
+                     [(c["email"], secrets.randbelow(1 << 34), secrets.randbelow(1 << 36)) for c in clients])
+    conn.commit()
+    conn.close()
+
+# --- Harness ---
+
+class Environment:
+    # A throwaway project directory wired to the stand-ins: .env, clients.json, a hysteria2 and
+    # fail2ban config, an x-ui.db in the fake volume, and a `docker` stub on PATH for the one
+    # remaining CLI call (`docker compose up` after a restore)
+    def __init__(self):
+        self.root = tempfile.mkdtemp(prefix="vpn-bench-")
+        self.project_dir = os.path.join(self.root, "project")
+        self.volume_dir = os.path.join(self.root, "volume")
+        for path in (self.project_dir, self.volume_dir, os.path.join(self.project_dir, "configs"),
+                     os.path.join(self.project_dir, "hysteria2"), os.path.join(self.root, "bin")):
+            os.makedirs(path, exist_ok=True)
+        shutil.copy(os.path.join(PROJECT_DIR, "configs", "routing.json"), os.path.join(self.project_dir, "configs"))
+        shutil.copytree(os.path.join(PROJECT_DIR, "configs", "fail2ban"), os.path.join(self.project_dir, "configs", "fail2ban"))
+        stub = os.path.join(self.root, "bin", "docker")
+        with open(stub, "w") as f:
+            f.write("#!/bin/sh\nexit 0\n")
+        os.chmod(stub, 0o755)
+        os.environ["PATH"] = f"{os.path.dirname(stub)}{os.pathsep}{os.environ.get('PATH', '')}"
+        # The manager must find the DB through the (fake) Docker volume, not an override
+        os.environ.pop("XUI_DB_PATH", None)
+        self.panel = FakePanel()
+        self.docker = FakeDocker(os.path.join(self.root, "docker.sock"), self.volume_dir)
+
+    def write_env(self):
+        with open(os.path.join(self.project_dir, ".env"), "w") as f:
+            f.write("\n".join([
+                "SERVER_IP=203.0.113.10",
+                f"XUI_PORT={self.panel.port}",
+                "XUI_USERNAME=admin",
+                "XUI_PASSWORD=admin",
+                "VLESS_PORT=443",
+                f"VLESS_UUID={uuid.uuid4()}",
+                "REALITY_SNI=www.microsoft.com",
+                "REALITY_PRIVATE_KEY=", "REALITY_PUBLIC_KEY=", "REALITY_SHORT_ID=",
+                "HYSTERIA_PORT=8443",
+                f"HYSTERIA_PASSWORD={secrets.token_urlsafe(18)}",
+                f"HYSTERIA_OBFS_PASSWORD={secrets.token_urlsafe(18)}",
+                f"DOCKER_SOCK={self.docker.sock_path}",
+                f"BACKUP_DIR={os.path.join(self.root, 'backups')}",
+                # Never list or rotate real backups of the host running the benchmark
+                "BACKUP_LEGACY_DIR=",
+                "BACKUP_COMPRESSION=gzip",
+                "READY_TIMEOUT=10",
+            ]) + "\n")
+
+    def prepare(self, size):
+        # Fresh panel, .env, roster of `size` clients (the default client included) and DB
+        self.panel.reset()
+        self.write_env()
+        clients = [{"email": f"user{i}@vpn", "id": str(uuid.uuid4()), "hysteria_password": secrets.token_urlsafe(16)}
+                   for i in range(1, size)]
+        with open(os.path.join(self.project_dir, "clients.json"), "w") as f:
+            json.dump(clients, f)
+        with open(os.path.join(self.project_dir, "hysteria2", "config.yaml"), "w") as f:
+            f.write("# placeholder\n")
+        for name in os.listdir(self.volume_dir):
+            os.remove(os.path.join(self.volume_dir, name))
+        create_xui_db(os.path.join(self.volume_dir, "x-ui.db"), clients)
+
+    def close(self):
+        self.panel.stop()
+        self.docker.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+def measure(fn, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "runs": repeat,
+        "min_ms": samples[0],
+        "median_ms": statistics.median(samples),
+        "max_ms": samples[-1],
+    }
+
+def bench_size(env, size, repeat):
+    from vpn_manager import VPNManager
+    env.prepare(size)
+    manager = VPNManager(env.project_dir)
+    results = {}
+
+    def fresh_client():
+        manager._xui = None
+
+    results["login_xui"] = measure(manager.login_xui, repeat, setup=fresh_client)
+    results["generate_keys"] = measure(manager.generate_keys, repeat)
+    # A new panel every run: creates the inbound and template; then the idempotent re-run
+    results["setup_inbound"] = measure(manager.setup_inbound, repeat, setup=env.panel.reset)
+    results["setup_inbound_noop"] = measure(manager.setup_inbound, repeat)
+
+    def cold_links():
+        manager._links_cache = None
+
+    results["get_client_links"] = measure(manager.get_client_links, repeat, setup=cold_links)
+    results["get_client_links_cached"] = measure(manager.get_client_links, repeat)
+
+    archives = []
+    results["create_backup"] = measure(lambda: archives.append(manager.create_backup()), repeat)
+    results["restore_backup"] = measure(lambda: manager.restore_backup(archives[-1]), repeat)
+    return [dict(stats, operation=name, clients=size) for name, stats in results.items()]
+
+def git_revision():
+    try:
+        res = subprocess.run(["git", "-C", PROJECT_DIR, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5)
+        return res.stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+def run(sizes=DEFAULT_SIZES, repeat=5):
+    import tracing
+    env = Environment()
+    try:
+        results = []
+        for size in sizes:
+            print(f"Benchmarking with {size} client(s)...")
+            results.extend(bench_size(env, size, repeat))
+    finally:
+        env.close()
+    return {
+        "revision": git_revision(),
+        "timestamp": int(time.time()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeat": repeat,
+        # Every timed operation above runs inside tracing spans; this is what one span adds
+        "span_overhead_ns": tracing.overhead_ns(),
+        "results": results,
+    }
+
+def compare(old, new, threshold=0.2, min_delta_ms=1.0):
+    # Median vs median per (operation, clients); flags anything more than `threshold` and
+    # `min_delta_ms` slower, so sub-millisecond jitter is not reported
+    before = {(r["operation"], r["clients"]): r for r in old["results"]}
+    lines, regressions = [], 0
+    for r in new["results"]:
+        base = before.get((r["operation"], r["clients"]))
+        if not base:
+            continue
+        ratio = r["median_ms"] / base["median_ms"] if base["median_ms"] else float("inf")
+        mark = ""
+        if ratio > 1 + threshold and r["median_ms"] - base["median_ms"] > min_delta_ms:
+            mark = "  REGRESSION"
+            regressions += 1
+        elif ratio < 1 - threshold:
+            mark = "  faster"
+        lines.append(f"{r['operation']:<26} {r['clients']:>5} {base['median_ms']:>10.2f} {r['median_ms']:>10.2f} {ratio:>6.2f}x{mark}")
+    header = f"{'operation':<26} {'n':>5} {'before ms':>10} {'after ms':>10} {'ratio':>7}"
+    return "\n".join([header] + lines), regressions
+
+def format_results(report):
+    lines = [f"{'operation':<26} {'n':>5} {'min ms':>10} {'median ms':>10} {'max ms':>10}"]
+    for r in report["results"]:
+        lines.append(f"{r['operation']:<26} {r['clients']:>5} {r['min_ms']:>10.2f} {r['median_ms']:>10.2f} {r['max_ms']:>10.2f}")
+    if report.get("span_overhead_ns") is not None:
+        lines.append(f"Tracing overhead: {report['span_overhead_ns'] / 1000:.2f} µs per span")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmark VPNManager control-plane operations against local stand-ins")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Client counts to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per operation")
+    parser.add_argument("--output", default="benchmark-results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", metavar="FILE", help="Previous results to compare against; exits 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown counted as a regression")
+    args = parser.parse_args()
+
+    sys.path.insert(0, SCRIPT_DIR)
+    report = run(args.sizes, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(format_results(report))
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            text, regressions = compare(json.load(f), report, args.threshold)
+        print(text)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,265 @@
+import io
+import re
+import json
+import time
+import socket
+import struct
+import tarfile
+import threading
+import http.client
+
+import tracing
+from urllib.parse import quote, urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_SOCK = "/var/run/docker.sock"
+# Exec and container IDs in paths, folded so spans group by operation
+_ID_RE = re.compile(r"/[0-9a-f]{12,}(?=/|$)")
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, sock_path, timeout=30):
+        super().__init__("localhost", timeout=timeout)
+        self.sock_path = sock_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.sock_path)
+        self.sock = sock
+
+class DockerAPI:
+    # Thin Docker Engine API client over the UNIX socket. Requests reuse a kept-alive
+    # connection (a second one is opened only while another thread holds the first), and
+    # volume/container lookups are cached because their answers only change on recreate.
+    def __init__(self, sock_path=DEFAULT_SOCK, timeout=30, api_version=None):
+        self.sock_path = sock_path
+        self.timeout = timeout
+        self.prefix = f"/v{api_version}" if api_version else ""
+        self._idle = []
+        self._lock = threading.Lock()
+        self._volumes = {}
+        self._services = {}
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return UnixHTTPConnection(self.sock_path, self.timeout)
+
+    def _release(self, conn):
+        with self._lock:
+            self._idle.append(conn)
+
+    def _url(self, path, params=None):
+        params = {k: (json.dumps(v) if isinstance(v, (dict, list)) else v) for k, v in (params or {}).items() if v is not None}
+        return self.prefix + path + (f"?{urlencode(params)}" if params else "")
+
+    def request(self, method, path, params=None, body=None, headers=None, expect=(200, 201, 204, 304)):
+        # Returns (status, raw body). A stale kept-alive connection is retried once on a fresh one.
+        url = self._url(path, params)
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        with tracing.span(f"docker {method} {_ID_RE.sub('/:id', path)}"):
+            return self._request(method, path, url, body, headers, expect)
+
+    def _request(self, method, path, url, body, headers, expect):
+        for attempt in range(2):
+            conn = self._acquire()
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                res = conn.getresponse()
+                data = res.read()
+            except (ConnectionError, http.client.BadStatusLine, http.client.CannotSendRequest) as e:
+                conn.close()
+                if attempt:
+                    raise Exception(f"Docker API {method} {path} failed: {e}")
+                continue
+            except OSError as e:
+                conn.close()
+                raise Exception(f"Docker API {method} {path} failed: {e}")
+            if res.will_close:
+                conn.close()
+            else:
+                self._release(conn)
+            if expect and res.status not in expect:
+                raise Exception(f"Docker API {method} {path} returned {res.status}: {self._message(data)}")
+            return res.status, data
+        raise Exception(f"Docker API {method} {path} failed")
+
+    @staticmethod
+    def _message(data):
+        try:
+            return json.loads(data).get("message", "")
+        except ValueError:
+            return data.decode(errors="replace").strip()
+
+    def get_json(self, path, params=None):
+        return json.loads(self.request("GET", path, params)[1])
+
+    def ping(self):
+        return self.request("GET", "/_ping")[1] == b"OK"
+
+    # --- Volumes ---
+
+    def volume_mountpoint(self, name):
+        # Compose may have prefixed the volume with the project name ("vpn_3xui-db")
+        if name in self._volumes:
+            return self._volumes[name]
+        status, data = self.request("GET", f"/volumes/{quote(name)}", expect=(200, 404))
+        if status == 200:
+            mountpoint = json.loads(data)["Mountpoint"]
+        else:
+            volumes = self.get_json("/volumes").get("Volumes") or []
+            matches = [v for v in volumes if v["Name"].endswith(f"_{name}")]
+            mountpoint = matches[0]["Mountpoint"] if matches else None
+        if mountpoint:
+            self._volumes[name] = mountpoint
+        return mountpoint
+
+    def create_volume(self, name):
+        self.request("POST", "/volumes/create", body={"Name": name})
+        self._volumes.pop(name, None)
+
+    # --- Containers ---
+
+    def containers(self, filters=None, all=True):
+        return self.get_json("/containers/json", {"all": 1 if all else 0, "filters": filters})
+
+    def service_containers(self, project_dir, service=None):
+        # IDs of the compose project's containers (optionally one service), cached. A container
+        # recreated by `compose up` gets a new ID, so callers drop the cache on a 404.
+        key = (project_dir, service)
+        if key not in self._services:
+            labels = [f"com.docker.compose.project.working_dir={project_dir}"]
+            if service:
+                labels.append(f"com.docker.compose.service={service}")
+            found = self.containers({"label": labels})
+            self._services[key] = {c["Names"][0].lstrip("/"): c["Id"] for c in found}
+        return self._services[key]
+
+    def forget_containers(self):
+        self._services.clear()
+
+    def inspect(self, container):
+        status, data = self.request("GET", f"/containers/{quote(container)}/json", expect=(200, 404))
+        return json.loads(data) if status == 200 else None
+
+    def top(self, container, ps_args="-eo comm"):
+        # Process list inside the container: {"Titles": [...], "Processes": [[...], ...]}
+        return self.get_json(f"/containers/{quote(container)}/top", {"ps_args": ps_args})
+
+    def stats(self, container):
+        # One resource sample; one-shot skips the daemon's second (precpu) sample and its 1s wait
+        return self.get_json(f"/containers/{quote(container)}/stats", {"stream": "false", "one-shot": "true"})
+
+    def start(self, container):
+        self.request("POST", f"/containers/{quote(container)}/start")
+
+    def stop(self, container, timeout=10):
+        self.request("POST", f"/containers/{quote(container)}/stop", {"t": timeout})
+
+    def restart(self, container, timeout=10):
+        self.request("POST", f"/containers/{quote(container)}/restart", {"t": timeout})
+
+    def restart_many(self, containers, timeout=10, wait=True):
+        # Restarts every container at once (the API call blocks for each), then confirms each
+        # one through the events stream instead of polling its state.
+        # Returns {container: None on success, else the error message}.
+        since = time.time()
+        results = {}
+        if not containers:
+            return results
+        with ThreadPoolExecutor(max_workers=len(containers)) as pool:
+            futures = {name: pool.submit(self.restart, name, timeout) for name in containers}
+            for name, future in futures.items():
+                try:
+                    future.result()
+                    results[name] = None
+                except Exception as e:
+                    results[name] = str(e)
+        if wait:
+            started = [name for name, error in results.items() if error is None]
+            missing = self.wait_for(started, "start", since=since, timeout=timeout + 30)
+            for name in missing:
+                results[name] = "no start event received"
+        return results
+
+    # --- Exec and files ---
+
+    def exec_run(self, container, cmd, check=False):
+        # `docker exec`: returns (exit code, stdout bytes, stderr bytes)
+        exec_id = json.loads(self.request("POST", f"/containers/{quote(container)}/exec", body={
+            "Cmd": list(cmd), "AttachStdout": True, "AttachStderr": True,
+        })[1])["Id"]
+        _, raw = self.request("POST", f"/exec/{exec_id}/start", body={"Detach": False, "Tty": False})
+        stdout, stderr = self._demux(raw)
+        code = self.get_json(f"/exec/{exec_id}/json")["ExitCode"]
+        if check and code != 0:
+            raise Exception(f"{' '.join(cmd)} in {container} exited with {code}: {stderr.decode(errors='replace').strip()}")
+        return code, stdout, stderr
+
+    @staticmethod
+    def _demux(raw):
+        # Non-TTY exec output is framed: 1 byte stream id, 3 padding, 4 byte big-endian length
+        out, err = [], []
+        pos = 0
+        while pos + 8 <= len(raw):
+            stream, size = raw[pos], struct.unpack(">I", raw[pos + 4:pos + 8])[0]
+            chunk = raw[pos + 8:pos + 8 + size]
+            (err if stream == 2 else out).append(chunk)
+            pos += 8 + size
+        return b"".join(out), b"".join(err)
+
+    def put_file(self, container, dest_dir, name, src_path, mode=0o644):
+        # `docker cp` into a directory: the Engine API takes a tar stream
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            info = tar.gettarinfo(src_path, arcname=name)
+            info.mode = mode
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+            with open(src_path, "rb") as f:
+                tar.addfile(info, f)
+        self.request("PUT", f"/containers/{quote(container)}/archive", {"path": dest_dir},
+                     body=buf.getvalue(), headers={"Content-Type": "application/x-tar"})
+
+    # --- Events ---
+
+    def events(self, filters=None, since=None, until=None, timeout=None):
+        # Yields event dicts as the daemon streams them; runs on its own connection so
+        # regular requests can continue meanwhile
+        conn = UnixHTTPConnection(self.sock_path, timeout=timeout)
+        try:
+            conn.request("GET", self._url("/events", {"filters": filters, "since": since, "until": until}))
+            res = conn.getresponse()
+            if res.status != 200:
+                raise Exception(f"Docker API /events returned {res.status}: {self._message(res.read())}")
+            while True:
+                line = res.readline()
+                if not line:
+                    return
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            conn.close()
+
+    def wait_for(self, containers, action, since, timeout=60):
+        # Blocks until every container emitted `action` after `since`; replaying from `since`
+        # covers events that fired before the stream opened. Returns the ones still missing.
+        pending = set(containers)
+        if not pending:
+            return pending
+        deadline = time.time() + timeout
+        filters = {"type": ["container"], "event": [action], "container": sorted(pending)}
+        try:
+            for event in self.events(filters, since=f"{since:.9f}", until=f"{deadline:.9f}", timeout=timeout + 5):
+                actor = event.get("Actor", {})
+                pending.discard(actor.get("Attributes", {}).get("name"))
+                pending.discard(actor.get("ID"))
+                if not pending:
+                    break
+        except (socket.timeout, OSError):
+            pass
+        return pending
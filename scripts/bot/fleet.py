@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import shlex
+import inspect
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Operation name -> vpn_manager.py CLI flags that perform it on a remote node
+OPERATIONS = {
+    "rotate_keys": ["--rotate-keys"],
+    "setup_inbound": ["--setup-inbound"],
+    "plan": ["--plan"],
+    "update_geodata": ["--update-geodata"],
+    "create_backup": ["--backup", "full"],
+}
+
+class LocalNode:
+    # This server, driven through its VPNManager directly
+    def __init__(self, manager, name="local"):
+        self.name = name
+        self.manager = manager
+
+    def run(self, operation):
+        manager = self.manager
+        if operation == "rotate_keys":
+            manager.rotate_keys()
+            return "Keys rotated."
+        if operation == "setup_inbound":
+            return manager.format_plan(manager.reconcile())
+        if operation == "plan":
+            return manager.format_plan(manager.reconcile(dry_run=True))
+        if operation == "update_geodata":
+            updated = manager.update_geodata()
+            return f"Geodata updated: {', '.join(updated)}." if updated else "Geodata already up to date."
+        if operation == "create_backup":
+            return f"Backup created: {manager.create_backup()}"
+        raise Exception(f"Unknown operation {operation!r}")
+
+class SSHNode:
+    # A remote server with the same checkout, driven by running vpn_manager.py over ssh.
+    # BatchMode makes a missing key fail fast instead of waiting for a password prompt.
+    def __init__(self, name, host, user="root", port=22, project_dir="/root/VPN", identity_file=None,
+                 python=None, connect_timeout=10, timeout=600):
+        self.name = name
+        self.host = host
+        self.user = user
+        self.port = int(port)
+        self.project_dir = project_dir
+        self.identity_file = identity_file
+        # The bot's venv has the dependencies vpn_manager.py needs
+        self.python = python or f"{project_dir}/scripts/bot/venv/bin/python"
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+
+    @classmethod
+    def from_config(cls, entry, taken=()):
+        # A typo in fleet.json should name the bad key, not surface as a bare TypeError.
+        # `taken`: names already in the fleet; results are keyed by name, so they must be unique.
+        if not isinstance(entry, dict):
+            raise Exception(f"node entry must be an object, got {entry!r}")
+        params = list(inspect.signature(cls.__init__).parameters)[1:]
+        unknown = sorted(set(entry) - set(params))
+        if unknown:
+            raise Exception(f"unknown key(s) {', '.join(unknown)}; allowed: {', '.join(params)}")
+        missing = [key for key in ("name", "host") if not entry.get(key)]
+        if missing:
+            raise Exception(f"missing {', '.join(missing)}")
+        if entry["name"] in taken:
+            raise Exception(f"duplicate name {entry['name']!r}")
+        return cls(**entry)
+
+    def ssh_command(self, remote_command):
+        cmd = ["ssh", "-o", "BatchMode=yes", "-o", f"ConnectTimeout={self.connect_timeout}", "-p", str(self.port)]
+        if self.identity_file:
+            cmd += ["-i", self.identity_file]
+        return cmd + [f"{self.user}@{self.host}", remote_command]
+
+    def run(self, operation):
+        if operation not in OPERATIONS:
+            raise Exception(f"Unknown operation {operation!r}")
+        script = f"{self.project_dir}/scripts/bot/vpn_manager.py"
+        remote = " ".join(shlex.quote(arg) for arg in [self.python, script] + OPERATIONS[operation])
+        res = subprocess.run(self.ssh_command(remote), capture_output=True, text=True, timeout=self.timeout)
+        if res.returncode != 0:
+            detail = (res.stderr or res.stdout).strip().splitlines()
+            raise Exception(detail[-1] if detail else f"ssh exited with code {res.returncode}")
+        return res.stdout.strip()
+
+class Fleet:
+    # Runs one operation on every node at once, so a fleet-wide run takes as long as
+    # the slowest node. progress(node_name, status, detail) is called from worker threads
+    # with status "running", "ok" or "error". `errors` lists config entries that were skipped.
+    def __init__(self, nodes, max_workers=16, errors=None):
+        self.nodes = nodes
+        self.max_workers = max_workers
+        self.errors = errors or []
+
+    @classmethod
+    def load(cls, path, manager=None):
+        # fleet.json: {"include_local": true, "nodes": [{"name": ..., "host": ..., "user": ..., ...}]}
+        config = {"include_local": True, "nodes": []}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                try:
+                    loaded = json.load(f)
+                except ValueError as e:
+                    raise Exception(f"{path} is not valid JSON: {e}")
+            if not isinstance(loaded, dict) or not isinstance(loaded.get("nodes", []), list):
+                raise Exception(f"{path} must be an object with a \"nodes\" list")
+            config.update(loaded)
+        nodes = []
+        if config.get("include_local", True) and manager is not None:
+            nodes.append(LocalNode(manager, config.get("local_name", "local")))
+        errors = []
+        for i, entry in enumerate(config["nodes"]):
+            try:
+                nodes.append(SSHNode.from_config(entry, taken={node.name for node in nodes}))
+            except Exception as e:
+                label = entry.get("name") if isinstance(entry, dict) and entry.get("name") else f"#{i + 1}"
+                errors.append(f"node {label}: {e}")
+                print(f"Skipping fleet node {label} in {path}: {e}")
+        return cls(nodes, max_workers=config.get("max_workers", 16), errors=errors)
+
+    def names(self):
+        return [node.name for node in self.nodes]
+
+    def _run_node(self, node, operation, progress):
+        if progress:
+            progress(node.name, "running", None)
+        start = time.monotonic()
+        try:
+            output = node.run(operation)
+            result = {"node": node.name, "ok": True, "output": output, "error": None}
+        except Exception as e:
+            result = {"node": node.name, "ok": False, "output": None, "error": str(e) or e.__class__.__name__}
+        result["elapsed"] = time.monotonic() - start
+        if progress:
+            progress(node.name, "ok" if result["ok"] else "error", result)
+        return result
+
+    def run(self, operation, progress=None, nodes=None):
+        # Results are returned in fleet order regardless of completion order
+        targets = [n for n in self.nodes if nodes is None or n.name in nodes]
+        if not targets:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(targets))) as pool:
+            futures = {pool.submit(self._run_node, node, operation, progress): node.name for node in targets}
+            results = {futures[f]: f.result() for f in as_completed(futures)}
+        return [results[node.name] for node in targets]
+
+    @staticmethod
+    def format_results(operation, results):
+        ok = sum(1 for r in results if r["ok"])
+        lines = [f"{operation}: {ok}/{len(results)} nodes OK"]
+        for r in results:
+            detail = r["output"].splitlines()[-1] if r["ok"] and r["output"] else r["error"] or ""
+            lines.append(f"{'+' if r['ok'] else '!'} {r['node']} ({r['elapsed']:.1f}s) {detail}")
+        return "\n".join(lines)
@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_BASE_URL = "https://github.com/Loyalsoldier/v2ray-rules-dat/releases/latest/download"
+GEODATA_FILES = ("geoip.dat", "geosite.dat")
+
+class GeoDataUpdater:
+    # Keeps a verified local copy of each geodata file. Downloads are conditional
+    # (ETag / Last-Modified), each file is fetched once and all files in parallel.
+    # A file is only replaced after its checksum matches the release's .sha256sum.
+    def __init__(self, cache_dir, base_url=DEFAULT_BASE_URL, files=GEODATA_FILES, timeout=60):
+        self.cache_dir = cache_dir
+        self.base_url = base_url.rstrip("/")
+        self.files = files
+        self.timeout = timeout
+        self.state_path = os.path.join(cache_dir, "state.json")
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.state = {}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r") as f:
+                    self.state = json.load(f)
+            except (OSError, ValueError):
+                self.state = {}
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _save_state(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".state.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _expected_sha256(self, session, name):
+        res = session.get(f"{self.base_url}/{name}.sha256sum", timeout=self.timeout)
+        res.raise_for_status()
+        digest = res.text.split()[0].strip().lower() if res.text.strip() else ""
+        if len(digest) != 64:
+            raise Exception(f"Malformed checksum for {name}: {res.text[:100]!r}")
+        return digest
+
+    def fetch(self, name):
+        # Returns True when the cached file changed
+        session = requests.Session()
+        cached = self.state.get(name, {})
+        headers = {}
+        if os.path.exists(self.path(name)):
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with session.get(f"{self.base_url}/{name}", headers=headers, stream=True, timeout=self.timeout) as res:
+            if res.status_code == 304:
+                return False
+            res.raise_for_status()
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=f".{name}.")
+            h = hashlib.sha256()
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in res.iter_content(1 << 20):
+                        h.update(chunk)
+                        f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                digest = h.hexdigest()
+                expected = self._expected_sha256(session, name)
+                if digest != expected:
+                    raise Exception(f"Checksum mismatch for {name}: got {digest}, release says {expected}")
+                os.replace(tmp_path, self.path(name))
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+
+        changed = digest != cached.get("sha256")
+        with self._lock:
+            self.state[name] = {
+                "etag": res.headers.get("ETag", ""),
+                "last_modified": res.headers.get("Last-Modified", ""),
+                "sha256": digest,
+            }
+            self._save_state()
+        return changed
+
+    def update(self):
+        # {name: changed}; raises the first download error after all downloads finish
+        with ThreadPoolExecutor(max_workers=len(self.files)) as pool:
+            futures = {name: pool.submit(self.fetch, name) for name in self.files}
+        return {name: future.result() for name, future in futures.items()}
+
+    def sha256(self, name):
+        return self.state.get(name, {}).get("sha256")
@@ -0,0 +1,222 @@
+import re
+import json
+import time
+import socket
+import subprocess
+from dataclasses import dataclass, field
+
+import psutil
+
+MIB = 1 << 20
+# quic-go refuses receive windows below this
+MIN_WINDOW = 16384
+# Hysteria's documented stream:connection window ratio
+STREAM_CONN_RATIO = 2 / 5
+
+@dataclass
+class TLSConfig:
+    cert: str = "/etc/hysteria/cert/server.crt"
+    key: str = "/etc/hysteria/cert/server.key"
+
+@dataclass
+class AuthConfig:
+    password: str = ""
+    # {username: password}; when set, per-user auth replaces the shared password
+    userpass: dict = field(default_factory=dict)
+
+@dataclass
+class TrafficStatsConfig:
+    listen: str = "127.0.0.1:25413"
+    secret: str = ""
+
+@dataclass
+class MasqueradeConfig:
+    target: str = "www.microsoft.com"
+    rewrite_host: bool = True
+
+@dataclass
+class BandwidthConfig:
+    up_mbps: int = 100
+    down_mbps: int = 100
+
+@dataclass
+class QUICConfig:
+    stream_window: int = 8 * MIB
+    conn_window: int = 20 * MIB
+    max_idle_timeout: str = "30s"
+    keep_alive_period: str = "10s"
+
+@dataclass
+class ObfsConfig:
+    password: str = ""
+
+@dataclass
+class HysteriaConfig:
+    port: int = 443
+    tls: TLSConfig = field(default_factory=TLSConfig)
+    auth: AuthConfig = field(default_factory=AuthConfig)
+    masquerade: MasqueradeConfig = field(default_factory=MasqueradeConfig)
+    bandwidth: BandwidthConfig = field(default_factory=BandwidthConfig)
+    quic: QUICConfig = field(default_factory=QUICConfig)
+    obfs: ObfsConfig = field(default_factory=ObfsConfig)
+    traffic_stats: TrafficStatsConfig = field(default_factory=TrafficStatsConfig)
+
+    def errors(self):
+        errors = []
+        if not 1 <= self.port <= 65535:
+            errors.append(f"port {self.port} is out of range")
+        if not self.auth.userpass and not self.auth.password:
+            errors.append("auth password is empty")
+        if any(not user or not password or ":" in user for user, password in self.auth.userpass.items()):
+            errors.append("userpass entries need a non-empty username without ':' and a password")
+        if self.traffic_stats.listen and not self.traffic_stats.secret:
+            errors.append("trafficStats API is enabled without a secret")
+        if not self.obfs.password:
+            errors.append("salamander obfs password is empty")
+        if not self.masquerade.target:
+            errors.append("masquerade target is empty")
+        if self.bandwidth.up_mbps <= 0 or self.bandwidth.down_mbps <= 0:
+            errors.append("bandwidth hints must be positive")
+        if self.quic.stream_window < MIN_WINDOW or self.quic.conn_window < MIN_WINDOW:
+            errors.append(f"QUIC receive windows must be at least {MIN_WINDOW} bytes")
+        if self.quic.stream_window > self.quic.conn_window:
+            errors.append("QUIC stream window is larger than the connection window")
+        return errors
+
+    def validate(self):
+        errors = self.errors()
+        if errors:
+            raise Exception(f"Invalid Hysteria2 config: {'; '.join(errors)}")
+        return self
+
+    def to_dict(self):
+        if self.auth.userpass:
+            auth = {"type": "userpass", "userpass": dict(sorted(self.auth.userpass.items()))}
+        else:
+            auth = {"type": "password", "password": self.auth.password}
+        config = {
+            "listen": f":{self.port}",
+            "tls": {"cert": self.tls.cert, "key": self.tls.key},
+            "auth": auth,
+            "masquerade": {
+                "type": "proxy",
+                "proxy": {"url": f"https://{self.masquerade.target}", "rewriteHost": self.masquerade.rewrite_host},
+            },
+            "bandwidth": {"up": f"{self.bandwidth.up_mbps} mbps", "down": f"{self.bandwidth.down_mbps} mbps"},
+            "quic": {
+                "initStreamReceiveWindow": self.quic.stream_window,
+                "maxStreamReceiveWindow": self.quic.stream_window,
+                "initConnReceiveWindow": self.quic.conn_window,
+                "maxConnReceiveWindow": self.quic.conn_window,
+                "maxIdleTimeout": self.quic.max_idle_timeout,
+                "keepAlivePeriod": self.quic.keep_alive_period,
+            },
+            "obfs": {"type": "salamander", "salamander": {"password": self.obfs.password}},
+        }
+        if self.traffic_stats.listen:
+            config["trafficStats"] = {"listen": self.traffic_stats.listen, "secret": self.traffic_stats.secret}
+        return config
+
+    def to_yaml(self):
+        return ("# Generated by vpn_manager.py from .env. Do not edit: changes are overwritten.\n"
+                "# Документация: https://v2.hysteria.network/docs/\n\n" + dump_yaml(self.validate().to_dict()))
+
+_PLAIN = re.compile(r"[A-Za-z0-9_/][A-Za-z0-9_./@+ -]*")
+_RESERVED = re.compile(r"(true|false|yes|no|on|off|null|~|[-+]?[0-9][0-9_.eE+-]*)", re.IGNORECASE)
+
+def _scalar(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    value = str(value)
+    if _PLAIN.fullmatch(value) and not _RESERVED.fullmatch(value) and not value.endswith(" "):
+        return value
+    # A JSON string is a valid YAML double-quoted scalar
+    return json.dumps(value)
+
+def dump_yaml(data, indent=0):
+    # Block-style YAML for nested dicts/lists of scalars, which is all the config needs
+    pad = " " * indent
+    lines = []
+    for key, value in data.items():
+        if isinstance(value, dict):
+            lines.append(f"{pad}{_scalar(key)}:")
+            lines.append(dump_yaml(value, indent + 2).rstrip("\n"))
+        elif isinstance(value, list):
+            lines.append(f"{pad}{_scalar(key)}:")
+            lines.extend(f"{pad}  - {_scalar(item)}" for item in value)
+        else:
+            lines.append(f"{pad}{_scalar(key)}: {_scalar(value)}")
+    return "\n".join(lines) + "\n"
+
+# --- Autotuning ---
+
+def default_interface():
+    # Interface of the IPv4 default route
+    try:
+        with open("/proc/net/route", "r") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 2 and fields[1] == "00000000":
+                    return fields[0]
+    except OSError:
+        pass
+    return None
+
+def link_capacity_mbps(iface=None):
+    # NIC speed as reported by the driver; 0 when unknown (common on virtio)
+    iface = iface or default_interface()
+    stats = psutil.net_if_stats().get(iface) if iface else None
+    return stats.speed if stats and stats.speed > 0 else 0
+
+_SS_RTT = re.compile(r"\brtt:([0-9.]+)/")
+
+def client_rtts_ms(port=443):
+    # Smoothed RTTs of established TCP connections to the VLESS port: the real client population
+    try:
+        res = subprocess.run(["ss", "-tin", "state", "established", f"( sport = :{port} )"],
+                             capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    return [float(m.group(1)) for m in _SS_RTT.finditer(res.stdout)]
+
+def probe_rtts_ms(targets, timeout=3):
+    # Fallback when there are no client connections to sample: TCP connect time to known hosts
+    rtts = []
+    for host, port in targets:
+        start = time.perf_counter()
+        try:
+            socket.create_connection((host, port), timeout=timeout).close()
+            rtts.append((time.perf_counter() - start) * 1000)
+        except OSError:
+            pass
+    return rtts
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def autotune(link_mbps, rtts_ms, share=0.9, rtt_pct=90, min_conn=4 * MIB, max_conn=64 * MIB):
+    # Bandwidth hints: `share` of the link. Windows: the bandwidth-delay product at the
+    # `rtt_pct` percentile RTT, so one client on a high-RTT route can still fill the link
+    rtt = percentile(rtts_ms, rtt_pct)
+    if not link_mbps or rtt is None:
+        return None
+    mbps = max(1, int(link_mbps * share))
+    bdp = mbps * 1_000_000 / 8 * rtt / 1000
+    conn = int(min(max(bdp, min_conn), max_conn))
+    conn = -(-conn // MIB) * MIB
+    stream = max(int(conn * STREAM_CONN_RATIO) // MIB * MIB, MIB)
+    return {"up_mbps": mbps, "down_mbps": mbps, "stream_window": stream, "conn_window": conn,
+            "rtt_ms": rtt, "samples": len(rtts_ms)}
+
+def material_change(current, tuned, threshold=0.2):
+    # True when any tuned value moved more than `threshold` relative to the current one
+    for key in ("up_mbps", "down_mbps", "stream_window", "conn_window"):
+        old, new = current.get(key), tuned[key]
+        if not old or abs(new - old) / old > threshold:
+            return True
+    return False
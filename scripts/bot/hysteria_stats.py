@@ -0,0 +1,79 @@
+import time
+import threading
+
+import requests
+
+class HysteriaStatsClient:
+    # Hysteria2's trafficStats HTTP API. One keep-alive session; every call is a single
+    # small JSON request, so polling every few seconds costs next to nothing.
+    def __init__(self, base_url, secret, timeout=5):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = secret
+
+    def _request(self, method, path, **kwargs):
+        res = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        if res.status_code != 200:
+            raise Exception(f"Hysteria stats API {path} returned {res.status_code}")
+        return res
+
+    def traffic(self, clear=False):
+        # {user: {"tx": bytes from the client, "rx": bytes to the client}}
+        return self._request("GET", "/traffic?clear=1" if clear else "/traffic").json()
+
+    def online(self):
+        # {user: number of connected client instances}
+        return self._request("GET", "/online").json()
+
+    def kick(self, users):
+        self._request("POST", "/kick", json=list(users))
+
+class HysteriaCollector:
+    # Polls the stats API with clear=1, so every poll returns only the traffic since the
+    # previous one, and records it as "hysteria" deltas next to the Xray counters. Users are
+    # keyed by their Hysteria username, which is the roster email in userpass mode.
+    def __init__(self, client, store, interval=5, aliases=None):
+        self.client = client
+        # Stats names -> roster names, e.g. the single "user" of password auth
+        self.aliases = aliases or {}
+        self.store = store
+        self.interval = interval
+        self.online = {}
+        self.last_error = None
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def collect_once(self):
+        traffic = self.client.traffic(clear=True)
+        now = time.time()
+        deltas = {self.aliases.get(user, user): (t.get("tx", 0), t.get("rx", 0)) for user, t in traffic.items()}
+        self.store.record_deltas("hysteria", "client", deltas, now)
+        self.online = {self.aliases.get(user, user): count for user, count in self.client.online().items()}
+        self.last_run = now
+        return deltas
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.collect_once()
+                self.last_error = None
+            except Exception as e:
+                # Polled every few seconds: only log when the failure changes
+                if str(e) != str(self.last_error):
+                    print(f"Hysteria collector error: {e}")
+                self.last_error = e
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="hysteria-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
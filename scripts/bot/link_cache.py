@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+import qrcode
+
+def link_key(link):
+    return hashlib.sha256(link.encode()).hexdigest()
+
+class LinkMediaCache:
+    # QR PNGs and Telegram file_ids keyed by the hash of the link they encode.
+    # A link string fully determines its QR image, so an entry can never be stale:
+    # rotated keys or a new port produce a new link and therefore a new key.
+    # Old entries are dropped on invalidate() or by the LRU bound.
+    def __init__(self, file_ids_path=None, max_images=1024):
+        self.file_ids_path = file_ids_path
+        self.max_images = max_images
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self._file_ids = {}
+        if file_ids_path and os.path.exists(file_ids_path):
+            try:
+                with open(file_ids_path, 'r') as f:
+                    self._file_ids = json.load(f)
+            except (OSError, ValueError):
+                self._file_ids = {}
+
+    def qr_png(self, link):
+        key = link_key(link)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+        bio = BytesIO()
+        qrcode.make(link).save(bio, format='PNG')
+        png = bio.getvalue()
+        with self._lock:
+            self._images[key] = png
+            while len(self._images) > self.max_images:
+                self._images.popitem(last=False)
+        return png
+
+    def file_id(self, link):
+        with self._lock:
+            return self._file_ids.get(link_key(link))
+
+    def remember_file_id(self, link, file_id):
+        with self._lock:
+            self._file_ids[link_key(link)] = file_id
+            self._save()
+
+    def forget_file_id(self, link):
+        with self._lock:
+            if self._file_ids.pop(link_key(link), None) is not None:
+                self._save()
+
+    def invalidate(self, keep_links=()):
+        # Drop everything not belonging to the current set of links
+        keep = {link_key(link) for link in keep_links}
+        with self._lock:
+            for key in [k for k in self._images if k not in keep]:
+                del self._images[key]
+            stale = [k for k in self._file_ids if k not in keep]
+            for key in stale:
+                del self._file_ids[key]
+            if stale:
+                self._save()
+
+    def _save(self):
+        if not self.file_ids_path:
+            return
+        os.makedirs(os.path.dirname(self.file_ids_path) or ".", exist_ok=True)
+        tmp_path = f"{self.file_ids_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._file_ids, f)
+        os.replace(tmp_path, self.file_ids_path)
@@ -0,0 +1,359 @@
+import os
+import re
+import json
+import time
+import heapq
+import random
+import tempfile
+import threading
+from operator import itemgetter
+from collections import deque
+
+# 2024/01/02 03:04:05.123456 from [tcp:]1.2.3.4:5678 accepted tcp:example.com:443 [in >> out] email: a@vpn
+ACCESS_RE = re.compile(
+    rb"^(\S+ \S+) from (?:tcp:|udp:)?\[?([0-9A-Fa-f.:]+?)\]?:\d+ (accepted|rejected) +(?:(?:tcp|udp):)?(\S+)(?: \[([^\]]*)\])?(?: email: (\S+))?")
+# Error-log lines that mean someone is probing the server rather than using it
+PROBE_RES = (
+    re.compile(rb"REALITY: processed invalid connection from \[?([0-9A-Fa-f.:]+?)\]?:\d+"),
+    re.compile(rb"from \[?([0-9A-Fa-f.:]+?)\]?:\d+ .*invalid request user id"),
+)
+CHUNK_SIZE = 1 << 20
+
+class LogTailer:
+    # Follows one log file across rotations, reading only bytes it has not seen. The
+    # (inode, offset) checkpoint is persisted so a restart resumes instead of rescanning.
+    # A rotated file is drained through the still-open descriptor before switching.
+    # Without a checkpoint the tailer starts at the current end of the file: lines already
+    # there carry no usable arrival time and would otherwise all count as "now".
+    def __init__(self, path, state_path=None):
+        self.path = path
+        self.state_path = state_path
+        self._f = None
+        self._partial = b""
+        self.inode = None
+        self.offset = 0
+        if state_path and os.path.exists(state_path):
+            try:
+                with open(state_path, "r") as f:
+                    state = json.load(f)
+                self.inode, self.offset = state["inode"], state["offset"]
+                return
+            except (OSError, ValueError, KeyError):
+                pass
+        try:
+            st = os.stat(path)
+            self.inode, self.offset = st.st_ino, st.st_size
+        except FileNotFoundError:
+            pass
+
+    def _open(self):
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        st = os.fstat(f.fileno())
+        if st.st_ino == self.inode and st.st_size >= self.offset:
+            f.seek(self.offset)
+        else:
+            self.inode, self.offset = st.st_ino, 0
+        self._f = f
+        self._partial = b""
+        return True
+
+    def _drain(self):
+        while True:
+            chunk = self._f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            data = self._partial + chunk
+            cut = data.rfind(b"\n") + 1
+            self._partial = data[cut:]
+            self.offset += len(chunk)
+            if cut:
+                yield data[:cut]
+
+    def read_chunks(self):
+        # Yields blocks of complete lines; a trailing partial line waits for the next call
+        if self._f is None and not self._open():
+            return
+        yield from self._drain()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self.inode:
+            self._f.close()
+            self._f = None
+            if self._open():
+                yield from self._drain()
+        elif st.st_size < self.offset:
+            # Truncated in place (copytruncate)
+            self._f.seek(0)
+            self.offset = 0
+            self._partial = b""
+            yield from self._drain()
+
+    def checkpoint(self):
+        # The offset excludes an unfinished last line, so it is re-read after a restart
+        if not self.state_path:
+            return
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"inode": self.inode, "offset": self.offset - len(self._partial)}, f)
+        os.replace(tmp_path, self.state_path)
+
+class SpaceSaving:
+    # Approximate top-k counter in O(capacity) memory. counts[key] may overestimate by at
+    # most errors[key]; counts - errors is a guaranteed lower bound. Eviction is batched:
+    # the table grows to 2x capacity and is then cut back to the largest `capacity` keys,
+    # so a stream of unique keys costs O(1) amortized per key instead of a min() scan.
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # Highest count ever evicted: an upper bound for any key not in the table
+        self.floor = 0
+
+    def add(self, key, n=1):
+        self.add_many({key: n})
+
+    def add_many(self, items):
+        counts, errors, floor = self.counts, self.errors, self.floor
+        for key, n in items.items():
+            if key in counts:
+                counts[key] += n
+            else:
+                counts[key] = floor + n
+                errors[key] = floor
+        if len(counts) > 2 * self.capacity:
+            self._trim()
+
+    def _trim(self):
+        keep = heapq.nlargest(self.capacity, self.counts.items(), key=itemgetter(1))
+        # Every evicted count is <= the smallest kept one
+        self.floor = max(self.floor, keep[-1][1])
+        self.counts = dict(keep)
+        self.errors = {key: self.errors[key] for key in self.counts}
+
+    def top(self, n=10):
+        return heapq.nlargest(n, self.counts.items(), key=itemgetter(1))
+
+    def lower_bound(self, key):
+        return self.counts.get(key, 0) - self.errors.get(key, 0)
+
+class RollingTopK:
+    # A ring of per-bucket SpaceSaving counters: memory stays bounded by
+    # buckets * capacity no matter how long the process runs
+    def __init__(self, capacity=1000, bucket_seconds=300, buckets=12):
+        self.capacity = capacity
+        self.bucket_seconds = bucket_seconds
+        self.ring = deque(maxlen=buckets)
+
+    def _bucket(self, now):
+        start = int(now) - int(now) % self.bucket_seconds
+        if not self.ring or self.ring[-1][0] != start:
+            self.ring.append((start, SpaceSaving(self.capacity)))
+        return self.ring[-1][1]
+
+    def add(self, key, n=1, now=None):
+        self._bucket(now or time.time()).add(key, n)
+
+    def add_many(self, counts, now=None):
+        self._bucket(now or time.time()).add_many(counts)
+
+    def window(self, seconds=None, now=None):
+        since = (now or time.time()) - (seconds or self.bucket_seconds * self.ring.maxlen)
+        merged, errors = {}, {}
+        for start, counter in self.ring:
+            if start + self.bucket_seconds <= since:
+                continue
+            for key, n in counter.counts.items():
+                merged[key] = merged.get(key, 0) + n
+                errors[key] = errors.get(key, 0) + counter.errors[key]
+        return merged, errors
+
+    def top(self, n=10, seconds=None, now=None):
+        merged, _ = self.window(seconds, now)
+        return sorted(merged.items(), key=lambda kv: kv[1], reverse=True)[:n]
+
+class LogAnalytics:
+    # Tails the Xray access and error logs, keeps rolling top-N counters per destination,
+    # source IP and user, and flags source IPs with too many rejected/probing connections.
+    # Ban candidates are appended to `ban_log` for the fail2ban "xray-abuse" jail.
+    def __init__(self, access_log, error_log=None, state_dir=None, ban_log=None, ban_threshold=30,
+                 ban_window=600, ban_cooldown=3600, capacity=2000, interval=10):
+        self.state_dir = state_dir
+        if state_dir:
+            os.makedirs(state_dir, exist_ok=True)
+        state = lambda name: os.path.join(state_dir, f"{name}.offset.json") if state_dir else None
+        self.access = LogTailer(access_log, state("access")) if access_log else None
+        self.error = LogTailer(error_log, state("error")) if error_log else None
+        self.ban_log = ban_log
+        self.ban_threshold = ban_threshold
+        self.ban_window = ban_window
+        self.ban_cooldown = ban_cooldown
+        self.interval = interval
+        self.destinations = RollingTopK(capacity)
+        self.sources = RollingTopK(capacity)
+        self.users = RollingTopK(capacity)
+        self.failures = RollingTopK(capacity, bucket_seconds=60, buckets=max(1, ban_window // 60))
+        self.banned = {}
+        self.lines = 0
+        self.bytes = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def process_access(self, block, now=None):
+        # Per-block tallies in plain dicts first: one counter update per distinct key, not per line
+        dests, srcs, users, fails = {}, {}, {}, {}
+        match = ACCESS_RE.match
+        lines = block.split(b"\n")
+        for line in lines:
+            m = match(line)
+            if not m:
+                continue
+            src = m.group(2)
+            srcs[src] = srcs.get(src, 0) + 1
+            if m.group(3) == b"rejected":
+                fails[src] = fails.get(src, 0) + 1
+                continue
+            target = m.group(4)
+            host = target[:target.rfind(b":")] if target.count(b":") == 1 else target
+            dests[host] = dests.get(host, 0) + 1
+            email = m.group(6)
+            if email:
+                users[email] = users.get(email, 0) + 1
+        self._record(now, dests, srcs, users, fails, len(lines) - 1, len(block))
+
+    def process_error(self, block, now=None):
+        fails = {}
+        for line in block.split(b"\n"):
+            if b"REALITY" not in line and b"invalid request" not in line:
+                continue
+            for pattern in PROBE_RES:
+                m = pattern.search(line)
+                if m:
+                    fails[m.group(1)] = fails.get(m.group(1), 0) + 1
+                    break
+        self._record(now, {}, {}, {}, fails, 0, 0)
+
+    def _record(self, now, dests, srcs, users, fails, lines, size):
+        now = now or time.time()
+        decode = lambda counts: {k.decode(errors="replace"): n for k, n in counts.items()}
+        with self._lock:
+            self.destinations.add_many(decode(dests), now)
+            self.sources.add_many(decode(srcs), now)
+            self.users.add_many(decode(users), now)
+            self.failures.add_many(decode(fails), now)
+            self.lines += lines
+            self.bytes += size
+
+    def ban_candidates(self, now=None):
+        # IPs whose guaranteed failure count in the window reaches the threshold
+        now = now or time.time()
+        with self._lock:
+            merged, errors = self.failures.window(self.ban_window, now)
+        return sorted(((ip, n - errors[ip]) for ip, n in merged.items() if n - errors[ip] >= self.ban_threshold),
+                      key=lambda item: item[1], reverse=True)
+
+    def publish_bans(self, now=None):
+        now = now or time.time()
+        new = [(ip, n) for ip, n in self.ban_candidates(now) if now - self.banned.get(ip, 0) > self.ban_cooldown]
+        if new and self.ban_log:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+            with open(self.ban_log, "a") as f:
+                for ip, n in new:
+                    f.write(f"{stamp} ban candidate {ip} failures={n}\n")
+        for ip, _ in new:
+            self.banned[ip] = now
+        return new
+
+    def poll(self):
+        for tailer, process in ((self.access, self.process_access), (self.error, self.process_error)):
+            if not tailer:
+                continue
+            for block in tailer.read_chunks():
+                process(block)
+            tailer.checkpoint()
+        return self.publish_bans()
+
+    def summary(self, n=10, seconds=3600):
+        with self._lock:
+            return {
+                "destinations": self.destinations.top(n, seconds),
+                "sources": self.sources.top(n, seconds),
+                "users": self.users.top(n, seconds),
+                "lines": self.lines,
+                "bytes": self.bytes,
+            }
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+                self.last_error = None
+            except Exception as e:
+                if str(e) != str(self.last_error):
+                    print(f"Log analytics error: {e}")
+                self.last_error = e
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="log-analytics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+def synthetic_access_log(path, lines, seed=1):
+    # Realistic mix: a few heavy destinations and users, a long tail, some rejected probes
+    rng = random.Random(seed)
+    hosts = [f"cdn{i}.example{i % 50}.com" for i in range(5000)]
+    heavy = ["www.google.com", "i.ytimg.com", "api.telegram.org", "graph.instagram.com"]
+    users = [f"user{i}@vpn" for i in range(200)]
+    with open(path, "w") as f:
+        for i in range(lines):
+            ip = f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            if i % 50 == 0:
+                f.write(f"2024/01/02 03:04:05.{i % 1000000:06d} from 45.13.7.{i % 8}:{40000 + i % 20000} rejected  proxy/vless/encoding: invalid request user id\n")
+                continue
+            host = rng.choice(heavy) if rng.random() < 0.4 else rng.choice(hosts)
+            f.write(f"2024/01/02 03:04:05.{i % 1000000:06d} from {ip}:{1024 + i % 60000} accepted tcp:{host}:443 "
+                    f"[VLESS-REALITY-AUTO >> direct] email: {rng.choice(users)}\n")
+
+def bench(lines=1_000_000):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access.log")
+        # The log appears after the tailer starts, as with a fresh Xray log, so it is read in full
+        analytics = LogAnalytics(path, state_dir=os.path.join(tmp, "state"), ban_log=os.path.join(tmp, "bans.log"))
+        synthetic_access_log(path, lines)
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        bans = analytics.poll()
+        elapsed = time.perf_counter() - start
+        # A second poll must find nothing new: the checkpoint prevents rescans
+        start = time.perf_counter()
+        analytics.poll()
+        idle = time.perf_counter() - start
+    return {
+        "lines": analytics.lines, "bytes": size, "seconds": elapsed,
+        "lines_per_s": analytics.lines / elapsed, "mb_per_s": size / elapsed / 1e6,
+        "gb_per_day_one_core": size / elapsed * 86400 / 1e9, "idle_poll_s": idle,
+        "ban_candidates": len(bans), "top_destinations": analytics.summary(5)["destinations"],
+    }
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Xray log analytics")
+    parser.add_argument("--bench", action="store_true", help="Process a synthetic access log and report throughput")
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    args = parser.parse_args()
+    if args.bench:
+        print(json.dumps(bench(args.lines), indent=2))
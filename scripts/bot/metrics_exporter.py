@@ -0,0 +1,230 @@
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import psutil
+
+import tracing
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+def family(lines, name, kind, help_text, samples):
+    # samples: [(labels dict or None, value)]; families without samples are omitted
+    if not samples:
+        return
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+class CachedSource:
+    # A read that costs a panel/Docker round trip, refreshed at most once per `ttl`. The lock
+    # is held during the fetch, so concurrent scrapes wait for one fetch instead of each doing it.
+    def __init__(self, fetch, ttl=15):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.value = None
+        self.error = None
+        self.fetched_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if time.monotonic() - self.fetched_at >= self.ttl:
+                try:
+                    self.value = self.fetch()
+                    self.error = None
+                except Exception as e:
+                    # Keep the last good value; the source's up metric reports the failure
+                    self.error = e
+                self.fetched_at = time.monotonic()
+            return self.value
+
+class MetricsExporter:
+    # Renders host, container, proxy and operation metrics in the Prometheus text format.
+    # Host counters come straight from psutil (cheap); panel and Docker reads go through
+    # CachedSource so any number of scrapers cost one read per `interval`.
+    def __init__(self, manager, host_sampler=None, hysteria_collector=None, warp_monitor=None, interval=15):
+        self.manager = manager
+        self.host_sampler = host_sampler
+        self.hysteria_collector = hysteria_collector
+        self.warp_monitor = warp_monitor
+        self.sources = {
+            "panel_inbounds": CachedSource(lambda: manager.xui.list_inbounds(), interval),
+            "panel_onlines": CachedSource(lambda: manager.xui.onlines() or [], interval),
+            "docker": CachedSource(self._container_stats, interval),
+        }
+
+    def _container_stats(self):
+        docker = self.manager.docker
+        result = []
+        for container in docker.containers():
+            name = container["Names"][0].lstrip("/")
+            stats = docker.stats(container["Id"]) if container.get("State") == "running" else None
+            result.append((name, container.get("State", ""), stats))
+        return result
+
+    def render(self):
+        start = time.perf_counter()
+        lines = []
+        self._host(lines)
+        self._containers(lines)
+        self._proxy(lines)
+        self._operations(lines)
+        family(lines, "vpn_exporter_source_up", "gauge", "Whether the last read of each cached source succeeded",
+               [({"source": name}, source.error is None and source.fetched_at > 0) for name, source in self.sources.items()])
+        family(lines, "vpn_exporter_render_seconds", "gauge", "Time spent rendering this scrape",
+               [(None, time.perf_counter() - start)])
+        return "\n".join(lines) + "\n"
+
+    def _host(self, lines):
+        cpu = psutil.cpu_times()
+        family(lines, "vpn_host_cpu_seconds_total", "counter", "Host CPU time by mode",
+               [({"mode": mode}, getattr(cpu, mode)) for mode in ("user", "system", "idle", "iowait", "steal") if hasattr(cpu, mode)])
+        if self.host_sampler:
+            # The sampler owns psutil.cpu_percent's interval; reading it here would reset it
+            sample = self.host_sampler.latest()
+            family(lines, "vpn_host_cpu_percent", "gauge", "Host CPU utilisation over the last sampler interval",
+                   [(None, sample["cpu"])])
+        family(lines, "vpn_host_load1", "gauge", "1-minute load average", [(None, psutil.getloadavg()[0])])
+        memory = psutil.virtual_memory()
+        family(lines, "vpn_host_memory_bytes", "gauge", "Host memory",
+               [({"state": "used"}, memory.used), ({"state": "available"}, memory.available), ({"state": "total"}, memory.total)])
+        disk = psutil.disk_usage(self.host_sampler.disk_path if self.host_sampler else "/")
+        family(lines, "vpn_host_disk_bytes", "gauge", "Root filesystem usage",
+               [({"state": "used"}, disk.used), ({"state": "free"}, disk.free), ({"state": "total"}, disk.total)])
+        nics = {name: c for name, c in psutil.net_io_counters(pernic=True).items() if name != "lo"}
+        family(lines, "vpn_host_network_bytes_total", "counter", "Bytes through each network interface",
+               [({"interface": name, "direction": "rx"}, c.bytes_recv) for name, c in nics.items()]
+               + [({"interface": name, "direction": "tx"}, c.bytes_sent) for name, c in nics.items()])
+        family(lines, "vpn_host_network_packets_dropped_total", "counter", "Dropped packets on each network interface",
+               [({"interface": name, "direction": "rx"}, c.dropin) for name, c in nics.items()]
+               + [({"interface": name, "direction": "tx"}, c.dropout) for name, c in nics.items()])
+
+    def _containers(self, lines):
+        containers = self.sources["docker"].get() or []
+        family(lines, "vpn_container_running", "gauge", "1 if the container is running",
+               [({"container": name}, state == "running") for name, state, _ in containers])
+        running = [(name, stats) for name, _, stats in containers if stats]
+        family(lines, "vpn_container_cpu_seconds_total", "counter", "CPU time used by the container",
+               [({"container": name}, s["cpu_stats"]["cpu_usage"]["total_usage"] / 1e9) for name, s in running])
+        family(lines, "vpn_container_memory_bytes", "gauge", "Memory used by the container (excluding page cache)",
+               [({"container": name}, _memory_used(s["memory_stats"])) for name, s in running if s.get("memory_stats", {}).get("usage")])
+        family(lines, "vpn_container_memory_limit_bytes", "gauge", "Memory limit of the container",
+               [({"container": name}, s["memory_stats"]["limit"]) for name, s in running if s.get("memory_stats", {}).get("limit")])
+        # Containers on the host network (3x-ui, hysteria2) have no network stats of their own
+        networks = [(name, s["networks"]) for name, s in running if s.get("networks")]
+        family(lines, "vpn_container_network_bytes_total", "counter", "Bytes through the container's networks",
+               [({"container": name, "direction": "rx"}, sum(n["rx_bytes"] for n in nets.values())) for name, nets in networks]
+               + [({"container": name, "direction": "tx"}, sum(n["tx_bytes"] for n in nets.values())) for name, nets in networks])
+
+    def _proxy(self, lines):
+        inbounds = self.sources["panel_inbounds"].get() or []
+        family(lines, "vpn_inbound_traffic_bytes_total", "counter", "3x-ui inbound traffic as counted by the panel",
+               [({"inbound": inb.get("remark") or inb.get("id"), "direction": d}, inb.get(d, 0)) for inb in inbounds for d in ("up", "down")])
+        clients = [stat for inb in inbounds for stat in inb.get("clientStats") or []]
+        family(lines, "vpn_client_traffic_bytes_total", "counter", "3x-ui client traffic as counted by the panel",
+               [({"client": stat.get("email"), "direction": d}, stat.get(d, 0)) for stat in clients for d in ("up", "down")])
+        family(lines, "vpn_client_enabled", "gauge", "1 if the client is enabled in the panel",
+               [({"client": stat.get("email")}, bool(stat.get("enable", True))) for stat in clients])
+
+        onlines = self.sources["panel_onlines"].get()
+        hysteria = self.hysteria_collector.online if self.hysteria_collector else {}
+        online = []
+        if onlines is not None:
+            online.append(({"protocol": "vless"}, len(onlines)))
+        if self.hysteria_collector and self.hysteria_collector.last_run:
+            online.append(({"protocol": "hysteria2"}, len(hysteria)))
+        family(lines, "vpn_online_users", "gauge", "Users with at least one live connection", online)
+        family(lines, "vpn_hysteria_connections", "gauge", "Connected Hysteria2 client instances per user",
+               [({"user": user}, count) for user, count in hysteria.items()])
+        if self.hysteria_collector:
+            family(lines, "vpn_hysteria_stats_up", "gauge", "Whether the last Hysteria2 stats API poll succeeded",
+                   [(None, self.hysteria_collector.last_error is None and self.hysteria_collector.last_run is not None)])
+
+        if self.warp_monitor:
+            summary = self.warp_monitor.summary()
+            family(lines, "vpn_warp_failed_over", "gauge", "1 while Warp routing rules are switched to the failover outbound",
+                   [(None, summary["failed_over"])])
+            last = summary["last"]
+            if last:
+                family(lines, "vpn_warp_up", "gauge", "Result of the last Warp SOCKS probe", [(None, last["ok"])])
+                if last["ok"]:
+                    family(lines, "vpn_warp_probe_seconds", "gauge", "Duration of the last Warp probe request",
+                           [(None, last["fetch_ms"] / 1000)])
+
+    def _operations(self, lines):
+        # Top-level manager operations (rotations, reconciles, backups...) from the tracing ring
+        last = {}
+        for record in tracing.tracer.records():
+            if record["depth"] == 0 and record["name"].startswith("manager."):
+                last[record["name"][len("manager."):]] = record
+        family(lines, "vpn_operation_last_duration_seconds", "gauge", "Duration of the most recent run of each operation",
+               [({"operation": name}, r["duration_ns"] / 1e9) for name, r in last.items()])
+        family(lines, "vpn_operation_last_timestamp_seconds", "gauge", "Start time of the most recent run of each operation",
+               [({"operation": name}, r["start"]) for name, r in last.items()])
+        family(lines, "vpn_operation_last_failed", "gauge", "1 if the most recent run of the operation raised",
+               [({"operation": name}, r["error"]) for name, r in last.items()])
+
+def _memory_used(memory):
+    # What `docker stats` shows: usage minus reclaimable page cache (cgroup v2 / v1 key)
+    stats = memory.get("stats", {})
+    return memory["usage"] - stats.get("inactive_file", stats.get("total_inactive_file", 0))
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "metrics"
+    sys_version = ""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        try:
+            body = self.server.exporter.render().encode()
+            code = 200
+        except Exception as e:
+            body = f"metrics rendering failed: {e}\n".encode()
+            code = 500
+        self.send_response(code)
+        self.send_header("Content-Type", CONTENT_TYPE if code == 200 else "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class MetricsServer:
+    # Serves /metrics from a background thread next to the bot
+    def __init__(self, exporter, host="127.0.0.1", port=9105):
+        self.exporter = exporter
+        self.httpd = ThreadingHTTPServer((host, int(port)), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.exporter = exporter
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -1,13 +1,21 @@
 import os
-import subprocess
+import html
+import threading
+import time
 import telebot
 from telebot import types
-import psutil
 from dotenv import load_dotenv
-import qrcode
-from io import BytesIO
-
 from vpn_manager import VPNManager
+from traffic_stats import TrafficStore, TrafficCollector, format_bytes
+from hysteria_stats import HysteriaCollector
+from system_stats import HostSampler
+from link_cache import LinkMediaCache
+from warp_health import WarpHealthMonitor
+from fleet import Fleet
+from subscription import SubscriptionServer
+from log_analytics import LogAnalytics
+import tracing
+from metrics_exporter import MetricsExporter, MetricsServer
 
 # Определяем пути относительно скрипта
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -23,32 +31,193 @@ if not TOKEN:
     print("Error: TG_BOT_TOKEN not found in .env")
     exit(1)
 
-bot = telebot.TeleBot(TOKEN)
+# Handlers run on a worker pool so a long backup or rotation doesn't freeze other commands
+bot = telebot.TeleBot(TOKEN, threaded=True, num_threads=int(os.getenv('BOT_THREADS', '8')))
 manager = VPNManager(PROJECT_DIR)
+host_sampler = HostSampler(interval=int(os.getenv('STATS_INTERVAL', '5')))
+link_cache = LinkMediaCache(os.path.join(PROJECT_DIR, 'data', 'tg_file_ids.json'))
+links_dirty = threading.Event()
+
+def on_env_change(key):
+    if key in manager.LINK_ENV_KEYS:
+        links_dirty.set()
+
+manager.env_listeners.append(on_env_change)
+traffic_store = TrafficStore(os.getenv('TRAFFIC_DB', os.path.join(PROJECT_DIR, 'data', 'traffic.db')))
+traffic_collector = TrafficCollector(manager, traffic_store, interval=int(os.getenv('TRAFFIC_INTERVAL', '60')))
+# Hysteria2 password auth reports its one shared login as "user". The stats client is attached
+# at startup: creating it may generate HYSTERIA_STATS_SECRET, and importing must not write .env.
+hysteria_collector = HysteriaCollector(None, traffic_store,
+                                       interval=int(os.getenv('HYSTERIA_STATS_INTERVAL', '5')),
+                                       aliases={'user': manager.DEFAULT_CLIENT_EMAIL})
+
+# Xray access/error log analytics; ban candidates go to the fail2ban xray-abuse jail
+log_paths = manager.xray_log_paths()
+log_analytics = LogAnalytics(log_paths['access'], log_paths['error'],
+                             state_dir=os.path.join(PROJECT_DIR, 'data', 'log_offsets'),
+                             ban_log=log_paths['bans'],
+                             ban_threshold=int(os.getenv('LOG_BAN_THRESHOLD', '30')),
+                             ban_window=int(os.getenv('LOG_BAN_WINDOW', '600')),
+                             interval=int(os.getenv('LOG_INTERVAL', '10'))) if manager.xray_logs_enabled else None
+
+# Optional subscription endpoint for client apps; served from the bot process when SUB_PORT is set
+subscription_server = SubscriptionServer(manager, host=os.getenv('SUB_HOST', '0.0.0.0'),
+                                         port=os.getenv('SUB_PORT')) if os.getenv('SUB_PORT') else None
 
 def is_authorized(message):
     return str(message.chat.id) == str(CHAT_ID)
 
+# Operations touching the same service are serialized; different services run in parallel
+operation_locks = {name: threading.Lock() for name in ('panel', 'hysteria', 'backup', 'compose')}
+
+def run_exclusive(message, resources, fn):
+    acquired = []
+    try:
+        for name in resources:
+            if not operation_locks[name].acquire(blocking=False):
+                bot.send_message(message.chat.id, "⏳ Похожая операция уже выполняется, дождитесь её завершения.")
+                return
+            acquired.append(operation_locks[name])
+        fn()
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
+
+def apply_warp_failover(active):
+    # Runs on the monitor thread: wait for any panel operation instead of skipping the switch
+    with operation_locks['panel']:
+        manager.set_warp_failover(active)
+    if CHAT_ID:
+        text = ("⚠️ Warp не отвечает — трафик правил Warp пущен напрямую." if active
+                else "✅ Warp снова работает — правила маршрутизации возвращены на Warp.")
+        bot.send_message(CHAT_ID, text)
+
+warp_monitor = WarpHealthMonitor(
+    host=os.getenv('WARP_SOCKS_HOST', '127.0.0.1'),
+    port=int(os.getenv('WARP_SOCKS_PORT', '1080')),
+    interval=int(os.getenv('WARP_CHECK_INTERVAL', '30')),
+    max_latency_ms=float(os.getenv('WARP_MAX_LATENCY_MS', '3000')),
+    fail_after=int(os.getenv('WARP_FAIL_AFTER', '3')),
+    recover_after=int(os.getenv('WARP_RECOVER_AFTER', '5')),
+    on_change=apply_warp_failover,
+    failed_over=manager.get_env('WARP_FAILOVER') == '1',
+)
+
+# Optional Prometheus endpoint (METRICS_PORT); panel and Docker are read at most once per METRICS_INTERVAL
+metrics_server = MetricsServer(
+    MetricsExporter(manager, host_sampler, hysteria_collector, warp_monitor, interval=int(os.getenv('METRICS_INTERVAL', '15'))),
+    host=os.getenv('METRICS_HOST', '127.0.0.1'), port=os.getenv('METRICS_PORT'),
+) if os.getenv('METRICS_PORT') else None
+
+def get_warp_status():
+    summary = warp_monitor.summary()
+    if not summary["checks"]:
+        return "🛰 Warp: ещё не проверялся"
+    last = summary["last"]
+    state = "🔴 обход (direct)" if summary["failed_over"] else "🟢 через Warp"
+    text = f"🛰 Warp: {state}"
+    if last["ok"]:
+        text += f"\n🔹 Handshake: {last['handshake_ms']:.0f} ms, запрос: {last['fetch_ms']:.0f} ms"
+    else:
+        text += f"\n🔹 Последняя проверка: ошибка ({html.escape(last['error'])})"
+    if summary["avg_ms"] is not None:
+        text += f"\n🔹 Среднее: {summary['avg_ms']:.0f} ms, успешных: {summary['success_rate'] * 100:.0f}%"
+    text += f"\n🔹 История: {warp_monitor.sparkline()}"
+    if summary["last_error"]:
+        text += f"\n⚠️ Не удалось переключить маршрутизацию: {html.escape(summary['last_error'])}"
+    return text
+
 def get_stats():
-    cpu = psutil.cpu_percent(interval=1)
-    ram = psutil.virtual_memory().percent
-    disk = psutil.disk_usage('/').percent
-    return f"📊 <b>Статус сервера:</b>\n\n🔹 CPU: {cpu}%\n🔹 RAM: {ram}%\n🔹 Disk: {disk}%"
+    sample = host_sampler.latest()
+    cpu_avg = host_sampler.average('cpu', window=60)
+    rx = format_bytes(sample['net_rx_rate'])
+    tx = format_bytes(sample['net_tx_rate'])
+    text = (f"📊 <b>Статус сервера:</b>\n\n🔹 CPU: {sample['cpu']:.1f}%"
+            + (f" (за минуту: {cpu_avg:.1f}%)" if cpu_avg is not None else "")
+            + f"\n🔹 RAM: {sample['ram']:.1f}%\n🔹 Disk: {sample['disk']:.1f}%"
+            + f"\n🔹 Сеть: ⬇️ {rx}/s ⬆️ {tx}/s"
+            + f"\n\n{get_warp_status()}")
+    return text
+
+def get_traffic_report():
+    lines = ["📈 <b>Топ за последний час:</b>\n"]
+    top = traffic_store.top(kind="client", window=3600, limit=10)
+    if not top:
+        lines.append("Нет данных (сборщик опрашивает панель раз в минуту).")
+    for name, up, down in top:
+        lines.append(f"🔹 {html.escape(name)}: ⬆️ {format_bytes(up)} ⬇️ {format_bytes(down)}")
+    totals = traffic_store.totals(kind="client")
+    if totals:
+        lines.append("\n📦 <b>Всего по пользователям:</b>\n")
+        for name, up, down in totals[:20]:
+            lines.append(f"🔹 {html.escape(name)}: {format_bytes(up + down)}")
+    online = get_online_users()
+    lines.append("\n🟢 <b>Сейчас онлайн:</b>\n" if online else "\n🟢 Сейчас онлайн: никого")
+    for name, protocols in sorted(online.items()):
+        lines.append(f"🔹 {html.escape(name)}: {', '.join(protocols)}")
+    if traffic_collector.last_error:
+        lines.append(f"\n⚠️ Ошибка сборщика: {html.escape(str(traffic_collector.last_error))}")
+    if hysteria_collector.last_error:
+        lines.append(f"⚠️ Статистика Hysteria2 недоступна: {html.escape(str(hysteria_collector.last_error))}")
+    if log_analytics:
+        lines.append(get_log_report())
+    return "\n".join(lines)
+
+def get_log_report():
+    summary = log_analytics.summary(5)
+    lines = ["\n🌐 <b>Популярные адреса за час:</b>\n" if summary['destinations'] else "\n🌐 Популярные адреса: нет данных"]
+    for host, count in summary['destinations']:
+        lines.append(f"🔹 {html.escape(host)}: {count}")
+    candidates = log_analytics.ban_candidates()[:5]
+    if candidates:
+        lines.append("\n🚫 <b>Подозрительные IP (отправлены в fail2ban):</b>\n")
+        for ip, failures in candidates:
+            lines.append(f"🔹 {ip}: {failures} отклонённых подключений")
+    if log_analytics.last_error:
+        lines.append(f"\n⚠️ Ошибка анализа логов: {html.escape(str(log_analytics.last_error))}")
+    return "\n".join(lines)
+
+def get_online_users():
+    # One view over both protocols: {email: ["VLESS", "Hysteria2 ×2"]}
+    online = {}
+    try:
+        for email in manager.xui.onlines() or []:
+            online.setdefault(email, []).append("VLESS")
+    except Exception as e:
+        print(f"Failed to fetch VLESS onlines: {e}")
+    for user, count in hysteria_collector.online.items():
+        online.setdefault(user, []).append("Hysteria2" + (f" ×{count}" if count > 1 else ""))
+    return online
 
 def get_main_keyboard():
     markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
     markup.add(
         types.KeyboardButton('📊 Статус'),
+        types.KeyboardButton('📈 Трафик'),
         types.KeyboardButton('🔗 Ссылки'),
         types.KeyboardButton('🔄 Рестарт VPN'),
         types.KeyboardButton('💾 Бекап'),
         types.KeyboardButton('♻️ Сбросить ключи'),
         types.KeyboardButton('⚙️ Изменить порт Hysteria2'),
         types.KeyboardButton('🛡 Изменить порт Панели'),
-        types.KeyboardButton('🌐 Обновить GeoData')
+        types.KeyboardButton('🌐 Обновить GeoData'),
+        types.KeyboardButton('🌍 Флот')
     )
     return markup
 
+def send_link_photo(chat_id, link, caption):
+    # Re-send an already uploaded QR by its Telegram file_id; upload (and remember) otherwise
+    file_id = link_cache.file_id(link)
+    if file_id:
+        try:
+            bot.send_photo(chat_id, file_id, caption=caption, parse_mode='HTML')
+            return
+        except Exception:
+            link_cache.forget_file_id(link)
+    msg = bot.send_photo(chat_id, link_cache.qr_png(link), caption=caption, parse_mode='HTML')
+    if msg.photo:
+        link_cache.remember_file_id(link, msg.photo[-1].file_id)
+
 def handle_show_links(message):
     bot.send_message(message.chat.id, "⏳ Генерирую ссылки и QR-коды...")
     try:
@@ -58,26 +227,25 @@ def handle_show_links(message):
             bot.send_message(message.chat.id, "❌ Ссылки не найдены.")
             return
 
+        if links_dirty.is_set():
+            links_dirty.clear()
+            link_cache.invalidate(keep_links=[item['link'] for item in links])
+
         for item in links:
             link = item['link']
             label = item['label']
             
             try:
-                qr = qrcode.make(link)
-                bio = BytesIO()
-                qr.save(bio, format='PNG')
-                bio.seek(0)
-                
-                bot.send_photo(
-                    message.chat.id, 
-                    bio, 
-                    caption=f"🚀 <b>{label}</b>\n\n<code>{link}</code>", 
-                    parse_mode='HTML'
-                )
+                send_link_photo(message.chat.id, link, f"🚀 <b>{label}</b>\n\n<code>{link}</code>")
             except Exception as e:
                 bot.send_message(message.chat.id, f"🔗 <b>{label}</b>:\n<code>{link}</code>", parse_mode='HTML')
                 print(f"QR Error: {e}")
 
+        if subscription_server:
+            urls = [f"🔹 {html.escape(c['email'])}: <code>{manager.subscription_url(c)}</code>"
+                    for c in manager.desired_clients() if c['enable']]
+            bot.send_message(message.chat.id, "📥 <b>Подписки</b> (обновляются в клиенте автоматически):\n\n" + "\n".join(urls), parse_mode='HTML')
+
     except Exception as e:
         bot.send_message(message.chat.id, f"❌ Ошибка: {e}")
 
@@ -89,33 +257,47 @@ def send_welcome(message):
         return
     bot.send_message(message.chat.id, "👋 Привет! Я твой VPN помощник.", reply_markup=get_main_keyboard())
 
+@bot.message_handler(commands=['kick'], func=lambda message: is_authorized(message))
+def kick_user(message):
+    users = message.text.split()[1:]
+    if not users:
+        bot.reply_to(message, "Использование: /kick email [email ...] — разорвать сессии Hysteria2 пользователя.")
+        return
+    if not manager.hysteria_userpass:
+        # With one shared password every session is the same Hysteria user: there is nobody to single out
+        bot.reply_to(message, "❌ /kick работает только с HYSTERIA_AUTH=userpass: при общем пароле сессии не привязаны к пользователям.")
+        return
+    try:
+        manager.kick_hysteria(users)
+        bot.reply_to(message, f"✅ Сессии Hysteria2 разорваны: {', '.join(users)}")
+    except Exception as e:
+        bot.reply_to(message, f"❌ Ошибка: {e}")
+
+@bot.message_handler(commands=['perf'], func=lambda message: is_authorized(message))
+def show_perf(message):
+    # /perf [минут] — p50/p95 по операциям из кольцевого буфера (по умолчанию за всё время работы бота)
+    args = message.text.split()[1:]
+    since = time.time() - int(args[0]) * 60 if args and args[0].isdigit() else None
+    stats = tracing.summarize(tracing.tracer.records(), since=since)
+    text = tracing.format_stats(stats, limit=20)
+    bot.send_message(message.chat.id, f"⏱ <b>Время операций</b>\n<pre>{html.escape(text)}</pre>", parse_mode='HTML')
+
 @bot.message_handler(func=lambda message: is_authorized(message), content_types=['text'])
 def handle_message(message):
     if message.text == '📊 Статус':
         bot.send_message(message.chat.id, get_stats(), parse_mode='HTML')
     
+    elif message.text == '📈 Трафик':
+        bot.send_message(message.chat.id, get_traffic_report(), parse_mode='HTML')
+
     elif message.text == '🔗 Ссылки':
         handle_show_links(message)
 
     elif message.text == '🔄 Рестарт VPN':
-        bot.send_message(message.chat.id, "🔄 Перезапускаю контейнеры...")
-        try:
-            subprocess.run(['docker', 'compose', '-f', os.path.join(PROJECT_DIR, 'docker-compose.yml'), 'restart'], check=True)
-            bot.send_message(message.chat.id, "✅ Контейнеры перезапущены!")
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка рестарта: {e}")
+        run_exclusive(message, ['compose', 'panel', 'hysteria'], lambda: restart_vpn(message))
 
     elif message.text == '♻️ Сбросить ключи':
-        bot.send_message(message.chat.id, "⚠️ <b>Внимание!</b> Все старые ссылки перестанут работать.\n⏳ Начинаю ротацию ключей...", parse_mode='HTML')
-        try:
-            manager.generate_keys()
-            manager.setup_inbound()
-            subprocess.run(['docker', 'compose', '-f', os.path.join(PROJECT_DIR, 'docker-compose.yml'), 'restart'], check=True)
-            
-            bot.send_message(message.chat.id, "✅ Ключи успешно сброшены! Вот ваши новые ссылки:")
-            handle_show_links(message)
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка при сбросе: {e}")
+        run_exclusive(message, ['panel', 'hysteria'], lambda: rotate_keys(message))
 
     elif message.text == '⚙️ Изменить порт Hysteria2':
         msg = bot.send_message(message.chat.id, "🔢 Введите новый UDP порт для Hysteria 2 (например, 39421):")
@@ -126,23 +308,126 @@ def handle_message(message):
         bot.register_next_step_handler(msg, process_xui_port_change)
 
     elif message.text == '🌐 Обновить GeoData':
-        bot.send_message(message.chat.id, "⏳ Обновляю GeoData для обхода блокировок...")
-        try:
-            manager.update_geodata()
-            bot.send_message(message.chat.id, "✅ GeoData обновлена и Xray перезапущен!")
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка при обновлении GeoData: {e}")
+        run_exclusive(message, ['panel'], lambda: update_geodata(message))
 
     elif message.text == '💾 Бекап':
-        bot.send_message(message.chat.id, "💾 Создаю бекап...")
-        try:
-            archive_path = manager.create_backup()
-            with open(archive_path, 'rb') as f:
-                bot.send_document(message.chat.id, f, caption="📦 Полный бекап VPN сервера (.tar.gz)")
-            # Cleanup sent backup to save space if needed
-            # os.remove(archive_path) 
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка бекапа: {e}")
+        run_exclusive(message, ['backup'], lambda: send_backup(message))
+
+    elif message.text == '🌍 Флот':
+        show_fleet_menu(message)
+
+FLEET_OPERATIONS = {
+    'update_geodata': '🌐 Обновить GeoData',
+    'rotate_keys': '♻️ Сбросить ключи',
+    'setup_inbound': '🔧 Применить конфиг',
+    'plan': '🔍 План изменений',
+    'create_backup': '💾 Бекап',
+}
+FLEET_ICONS = {'pending': '⏸', 'running': '⏳', 'ok': '✅', 'error': '❌'}
+
+def load_fleet(message):
+    # A broken fleet.json is reported to the chat instead of killing the handler
+    try:
+        return Fleet.load(manager.fleet_path, manager)
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Не удалось прочитать fleet.json: {e}")
+        return None
+
+def show_fleet_menu(message):
+    fleet = load_fleet(message)
+    if not fleet:
+        return
+    markup = types.InlineKeyboardMarkup(row_width=1)
+    for op, label in FLEET_OPERATIONS.items():
+        markup.add(types.InlineKeyboardButton(label, callback_data=f"fleet:{op}"))
+    text = f"🌍 Узлы: {', '.join(fleet.names())}"
+    if fleet.errors:
+        text += "\n⚠️ Пропущены записи fleet.json:\n" + "\n".join(fleet.errors)
+    bot.send_message(message.chat.id, text + "\nЧто выполнить на всех?", reply_markup=markup)
+
+def render_fleet_status(label, statuses):
+    lines = [f"🌍 <b>{label}</b>\n"]
+    for name, (status, result) in statuses.items():
+        line = f"{FLEET_ICONS[status]} {html.escape(name)}"
+        if result:
+            detail = result['output'].splitlines()[-1] if result['ok'] and result['output'] else result['error'] or ''
+            line += f" ({result['elapsed']:.1f}s) {html.escape(detail)}"
+        lines.append(line)
+    return "\n".join(lines)
+
+def run_fleet_operation(message, op):
+    # One status message per run, edited in place as nodes report progress
+    fleet = load_fleet(message)
+    if not fleet:
+        return
+    label = FLEET_OPERATIONS[op]
+    statuses = {name: ('pending', None) for name in fleet.names()}
+    status_msg = bot.send_message(message.chat.id, render_fleet_status(label, statuses), parse_mode='HTML')
+    edit_lock = threading.Lock()
+
+    def progress(name, status, result):
+        with edit_lock:
+            statuses[name] = (status, result)
+            try:
+                bot.edit_message_text(render_fleet_status(label, statuses), message.chat.id, status_msg.message_id, parse_mode='HTML')
+            except Exception as e:
+                print(f"Fleet progress update failed: {e}")
+
+    results = fleet.run(op, progress=progress)
+    ok = sum(1 for r in results if r['ok'])
+    bot.send_message(message.chat.id, f"{'✅' if ok == len(results) else '⚠️'} {label}: успешно на {ok} из {len(results)} узлов.")
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('fleet:') and is_authorized(call.message))
+def handle_fleet_callback(call):
+    op = call.data.split(':', 1)[1]
+    bot.answer_callback_query(call.id)
+    if op in FLEET_OPERATIONS:
+        run_exclusive(call.message, ['panel', 'hysteria', 'backup'], lambda: run_fleet_operation(call.message, op))
+
+def restart_vpn(message):
+    bot.send_message(message.chat.id, "🔄 Перезапускаю контейнеры...")
+    try:
+        start = time.monotonic()
+        results = manager.restart_services()
+        failed = {name: error for name, error in results.items() if error}
+        if failed:
+            bot.send_message(message.chat.id, "⚠️ Не все контейнеры перезапущены:\n" + "\n".join(f"🔹 {name}: {error}" for name, error in failed.items()))
+        else:
+            bot.send_message(message.chat.id, f"✅ Контейнеры перезапущены за {time.monotonic() - start:.1f}с: {', '.join(sorted(results))}")
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка рестарта: {e}")
+
+def rotate_keys(message):
+    bot.send_message(message.chat.id, "⚠️ <b>Внимание!</b> Все старые ссылки перестанут работать.\n⏳ Начинаю ротацию ключей...", parse_mode='HTML')
+    try:
+        manager.rotate_keys()
+        
+        bot.send_message(message.chat.id, "✅ Ключи успешно сброшены! Вот ваши новые ссылки:")
+        handle_show_links(message)
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка при сбросе: {e}")
+
+def update_geodata(message):
+    bot.send_message(message.chat.id, "⏳ Обновляю GeoData для обхода блокировок...")
+    try:
+        updated = manager.update_geodata()
+        if updated:
+            bot.send_message(message.chat.id, f"✅ GeoData обновлена ({', '.join(updated)}), Xray перезапущен!")
+        else:
+            bot.send_message(message.chat.id, "✅ GeoData уже актуальна, перезапуск не нужен.")
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка при обновлении GeoData: {e}")
+
+def send_backup(message):
+    bot.send_message(message.chat.id, "💾 Создаю бекап...")
+    try:
+        archive_path = manager.create_backup()
+        with open(archive_path, 'rb') as f:
+            bot.send_document(message.chat.id, f, caption=f"📦 Полный бекап VPN сервера ({os.path.basename(archive_path)})")
+        # Cleanup sent backup to save space if needed
+        # os.remove(archive_path) 
+    except Exception as e:
+        bot.send_message(message.chat.id, f"❌ Ошибка бекапа: {e}")
 
 def process_port_change(message):
     if not is_authorized(message): return
@@ -152,13 +437,15 @@ def process_port_change(message):
         bot.send_message(message.chat.id, "❌ Ошибка: введите корректное число (1-65535)")
         return
     
-    bot.send_message(message.chat.id, f"⏳ Меняю порт Hysteria2 на {new_port}...")
-    try:
-        manager.change_port(new_port)
-        bot.send_message(message.chat.id, f"✅ Порт изменен на {new_port}! Вот ваши новые ссылки:")
-        handle_show_links(message)
-    except Exception as e:
-        bot.send_message(message.chat.id, f"❌ Ошибка при смене порта: {e}")
+    def change():
+        bot.send_message(message.chat.id, f"⏳ Меняю порт Hysteria2 на {new_port}...")
+        try:
+            manager.change_port(new_port)
+            bot.send_message(message.chat.id, f"✅ Порт изменен на {new_port}! Вот ваши новые ссылки:")
+            handle_show_links(message)
+        except Exception as e:
+            bot.send_message(message.chat.id, f"❌ Ошибка при смене порта: {e}")
+    run_exclusive(message, ['hysteria'], change)
 
 def process_xui_port_change(message):
     if not is_authorized(message): return
@@ -168,33 +455,38 @@ def process_xui_port_change(message):
         bot.send_message(message.chat.id, "❌ Ошибка: введите корректное число (1024-65535)")
         return
     
-    bot.send_message(message.chat.id, f"⏳ Меняю порт Панели на {new_port}...")
+    def change():
+        bot.send_message(message.chat.id, f"⏳ Меняю порт Панели на {new_port}...")
+        try:
+            manager.change_xui_port(new_port)
+            bot.send_message(message.chat.id, f"✅ Порт Панели изменен на {new_port}! Старый порт больше недоступен.")
+        except Exception as e:
+            bot.send_message(message.chat.id, f"❌ Ошибка при смене порта Панели: {e}")
+    run_exclusive(message, ['panel'], change)
+
+def restore_from_document(message):
+    bot.send_message(message.chat.id, "⏳ Обнаружен архив бэкапа. Начинаю восстановление...")
     try:
-        manager.change_xui_port(new_port)
-        bot.send_message(message.chat.id, f"✅ Порт Панели изменен на {new_port}! Старый порт больше недоступен.")
+        file_info = bot.get_file(message.document.file_id)
+        downloaded_file = bot.download_file(file_info.file_path)
+        
+        temp_path = f"/tmp/{message.document.file_name}"
+        with open(temp_path, 'wb') as new_file:
+            new_file.write(downloaded_file)
+        
+        manager.restore_backup(temp_path)
+        os.remove(temp_path)
+        
+        bot.send_message(message.chat.id, "✅ Восстановление успешно завершено! Контейнеры запущены.")
     except Exception as e:
-        bot.send_message(message.chat.id, f"❌ Ошибка при смене порта Панели: {e}")
+        bot.send_message(message.chat.id, f"❌ Ошибка при восстановлении: {e}")
 
 @bot.message_handler(func=lambda message: is_authorized(message), content_types=['document'])
 def handle_document_restore(message):
-    if message.document.file_name.endswith('.tar.gz') and 'VPN-backup' in message.document.file_name:
-        bot.send_message(message.chat.id, "⏳ Обнаружен архив бэкапа. Начинаю восстановление...")
-        try:
-            file_info = bot.get_file(message.document.file_id)
-            downloaded_file = bot.download_file(file_info.file_path)
-            
-            temp_path = f"/tmp/{message.document.file_name}"
-            with open(temp_path, 'wb') as new_file:
-                new_file.write(downloaded_file)
-            
-            manager.restore_backup(temp_path)
-            os.remove(temp_path)
-            
-            bot.send_message(message.chat.id, "✅ Восстановление успешно завершено! Контейнеры запущены.")
-        except Exception as e:
-            bot.send_message(message.chat.id, f"❌ Ошибка при восстановлении: {e}")
+    if message.document.file_name.endswith(('.tar.gz', '.tar.zst')) and 'VPN-backup' in message.document.file_name:
+        run_exclusive(message, ['backup', 'compose', 'panel', 'hysteria'], lambda: restore_from_document(message))
     else:
-        bot.send_message(message.chat.id, "⚠️ Документ не похож на бэкап VPN (ожидается VPN-backup...tar.gz).")
+        bot.send_message(message.chat.id, "⚠️ Документ не похож на бэкап VPN (ожидается VPN-backup...tar.gz или .tar.zst).")
 
 @bot.message_handler(func=lambda message: True)
 def handle_unauthorized(message):
@@ -205,4 +497,21 @@ if __name__ == "__main__":
     print("Bot started...")
     # Очищаем вебхук, если он был установлен ранее (решает ошибку 409 Conflict)
     bot.remove_webhook()
+    host_sampler.start()
+    try:
+        # Older deployments render config.yaml without the trafficStats API the collector needs
+        manager.apply_hysteria_config()
+    except Exception as e:
+        print(f"Failed to apply Hysteria2 config: {e}")
+    traffic_collector.start()
+    hysteria_collector.client = manager.hysteria_stats()
+    hysteria_collector.start()
+    warp_monitor.start()
+    if log_analytics:
+        log_analytics.start()
+    if subscription_server:
+        manager.open_subscription_port()
+        subscription_server.start()
+    if metrics_server:
+        metrics_server.start()
     bot.polling(none_stop=True)
@@ -0,0 +1,179 @@
+import os
+import json
+import ipaddress
+
+# Rules we generate carry this ruleTag prefix, so they can be found and replaced later.
+# Xray ignores ruleTag for matching.
+RULE_TAG_PREFIX = "policy:"
+# Outbounds whose untagged rules were written by older versions of setup_inbound
+LEGACY_MANAGED_OUTBOUNDS = ("warp",)
+
+DOMAIN_PREFIXES = ("domain:", "full:", "keyword:", "regexp:")
+
+DEFAULT_POLICY = {
+    "rule_sets": [
+        {
+            "name": "warp-services",
+            "outbound": "warp",
+            "priority": 100,
+            "geosite": ["openai", "netflix", "disney", "primevideo", "twitter", "instagram", "meta"],
+            "domain": ["chatgpt.com", "antigravity.com"],
+            "geoip": [],
+            "ip": [],
+        }
+    ]
+}
+
+def is_managed_rule(rule):
+    tag = rule.get("ruleTag") or ""
+    if tag.startswith(RULE_TAG_PREFIX):
+        return True
+    return not tag and rule.get("outboundTag") in LEGACY_MANAGED_OUTBOUNDS
+
+def classify_entry(entry):
+    # Maps a user-supplied entry to (field, normalized value)
+    entry = entry.strip()
+    lower = entry.lower()
+    if lower.startswith("geosite:"):
+        return "geosite", lower[len("geosite:"):]
+    if lower.startswith("geoip:"):
+        return "geoip", lower[len("geoip:"):]
+    if lower.startswith("regexp:"):
+        return "domain", entry  # regexps are case-sensitive as written
+    if lower.startswith(DOMAIN_PREFIXES):
+        return "domain", lower
+    try:
+        return "ip", str(ipaddress.ip_network(entry, strict=False))
+    except ValueError:
+        return "domain", f"domain:{lower.lstrip('.')}"
+
+def _parents(domain):
+    parts = domain.split(".")
+    return [".".join(parts[i:]) for i in range(1, len(parts))]
+
+class RoutingPolicy:
+    # Named rule sets (domain / geosite / geoip / IP CIDR) routed to an outbound. compile()
+    # turns them into an ordered, deduplicated list of Xray routing rules: entries shadowed
+    # by a broader entry, or by a higher-priority set that matches first, are dropped.
+    def __init__(self, path, data=None):
+        self.path = path
+        self.data = data if data is not None else self._load()
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                return json.load(f)
+        return json.loads(json.dumps(DEFAULT_POLICY))
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        os.replace(tmp_path, self.path)
+
+    @property
+    def rule_sets(self):
+        return sorted(self.data.get("rule_sets", []), key=lambda rs: (rs.get("priority", 100), rs["name"]))
+
+    def outbounds(self):
+        return sorted({rs["outbound"] for rs in self.rule_sets if rs.get("enabled", True)})
+
+    def _rule_set(self, name, outbound=None):
+        for rs in self.data.setdefault("rule_sets", []):
+            if rs["name"] == name:
+                return rs
+        if outbound is None:
+            raise Exception(f"Unknown rule set {name!r}; pass an outbound to create it")
+        rs = {"name": name, "outbound": outbound, "priority": 100, "geosite": [], "domain": [], "geoip": [], "ip": []}
+        self.data["rule_sets"].append(rs)
+        return rs
+
+    def add_entries(self, name, entries, outbound=None):
+        rs = self._rule_set(name, outbound)
+        added = []
+        for entry in entries:
+            field, value = classify_entry(entry)
+            stored = value[len("domain:"):] if field == "domain" and value.startswith("domain:") else value
+            values = rs.setdefault(field, [])
+            if stored not in values:
+                values.append(stored)
+                added.append(f"{field}:{stored}")
+        return added
+
+    def remove_entries(self, name, entries):
+        rs = self._rule_set(name)
+        removed = []
+        for entry in entries:
+            field, value = classify_entry(entry)
+            stored = value[len("domain:"):] if field == "domain" and value.startswith("domain:") else value
+            if stored in rs.get(field, []):
+                rs[field].remove(stored)
+                removed.append(f"{field}:{stored}")
+        return removed
+
+    def compile(self, outbound_overrides=None):
+        # outbound_overrides {tag: tag} reroutes whole rule sets (e.g. warp -> direct on failover)
+        # without changing their ruleTags, so a switch is an in-place rule update
+        outbound_overrides = outbound_overrides or {}
+        rules = []
+        stats = {"input": 0, "output": 0}
+        # Everything earlier sets already match; Xray takes the first matching rule
+        seen_domains, seen_full, seen_other = set(), set(), set()
+        seen_geosite, seen_geoip = set(), set()
+        seen_nets = []
+
+        for rs in self.rule_sets:
+            if not rs.get("enabled", True):
+                continue
+            entries = [classify_entry(f"geosite:{g}") for g in rs.get("geosite", [])]
+            entries += [classify_entry(d if d.lower().startswith(DOMAIN_PREFIXES) else f"domain:{d}") for d in rs.get("domain", [])]
+            entries += [classify_entry(f"geoip:{g}") for g in rs.get("geoip", [])]
+            entries += [("ip", str(ipaddress.ip_network(n, strict=False))) for n in rs.get("ip", [])]
+            stats["input"] += len(entries)
+
+            domains = {}
+            full, other, geosite, geoip, nets = [], [], [], [], []
+            for field, value in entries:
+                if field == "geosite":
+                    if value not in seen_geosite and value not in geosite:
+                        geosite.append(value)
+                elif field == "geoip":
+                    if value not in seen_geoip and value not in geoip:
+                        geoip.append(value)
+                elif field == "ip":
+                    nets.append(ipaddress.ip_network(value))
+                elif value.startswith("domain:"):
+                    domains[value[len("domain:"):]] = True
+                elif value.startswith("full:"):
+                    full.append(value[len("full:"):])
+                elif value not in seen_other and value not in other:
+                    other.append(value)
+
+            # domain:example.com already covers every subdomain
+            all_domains = seen_domains | set(domains)
+            kept_domains = sorted(d for d in domains if d not in seen_domains and not any(p in all_domains for p in _parents(d)))
+            kept_full = sorted({f for f in full if f not in seen_full and f not in all_domains and not any(p in all_domains for p in _parents(f))})
+            kept_nets = [n for n in ipaddress.collapse_addresses([n for n in nets if n.version == 4])]
+            kept_nets += [n for n in ipaddress.collapse_addresses([n for n in nets if n.version == 6])]
+            kept_nets = [n for n in kept_nets if not any(n.version == s.version and n.subnet_of(s) for s in seen_nets)]
+
+            seen_domains.update(kept_domains)
+            seen_full.update(kept_full)
+            seen_other.update(other)
+            seen_geosite.update(geosite)
+            seen_geoip.update(geoip)
+            seen_nets.extend(kept_nets)
+
+            outbound = outbound_overrides.get(rs["outbound"], rs["outbound"])
+            # Conditions inside one Xray rule are ANDed, so domains and IPs need separate rules
+            domain_list = [f"geosite:{g}" for g in geosite] + [f"domain:{d}" for d in kept_domains] + [f"full:{f}" for f in kept_full] + other
+            if domain_list:
+                rules.append({"type": "field", "ruleTag": f"{RULE_TAG_PREFIX}{rs['name']}",
+                              "outboundTag": outbound, "domain": domain_list})
+            ip_list = [f"geoip:{g}" for g in geoip] + [str(n) for n in kept_nets]
+            if ip_list:
+                rules.append({"type": "field", "ruleTag": f"{RULE_TAG_PREFIX}{rs['name']}:ip",
+                              "outboundTag": outbound, "ip": ip_list})
+            stats["output"] += len(domain_list) + len(ip_list)
+        return rules, stats
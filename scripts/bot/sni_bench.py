@@ -0,0 +1,107 @@
+import ssl
+import time
+import socket
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_CANDIDATES = (
+    "www.microsoft.com", "www.samsung.com", "dl.google.com", "www.apple.com", "itunes.apple.com",
+    "www.amazon.com", "www.nvidia.com", "www.cloudflare.com", "addons.mozilla.org", "www.yahoo.com",
+)
+
+def _tls_context(cafile=None):
+    # REALITY needs a TLS 1.3 dest that negotiates X25519; offering only X25519 makes the
+    # handshake fail outright on targets that lack it
+    ctx = ssl.create_default_context(cafile=cafile)
+    ctx.minimum_version = ssl.TLSVersion.TLSv1_3
+    ctx.set_ecdh_curve("X25519")
+    ctx.set_alpn_protocols(["h2", "http/1.1"])
+    return ctx
+
+def _cert_names(cert):
+    return [value.lower() for kind, value in cert.get("subjectAltName", ()) if kind == "DNS"]
+
+def cert_covers(names, host):
+    host = host.lower()
+    for name in names:
+        if name == host:
+            return True
+        if name.startswith("*.") and host.count(".") == name.count(".") and host.endswith(name[1:]):
+            return True
+    return False
+
+def probe_once(host, port=443, address=None, timeout=5, cafile=None):
+    # address: (ip, port) to dial instead of resolving host, e.g. a local stand-in
+    result = {"connect_ms": None, "tls_ms": None, "version": None, "alpn": None, "names": [], "error": None}
+    start = time.perf_counter()
+    try:
+        sock = socket.create_connection(address or (host, port), timeout=timeout)
+    except OSError as e:
+        result["error"] = f"connect: {e}"
+        return result
+    connected = time.perf_counter()
+    result["connect_ms"] = (connected - start) * 1000
+    try:
+        with _tls_context(cafile).wrap_socket(sock, server_hostname=host) as tls:
+            result["tls_ms"] = (time.perf_counter() - connected) * 1000
+            result["version"] = tls.version()
+            result["alpn"] = tls.selected_alpn_protocol()
+            result["names"] = _cert_names(tls.getpeercert() or {})
+    except ssl.SSLCertVerificationError as e:
+        result["error"] = f"certificate: {e.verify_message}"
+    except (ssl.SSLError, OSError) as e:
+        # With only X25519 offered, a handshake failure usually means the group is unsupported
+        result["error"] = f"tls: {e}"
+    finally:
+        sock.close()
+    return result
+
+def probe_target(host, port=443, attempts=3, address=None, timeout=5, cafile=None):
+    samples = [probe_once(host, port, address, timeout, cafile) for _ in range(attempts)]
+    good = [s for s in samples if s["tls_ms"] is not None]
+    summary = {"host": host, "port": port, "attempts": attempts, "ok": len(good)}
+    if not good:
+        summary.update({"valid": False, "error": samples[-1]["error"]})
+        return summary
+    last = good[-1]
+    summary.update({
+        "connect_ms": statistics.median(s["connect_ms"] for s in good),
+        "tls_ms": statistics.median(s["tls_ms"] for s in good),
+        "total_ms": statistics.median(s["connect_ms"] + s["tls_ms"] for s in good),
+        "jitter_ms": max(s["connect_ms"] + s["tls_ms"] for s in good) - min(s["connect_ms"] + s["tls_ms"] for s in good),
+        "tls13": last["version"] == "TLSv1.3",
+        "x25519": True,
+        "h2": last["alpn"] == "h2",
+        "names": last["names"],
+        "error": None if len(good) == attempts else samples[-1]["error"],
+    })
+    summary["valid"] = summary["tls13"] and summary["h2"] and len(good) == attempts
+    return summary
+
+def benchmark(candidates, port=443, attempts=3, concurrency=16, addresses=None, timeout=5, cafile=None):
+    # Probes all candidates at once and returns them fastest-valid first
+    addresses = addresses or {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(candidates)))) as pool:
+        results = list(pool.map(lambda host: probe_target(host, port, attempts, addresses.get(host), timeout, cafile), candidates))
+    return sorted(results, key=lambda r: (not r["valid"], r.get("total_ms") or float("inf")))
+
+def pick_server_names(ranking, limit=4):
+    # The fastest valid target becomes dest; other valid candidates its certificate
+    # also covers can be offered as extra serverNames
+    valid = [r for r in ranking if r["valid"]]
+    if not valid:
+        return None, []
+    dest = valid[0]
+    extra = [r["host"] for r in valid[1:] if cert_covers(dest["names"], r["host"])]
+    return dest["host"], extra[:max(0, limit - 1)]
+
+def format_ranking(ranking):
+    lines = [f"{'host':<28} {'connect':>8} {'tls':>8} {'total':>8} {'jitter':>7}  tls1.3 x25519 h2"]
+    for r in ranking:
+        if r["ok"] == 0:
+            lines.append(f"{r['host']:<28} {'-':>8} {'-':>8} {'-':>8} {'-':>7}  {r['error']}")
+            continue
+        flags = "  ".join("yes" if r[key] else "no " for key in ("tls13", "x25519", "h2"))
+        mark = "" if r["valid"] else "  (not usable)"
+        lines.append(f"{r['host']:<28} {r['connect_ms']:>6.1f}ms {r['tls_ms']:>6.1f}ms {r['total_ms']:>6.1f}ms {r['jitter_ms']:>5.1f}ms  {flags}{mark}")
+    return "\n".join(lines)
@@ -0,0 +1,259 @@
+import gzip
+import json
+import time
+import base64
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FORMATS = ("base64", "singbox", "clash")
+CONTENT_TYPES = {
+    "base64": "text/plain; charset=utf-8",
+    "singbox": "application/json; charset=utf-8",
+    # Clash/mihomo read YAML; JSON is valid YAML, so no emitter is needed
+    "clash": "text/yaml; charset=utf-8",
+}
+
+def parse_link(link):
+    parts = urlsplit(link)
+    query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+    return {
+        "scheme": parts.scheme,
+        # Hysteria2 userpass links carry "user:pass", which is the whole auth string
+        "user": unquote(parts.username or "") + (f":{unquote(parts.password)}" if parts.password else ""),
+        "host": parts.hostname,
+        "port": parts.port or 443,
+        "query": query,
+        "name": unquote(parts.fragment),
+    }
+
+def singbox_outbound(link):
+    p = parse_link(link)
+    q = p["query"]
+    if p["scheme"] == "vless":
+        return {
+            "type": "vless", "tag": p["name"], "server": p["host"], "server_port": p["port"],
+            "uuid": p["user"], "flow": q.get("flow", ""),
+            "tls": {
+                "enabled": True, "server_name": q.get("sni", ""),
+                "utls": {"enabled": True, "fingerprint": q.get("fp", "chrome")},
+                "reality": {"enabled": True, "public_key": q.get("pbk", ""), "short_id": q.get("sid", "")},
+            },
+        }
+    if p["scheme"] == "hysteria2":
+        outbound = {
+            "type": "hysteria2", "tag": p["name"], "server": p["host"], "server_port": p["port"],
+            "password": p["user"],
+            "tls": {"enabled": True, "server_name": q.get("sni", ""), "insecure": q.get("insecure") == "1"},
+        }
+        if q.get("obfs"):
+            outbound["obfs"] = {"type": q["obfs"], "password": q.get("obfs-password", "")}
+        return outbound
+    raise Exception(f"Unsupported link scheme {p['scheme']!r}")
+
+def clash_proxy(link):
+    p = parse_link(link)
+    q = p["query"]
+    if p["scheme"] == "vless":
+        return {
+            "name": p["name"], "type": "vless", "server": p["host"], "port": p["port"], "uuid": p["user"],
+            "network": q.get("type", "tcp"), "tls": True, "udp": True, "flow": q.get("flow", ""),
+            "servername": q.get("sni", ""), "client-fingerprint": q.get("fp", "chrome"),
+            "reality-opts": {"public-key": q.get("pbk", ""), "short-id": q.get("sid", "")},
+        }
+    if p["scheme"] == "hysteria2":
+        proxy = {
+            "name": p["name"], "type": "hysteria2", "server": p["host"], "port": p["port"],
+            "password": p["user"], "sni": q.get("sni", ""), "skip-cert-verify": q.get("insecure") == "1",
+        }
+        if q.get("obfs"):
+            proxy["obfs"] = q["obfs"]
+            proxy["obfs-password"] = q.get("obfs-password", "")
+        return proxy
+    raise Exception(f"Unsupported link scheme {p['scheme']!r}")
+
+def render(fmt, links):
+    if fmt == "base64":
+        return base64.b64encode("\n".join(links).encode())
+    if fmt == "singbox":
+        outbounds = [singbox_outbound(link) for link in links]
+        tags = [o["tag"] for o in outbounds]
+        config = {
+            "outbounds": [{"type": "selector", "tag": "proxy", "outbounds": tags, "default": tags[0]}] + outbounds
+                         + [{"type": "direct", "tag": "direct"}],
+            "route": {"final": "proxy", "auto_detect_interface": True},
+        }
+        return json.dumps(config, indent=2).encode()
+    if fmt == "clash":
+        proxies = [clash_proxy(link) for link in links]
+        config = {
+            "proxies": proxies,
+            "proxy-groups": [{"name": "PROXY", "type": "select", "proxies": [p["name"] for p in proxies]}],
+            "rules": ["MATCH,PROXY"],
+        }
+        return json.dumps(config, indent=2).encode()
+    raise Exception(f"Unknown subscription format {fmt!r}")
+
+def accepts_gzip(accept_encoding):
+    # RFC 9110: "gzip;q=0" (or "*;q=0" with no gzip entry) forbids gzip; an explicit entry beats "*"
+    qvalues = {}
+    for item in accept_encoding.split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues[coding.lower()] = q
+    q = qvalues.get("gzip", qvalues.get("x-gzip", qvalues.get("*", 0.0)))
+    return q > 0
+
+class SubscriptionCache:
+    # Every body for every client and format, rendered once with its gzip copy and ETag.
+    # Bodies are rebuilt only when manager.links_fingerprint() changes (keys, ports, roster);
+    # the fingerprint itself is rechecked at most every `check_interval` seconds.
+    def __init__(self, manager, check_interval=1.0):
+        self.manager = manager
+        self.check_interval = check_interval
+        self.fingerprint = None
+        self.entries = {}
+        self.built_at = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        manager = self.manager
+        items = manager.get_client_links()
+        shared = [item["link"] for item in items if item.get("shared")]
+        entries = {}
+        for client in manager.desired_clients():
+            if not client["enable"]:
+                continue
+            links = [item["link"] for item in items if item["email"] == client["email"] and not item.get("shared")] + shared
+            if not links:
+                continue
+            headers = {"profile-update-interval": "12"}
+            total = client["totalGB"]
+            expire = client["expiryTime"] // 1000 if client["expiryTime"] > 0 else 0
+            if total or expire:
+                headers["subscription-userinfo"] = f"upload=0; download=0; total={total}; expire={expire}"
+            formats = {}
+            for fmt in FORMATS:
+                body = render(fmt, links)
+                digest = hashlib.sha256(body).hexdigest()[:32]
+                # Each encoding is its own representation, so the gzip copy gets its own strong ETag
+                formats[fmt] = {
+                    "body": body,
+                    "gzip": gzip.compress(body, mtime=0),
+                    "etag": f'"{digest}"',
+                    "gzip_etag": f'"{digest}-gzip"',
+                }
+            entries[manager.subscription_token(client)] = {"email": client["email"], "headers": headers, "formats": formats}
+        return entries
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            if not force and self.fingerprint and now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            fingerprint = self.manager.links_fingerprint()
+            if not force and fingerprint == self.fingerprint:
+                return False
+            self.entries = self._build()
+            self.fingerprint = fingerprint
+            self.built_at = time.time()
+            return True
+
+    def get(self, token, fmt):
+        try:
+            self.refresh()
+        except Exception as e:
+            # Keep serving the last good bodies if .env or the roster is mid-edit
+            print(f"Subscription rebuild failed: {e}")
+        entry = self.entries.get(token)
+        if not entry:
+            return None, None
+        return entry, entry["formats"][fmt]
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "sub"
+    sys_version = ""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _plain(self, code, text):
+        body = text.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        segments = [s for s in parts.path.split("/") if s]
+        if len(segments) not in (2, 3) or segments[0] != "sub":
+            return self._plain(404, "not found")
+        fmt = segments[2] if len(segments) == 3 else parse_qs(parts.query).get("format", ["base64"])[0]
+        if fmt not in FORMATS:
+            return self._plain(400, f"format must be one of: {', '.join(FORMATS)}")
+        entry, rendered = self.server.cache.get(segments[1], fmt)
+        if not entry:
+            return self._plain(404, "not found")
+
+        gzipped = accepts_gzip(self.headers.get("Accept-Encoding", ""))
+        body, etag = (rendered["gzip"], rendered["gzip_etag"]) if gzipped else (rendered["body"], rendered["etag"])
+        if etag in [t.strip() for t in self.headers.get("If-None-Match", "").split(",")]:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[fmt])
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Vary", "Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        for name, value in entry["headers"].items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+class SubscriptionServer:
+    # Serves /sub/<token>[/<format>] (or ?format=) from SubscriptionCache on a background thread.
+    # Requests never touch the panel: bodies come from .env and the roster only.
+    def __init__(self, manager, host="0.0.0.0", port=2097):
+        self.cache = SubscriptionCache(manager)
+        self.httpd = ThreadingHTTPServer((host, int(port)), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.cache = self.cache
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.cache.refresh(force=True)
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="subscriptions", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
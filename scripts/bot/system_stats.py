@@ -0,0 +1,84 @@
+import time
+import threading
+from collections import deque
+
+import psutil
+
+class HostSampler:
+    # Samples host CPU/RAM/disk/network in the background so readers never block.
+    # psutil.cpu_percent(interval=None) measures since the previous call, so sampling on
+    # a fixed period gives a proper average without sleeping in the caller.
+    def __init__(self, interval=5, history=120, disk_path='/'):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.samples = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_net = None
+        psutil.cpu_percent(interval=None)  # prime the CPU counter
+
+    def sample(self):
+        now = time.monotonic()
+        net = psutil.net_io_counters()
+        if self._last_net:
+            last_ts, last = self._last_net
+            elapsed = max(now - last_ts, 1e-6)
+            rx_rate = (net.bytes_recv - last.bytes_recv) / elapsed
+            tx_rate = (net.bytes_sent - last.bytes_sent) / elapsed
+        else:
+            rx_rate = tx_rate = 0.0
+        self._last_net = (now, net)
+
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage(self.disk_path)
+        sample = {
+            "ts": time.time(),
+            "cpu": psutil.cpu_percent(interval=None),
+            "ram": memory.percent,
+            "ram_used": memory.used,
+            "ram_total": memory.total,
+            "disk": disk.percent,
+            "disk_used": disk.used,
+            "disk_total": disk.total,
+            "net_rx_bytes": net.bytes_recv,
+            "net_tx_bytes": net.bytes_sent,
+            "net_rx_rate": rx_rate,
+            "net_tx_rate": tx_rate,
+        }
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def latest(self):
+        with self._lock:
+            if self.samples:
+                return self.samples[-1]
+        # Not started yet: take one sample synchronously (non-blocking, CPU since import)
+        return self.sample()
+
+    def average(self, key, window=60):
+        since = time.time() - window
+        with self._lock:
+            values = [s[key] for s in self.samples if s["ts"] >= since]
+        return sum(values) / len(values) if values else None
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Host sampler error: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="host-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
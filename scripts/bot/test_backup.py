@@ -0,0 +1,83 @@
+import os
+import shutil
+import sqlite3
+import tarfile
+
+import pytest
+
+from benchmark import Environment
+from vpn_manager import VPNManager
+
+@pytest.fixture
+def env():
+    environment = Environment()
+    environment.prepare(3)
+    yield environment
+    environment.close()
+
+def legacy_archive(env, rows):
+    # Layout of the archives the old `cp -a /source/*` backup produced: the whole volume,
+    # including the bind-mounted access.log directory and an uncheckpointed WAL
+    root = os.path.join(env.root, "legacy", "VPN-backup-20240101_000000")
+    db_dir = os.path.join(root, "3xui-db")
+    os.makedirs(os.path.join(db_dir, "access.log"))
+    with open(os.path.join(db_dir, "access.log", "3xui.log"), "w") as f:
+        f.write("panel log\n")
+    src = os.path.join(env.root, "legacy", "live.db")
+    conn = sqlite3.connect(src)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA wal_autocheckpoint=0")
+    conn.execute("CREATE TABLE restored (value TEXT)")
+    conn.executemany("INSERT INTO restored VALUES (?)", [(f"row{i}",) for i in range(rows)])
+    conn.commit()
+    shutil.copy(src, os.path.join(db_dir, "x-ui.db"))
+    shutil.copy(src + "-wal", os.path.join(db_dir, "x-ui.db-wal"))
+    conn.close()
+    shutil.copy(os.path.join(env.project_dir, ".env"), os.path.join(root, ".env"))
+    with open(os.path.join(root, ".env"), "a") as f:
+        f.write("RESTORED_MARKER=1\n")
+    shutil.copytree(os.path.join(env.project_dir, "hysteria2"), os.path.join(root, "hysteria2"))
+    archive = f"{root}.tar.gz"
+    with tarfile.open(archive, "w:gz") as tar:
+        tar.add(root, arcname=os.path.basename(root))
+    return archive
+
+def test_restore_legacy_archive(env):
+    manager = VPNManager(env.project_dir)
+    manager.restore_backup(legacy_archive(env, rows=50))
+    db_path = os.path.join(env.volume_dir, "x-ui.db")
+    conn = sqlite3.connect(db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM restored").fetchone()[0] == 50
+    finally:
+        conn.close()
+    assert not os.path.exists(os.path.join(env.volume_dir, "access.log"))
+    assert not os.path.exists(db_path + "-wal.restore")
+    assert manager.get_env("RESTORED_MARKER") == "1"
+    assert any(e["Actor"]["Attributes"]["name"] == "3x-ui" for e in env.docker.events)
+
+def test_failed_restore_starts_the_panel_again(env, monkeypatch):
+    manager = VPNManager(env.project_dir)
+    archive = legacy_archive(env, rows=1)
+
+    def broken_copy(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(shutil, "copy2", broken_copy)
+    with pytest.raises(OSError):
+        manager.restore_backup(archive)
+    assert any(e["Actor"]["Attributes"]["name"] == "3x-ui" for e in env.docker.events)
+
+def test_backups_in_the_legacy_directory_stay_visible(env):
+    legacy_dir = os.path.join(env.root, "old-backups")
+    with open(os.path.join(env.project_dir, ".env"), "a") as f:
+        f.write(f"BACKUP_LEGACY_DIR={legacy_dir}\n")
+    manager = VPNManager(env.project_dir)
+    full = manager.create_backup()
+    os.makedirs(legacy_dir)
+    moved = shutil.move(full, legacy_dir)
+    shutil.move(full.replace(".tar.gz", ".manifest.json"), legacy_dir)
+    assert manager.list_backups() == [moved]
+    # The full backup in the old directory is found as the base of a new incremental
+    incremental = manager.create_backup(incremental=True)
+    assert incremental.endswith("-inc.tar.gz")
+    manager.restore_backup(incremental)
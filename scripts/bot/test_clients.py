@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from benchmark import Environment
+from vpn_manager import VPNManager
+
+@pytest.fixture(scope="module")
+def env():
+    environment = Environment()
+    yield environment
+    environment.close()
+
+@pytest.fixture
+def manager(env):
+    env.prepare(3)
+    manager = VPNManager(env.project_dir)
+    manager.setup_inbound()
+    return manager
+
+def panel_ids(manager):
+    return {c["email"]: c["id"] for c in manager.list_clients()}
+
+def roster_ids(manager):
+    return {c["email"]: c["id"] for c in manager.load_roster()}
+
+def test_add_clients_skips_existing_emails(manager):
+    before_panel, before_roster = panel_ids(manager), roster_ids(manager)
+    clashing = [{"email": email, "id": "00000000-0000-4000-8000-000000000000"} for email in before_roster]
+    added = manager.add_clients(clashing + [{"email": "fresh@vpn"}])
+    assert [c["email"] for c in added] == ["fresh@vpn"]
+    after_panel, after_roster = panel_ids(manager), roster_ids(manager)
+    assert {k: v for k, v in after_roster.items() if k != "fresh@vpn"} == before_roster
+    assert {k: v for k, v in after_panel.items() if k != "fresh@vpn"} == before_panel
+    assert after_roster["fresh@vpn"] == after_panel["fresh@vpn"]
+    # Roster and panel agree, so a reconcile has nothing to change
+    assert manager.plan() == []
+
+def test_add_clients_keeps_hysteria_passwords(manager):
+    before = manager.roster_hysteria_passwords()
+    manager.add_clients([{"email": email, "hysteria_password": "replaced"} for email in before])
+    assert manager.roster_hysteria_passwords() == before
+
+def test_mint_clients_twice_gives_distinct_emails(manager):
+    first = manager.mint_clients(2)
+    assert len(manager.add_clients(first)) == 2
+    second = manager.mint_clients(2)
+    assert not {c["email"] for c in second} & set(roster_ids(manager))
+    assert len(manager.add_clients(second)) == 2
+    assert len(roster_ids(manager)) == len({c["email"] for c in first + second}) + 2
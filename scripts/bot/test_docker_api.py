@@ -0,0 +1,232 @@
+import io
+import os
+import json
+import time
+import struct
+import tarfile
+import tempfile
+import threading
+import socketserver
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from docker_api import DockerAPI
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def address_string(self):
+        return "local"
+
+    def setup(self):
+        super().setup()
+        self.server.fake.connections += 1
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def _send(self, code, obj=None, raw=None):
+        body = raw if raw is not None else (json.dumps(obj).encode() if obj is not None else b"")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = urlsplit(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        fake.requests.append((method, url.path))
+        if url.path == "/events":
+            return self._events(json.loads(query.get("filters", "{}")), float(query["since"]), float(query["until"]))
+        if url.path == "/volumes":
+            return self._send(200, {"Volumes": [{"Name": f"vpn_{name}", "Mountpoint": path} for name, path in fake.volumes.items()]})
+        if parts[0] == "volumes":
+            return self._send(404, {"message": f"get {parts[1]}: no such volume"})
+        if url.path == "/containers/json":
+            return self._send(200, [{"Id": f"id-{name}", "Names": [f"/{name}"]} for name in fake.containers])
+        if parts[0] == "containers":
+            name, action = parts[1], parts[-1]
+            if name not in fake.containers:
+                return self._send(404, {"message": f"No such container: {name}"})
+            if action == "restart":
+                time.sleep(fake.restart_delay)
+                if name in fake.broken:
+                    return self._send(500, {"message": "cannot restart container"})
+                if name not in fake.silent:
+                    fake.emit(name, "start")
+                return self._send(204)
+            if action == "exec":
+                fake.execs[f"{len(fake.execs):064x}"] = json.loads(body)["Cmd"]
+                return self._send(201, {"Id": f"{len(fake.execs) - 1:064x}"})
+            if action == "archive":
+                fake.archives.append((name, query["path"], body))
+                return self._send(200)
+        if parts[0] == "exec":
+            code, stdout, stderr = fake.exec_result
+            if parts[-1] == "start":
+                frames = b"".join(struct.pack(">BxxxI", stream, len(data)) + data for stream, data in ((1, stdout), (2, stderr)) if data)
+                return self._send(200, raw=frames)
+            return self._send(200, {"ExitCode": code})
+        self._send(404, {"message": f"no route {url.path}"})
+
+    def _events(self, filters, since, until):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        fake = self.server.fake
+        wanted = set(filters.get("container", []))
+        sent = 0
+        try:
+            while time.time() < until:
+                events = [e for e in fake.events if e["time"] >= since and e["Actor"]["Attributes"]["name"] in wanted]
+                for event in events[sent:]:
+                    line = (json.dumps(event) + "\n").encode()
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+                sent = len(events)
+                time.sleep(0.01)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class FakeDocker:
+    def __init__(self, sock_path):
+        self.sock_path = sock_path
+        self.containers = ["3x-ui", "hysteria2", "VPN-Warp"]
+        self.volumes = {"3xui-db": "/var/lib/docker/volumes/vpn_3xui-db/_data"}
+        self.broken = set()
+        self.silent = set()
+        self.restart_delay = 0
+        self.exec_result = (0, b"", b"")
+        self.connections = 0
+        self.requests = []
+        self.events = []
+        self.execs = {}
+        self.archives = []
+        self.server = _UnixServer(sock_path, _Handler)
+        self.server.fake = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def emit(self, name, action):
+        self.events.append({"Type": "container", "Action": action, "time": time.time(),
+                            "Actor": {"ID": f"id-{name}", "Attributes": {"name": name}}})
+
+    def count(self, method, path):
+        return self.requests.count((method, path))
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def fake():
+    with tempfile.TemporaryDirectory() as tmp:
+        server = FakeDocker(os.path.join(tmp, "docker.sock"))
+        yield server
+        server.stop()
+
+@pytest.fixture
+def api(fake):
+    return DockerAPI(fake.sock_path, timeout=5)
+
+def test_keep_alive_reuses_one_connection(fake, api):
+    for _ in range(5):
+        api.containers()
+    assert fake.count("GET", "/containers/json") == 5
+    assert fake.connections == 1
+
+def test_volume_lookup_is_cached(fake, api):
+    # The bare name 404s; the compose-prefixed volume is found through the list
+    assert api.volume_mountpoint("3xui-db") == fake.volumes["3xui-db"]
+    assert api.volume_mountpoint("3xui-db") == fake.volumes["3xui-db"]
+    assert fake.count("GET", "/volumes/3xui-db") == 1
+    assert fake.count("GET", "/volumes") == 1
+    assert api.volume_mountpoint("missing") is None
+    assert api.volume_mountpoint("missing") is None
+    assert fake.count("GET", "/volumes/missing") == 2
+
+def test_service_containers_are_cached(fake, api):
+    first = api.service_containers("/opt/vpn")
+    assert first == {name: f"id-{name}" for name in fake.containers}
+    assert api.service_containers("/opt/vpn") is first
+    assert fake.count("GET", "/containers/json") == 1
+    api.forget_containers()
+    api.service_containers("/opt/vpn")
+    assert fake.count("GET", "/containers/json") == 2
+
+def test_restart_many_runs_in_parallel_and_waits_for_events(fake, api):
+    fake.restart_delay = 0.3
+    start = time.monotonic()
+    results = api.restart_many(fake.containers, timeout=1)
+    elapsed = time.monotonic() - start
+    assert results == {name: None for name in fake.containers}
+    assert elapsed < 0.3 * len(fake.containers)
+    assert fake.count("GET", "/events") == 1
+
+def test_restart_many_reports_failed_restarts(fake, api):
+    fake.broken.add("hysteria2")
+    results = api.restart_many(fake.containers, timeout=1)
+    assert "cannot restart container" in results["hysteria2"]
+    assert results["3x-ui"] is None and results["VPN-Warp"] is None
+
+def test_wait_for_returns_containers_without_events(fake, api):
+    fake.silent.add("VPN-Warp")
+    since = time.time()
+    api.restart("3x-ui")
+    api.restart("VPN-Warp")
+    start = time.monotonic()
+    missing = api.wait_for(["3x-ui", "VPN-Warp"], "start", since=since, timeout=0.5)
+    assert missing == {"VPN-Warp"}
+    assert 0.4 < time.monotonic() - start < 3
+
+def test_exec_run_demuxes_output_and_raises_on_failure(fake, api):
+    fake.exec_result = (0, b"ok\n", b"")
+    assert api.exec_run("3x-ui", ["true"]) == (0, b"ok\n", b"")
+    fake.exec_result = (2, b"partial", b"boom\n")
+    assert api.exec_run("3x-ui", ["false"]) == (2, b"partial", b"boom\n")
+    with pytest.raises(Exception, match="exited with 2: boom"):
+        api.exec_run("3x-ui", ["false"], check=True)
+    with pytest.raises(Exception, match="404: No such container: gone"):
+        api.exec_run("gone", ["true"])
+
+def test_put_file_sends_a_tar_and_reports_errors(fake, api):
+    with tempfile.NamedTemporaryFile("wb", delete=False) as f:
+        f.write(b"hello")
+    try:
+        api.put_file("hysteria2", "/etc/hysteria", "config.yaml", f.name, mode=0o600)
+        name, dest, body = fake.archives[0]
+        assert (name, dest) == ("hysteria2", "/etc/hysteria")
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            member = tar.getmember("config.yaml")
+            assert member.mode == 0o600
+            assert tar.extractfile(member).read() == b"hello"
+        with pytest.raises(Exception, match="404: No such container: gone"):
+            api.put_file("gone", "/etc", "config.yaml", f.name)
+    finally:
+        os.remove(f.name)
+
+def test_unreachable_socket_raises(api, fake):
+    fake.stop()
+    os.remove(fake.sock_path)
+    with pytest.raises(Exception, match="Docker API GET /_ping failed"):
+        api.ping()
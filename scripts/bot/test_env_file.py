@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+from dotenv import dotenv_values
+
+from vpn_manager import EnvFile
+
+VALUES = {
+    "PLAIN": "abc123",
+    "SINGLE": "it's",
+    "DOUBLE": 'say "hi"',
+    "BOTH": 'it\'s "q"',
+    "BACKSLASH": r"C:\path\to",
+    "TRAILING_BACKSLASH": "ends\\",
+    "ESCAPED_QUOTE": "a\\'b",
+    "DOLLAR": "p$ss=#word",
+    "EMPTY": "",
+}
+
+def test_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, ".env")
+        with open(path, "w") as f:
+            f.write("# comment\nKEEP=1\n")
+        env = EnvFile(path)
+        env.update(VALUES)
+        assert dotenv_values(path) == {"KEEP": "1", **VALUES}
+        assert EnvFile(path).values() == {"KEEP": "1", **VALUES}
+
+        # Rewriting keeps every other key intact
+        env.update({"PLAIN": "changed"})
+        assert dotenv_values(path) == {"KEEP": "1", **VALUES, "PLAIN": "changed"}
@@ -0,0 +1,108 @@
+import os
+import hashlib
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from geodata import GeoDataUpdater
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        release = self.server.release
+        name = self.path.lstrip("/")
+        release.requests.append(name)
+        if name.endswith(".sha256sum"):
+            data = release.files.get(name[:-len(".sha256sum")])
+            if data is None:
+                return self._send(404, b"")
+            digest = release.checksums.get(name[:-len(".sha256sum")]) or hashlib.sha256(data).hexdigest()
+            return self._send(200, f"{digest}  {name[:-len('.sha256sum')]}\n".encode())
+        data = release.files.get(name)
+        if data is None:
+            return self._send(404, b"")
+        etag = f'"{hashlib.sha256(data).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(304, b"", etag)
+        self._send(200, data, etag)
+
+    def _send(self, code, body, etag=None):
+        self.send_response(code)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if code != 304:
+            self.wfile.write(body)
+
+class FakeRelease:
+    def __init__(self):
+        self.files = {"geoip.dat": b"geoip v1", "geosite.dat": b"geosite v1"}
+        # name -> checksum to publish instead of the real one
+        self.checksums = {}
+        self.requests = []
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.release = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def release():
+    server = FakeRelease()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def cache_dir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+def read(updater, name):
+    with open(updater.path(name), "rb") as f:
+        return f.read()
+
+def test_first_update_downloads_and_reports_every_file(release, cache_dir):
+    updater = GeoDataUpdater(cache_dir, base_url=release.url)
+    assert updater.update() == {"geoip.dat": True, "geosite.dat": True}
+    assert read(updater, "geoip.dat") == b"geoip v1"
+    assert updater.sha256("geosite.dat") == hashlib.sha256(b"geosite v1").hexdigest()
+
+def test_unchanged_release_is_a_304_no_op(release, cache_dir):
+    GeoDataUpdater(cache_dir, base_url=release.url).update()
+    release.requests.clear()
+    # A new updater reads the ETags back from state.json
+    updater = GeoDataUpdater(cache_dir, base_url=release.url)
+    assert updater.update() == {"geoip.dat": False, "geosite.dat": False}
+    # Conditional GETs only: no body and no checksum fetches
+    assert sorted(release.requests) == ["geoip.dat", "geosite.dat"]
+
+def test_only_changed_files_are_reported(release, cache_dir):
+    updater = GeoDataUpdater(cache_dir, base_url=release.url)
+    updater.update()
+    release.files["geosite.dat"] = b"geosite v2"
+    assert updater.update() == {"geoip.dat": False, "geosite.dat": True}
+    assert read(updater, "geosite.dat") == b"geosite v2"
+
+def test_checksum_mismatch_keeps_the_old_file(release, cache_dir):
+    updater = GeoDataUpdater(cache_dir, base_url=release.url)
+    updater.update()
+    release.files["geoip.dat"] = b"tampered"
+    release.checksums["geoip.dat"] = hashlib.sha256(b"geoip v2").hexdigest()
+    with pytest.raises(Exception, match="Checksum mismatch for geoip.dat"):
+        updater.update()
+    assert read(updater, "geoip.dat") == b"geoip v1"
+    assert updater.sha256("geoip.dat") == hashlib.sha256(b"geoip v1").hexdigest()
+    # No temp file is left next to the cache
+    assert sorted(os.listdir(cache_dir)) == ["geoip.dat", "geosite.dat", "state.json"]
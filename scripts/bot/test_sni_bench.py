@@ -0,0 +1,105 @@
+import os
+import ssl
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+
+import pytest
+
+import sni_bench
+
+@pytest.fixture(scope="module")
+def cert():
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is not installed")
+    with tempfile.TemporaryDirectory() as tmp:
+        certfile, keyfile = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                        "-nodes", "-days", "1", "-subj", "/CN=dest.test", "-keyout", keyfile, "-out", certfile,
+                        "-addext", "subjectAltName=DNS:dest.test,DNS:*.dest.test"],
+                       check=True, capture_output=True)
+        yield certfile, keyfile
+
+class TLSServer:
+    # Self-signed TLS stand-in for a REALITY dest candidate
+    def __init__(self, cert, alpn=("h2", "http/1.1"), max_version=ssl.TLSVersion.TLSv1_3):
+        self.ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ctx.load_cert_chain(*cert)
+        self.ctx.maximum_version = max_version
+        self.ctx.set_alpn_protocols(list(alpn))
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.address = self.listener.getsockname()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            with self.ctx.wrap_socket(conn, server_side=True) as tls:
+                tls.recv(1)
+        except (ssl.SSLError, OSError):
+            conn.close()
+
+    def close(self):
+        self.listener.close()
+
+@pytest.fixture
+def servers(cert):
+    started = []
+
+    def start(**kwargs):
+        server = TLSServer(cert, **kwargs)
+        started.append(server)
+        return server
+    yield start
+    for server in started:
+        server.close()
+
+def test_probe_target_reports_latency_tls13_and_h2(cert, servers):
+    server = servers()
+    result = sni_bench.probe_target("dest.test", attempts=3, address=server.address, cafile=cert[0])
+    assert result["ok"] == 3 and result["valid"] and result["error"] is None
+    assert result["tls13"] and result["h2"]
+    assert result["connect_ms"] >= 0 and result["tls_ms"] > 0
+    assert result["total_ms"] >= result["tls_ms"] and result["jitter_ms"] >= 0
+    assert result["names"] == ["dest.test", "*.dest.test"]
+
+def test_target_without_h2_is_not_valid(cert, servers):
+    server = servers(alpn=("http/1.1",))
+    result = sni_bench.probe_target("dest.test", attempts=1, address=server.address, cafile=cert[0])
+    assert result["ok"] == 1 and result["tls13"] and not result["h2"] and not result["valid"]
+
+def test_failure_paths(cert, servers):
+    tls12 = servers(max_version=ssl.TLSVersion.TLSv1_2)
+    result = sni_bench.probe_target("dest.test", attempts=1, address=tls12.address, cafile=cert[0])
+    assert result["ok"] == 0 and not result["valid"] and result["error"].startswith("tls:")
+
+    server = servers()
+    result = sni_bench.probe_target("other.test", attempts=1, address=server.address, cafile=cert[0])
+    assert not result["valid"] and result["error"].startswith("certificate:")
+
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    address = closed.getsockname()
+    closed.close()
+    result = sni_bench.probe_target("dest.test", attempts=1, address=address, timeout=1)
+    assert not result["valid"] and result["error"].startswith("connect:")
+
+def test_benchmark_ranks_valid_targets_first(cert, servers):
+    good, no_h2 = servers(), servers(alpn=("http/1.1",))
+    addresses = {"dest.test": good.address, "www.dest.test": good.address, "cdn.dest.test": no_h2.address}
+    ranking = sni_bench.benchmark(list(addresses), attempts=2, addresses=addresses, cafile=cert[0])
+    assert [r["valid"] for r in ranking] == [True, True, False]
+    assert ranking[-1]["host"] == "cdn.dest.test"
+    dest, extra = sni_bench.pick_server_names(ranking)
+    assert {dest} | set(extra) == {"dest.test", "www.dest.test"}
@@ -0,0 +1,42 @@
+import gzip
+import urllib.request
+
+import pytest
+
+from benchmark import Environment
+from subscription import SubscriptionServer, accepts_gzip
+from vpn_manager import VPNManager
+
+@pytest.fixture(scope="module")
+def server():
+    env = Environment()
+    env.prepare(2)
+    manager = VPNManager(env.project_dir)
+    manager.setup_inbound()
+    server = SubscriptionServer(manager, host="127.0.0.1", port=0)
+    server.start()
+    server.token = manager.subscription_token(manager.desired_clients()[0])
+    yield server
+    server.stop()
+    env.close()
+
+def fetch(server, accept_encoding):
+    request = urllib.request.Request(f"http://127.0.0.1:{server.port}/sub/{server.token}/singbox",
+                                     headers={"Accept-Encoding": accept_encoding})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.headers.get("Content-Encoding"), response.headers["ETag"], response.read()
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", True), ("GZIP;q=0.3, br", True), ("*", True), ("br, *;q=0.5", True),
+    ("gzip;q=0", False), ("gzip; q=0.0, br", False), ("*;q=0", False), ("gzip;q=0, *", False),
+    ("identity", False), ("", False),
+])
+def test_accepts_gzip_honours_qvalues(header, expected):
+    assert accepts_gzip(header) is expected
+
+def test_refused_gzip_gets_the_identity_body(server):
+    encoding, etag, body = fetch(server, "gzip;q=0, identity")
+    assert encoding is None and not etag.endswith('-gzip"')
+    gz_encoding, gz_etag, gz_body = fetch(server, "gzip")
+    assert gz_encoding == "gzip" and gz_etag != etag
+    assert gzip.decompress(gz_body) == body
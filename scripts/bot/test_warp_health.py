@@ -0,0 +1,118 @@
+import socket
+import threading
+
+import pytest
+
+from benchmark import Environment
+from vpn_manager import VPNManager
+from warp_health import WarpHealthMonitor, probe
+
+class FakeSocks:
+    # Minimal SOCKS5 server: no-auth, CONNECT, then answers one HTTP request itself.
+    # While `healthy` is False it reads the greeting and hangs up, like a wedged warp-svc.
+    def __init__(self):
+        self.healthy = True
+        self.targets = []
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        with conn:
+            conn.recv(3)
+            if not self.healthy:
+                return
+            conn.sendall(b"\x05\x00")
+            head = conn.recv(5)
+            name = conn.recv(head[4])
+            port = int.from_bytes(conn.recv(2), "big")
+            self.targets.append((name.decode(), port))
+            conn.sendall(b"\x05\x00\x00\x01" + bytes(4) + bytes(2))
+            conn.recv(1024)
+            conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+
+    def stop(self):
+        self.listener.close()
+
+@pytest.fixture
+def socks():
+    server = FakeSocks()
+    yield server
+    server.stop()
+
+def test_probe_through_a_healthy_proxy(socks):
+    result = probe("127.0.0.1", socks.port, "www.cloudflare.com", timeout=2)
+    assert result["ok"] and result["error"] is None
+    assert 0 <= result["handshake_ms"] <= result["fetch_ms"]
+    assert socks.targets == [("www.cloudflare.com", 80)]
+
+def test_probe_reports_a_dead_proxy(socks):
+    socks.healthy = False
+    result = probe("127.0.0.1", socks.port, "www.cloudflare.com", timeout=2)
+    assert not result["ok"]
+    assert "closed the connection" in result["error"]
+
+def outbound_tags(env):
+    return [r.get("outboundTag") for r in env.panel.template["routing"]["rules"]]
+
+def test_failover_and_recovery_switch_routing(socks):
+    env = Environment()
+    try:
+        env.prepare(1)
+        manager = VPNManager(env.project_dir)
+        manager.setup_inbound()
+        changes = []
+
+        def on_change(active):
+            changes.append(active)
+            manager.set_warp_failover(active)
+
+        monitor = WarpHealthMonitor(port=socks.port, timeout=2, fail_after=2, recover_after=2, on_change=on_change)
+        monitor.check()
+        assert changes == [] and not monitor.failed_over
+        assert "warp" in outbound_tags(env)
+
+        socks.healthy = False
+        monitor.check()
+        assert changes == []  # one bad check is not enough
+        monitor.check()
+        assert changes == [True] and monitor.failed_over
+        assert manager.get_env("WARP_FAILOVER") == "1"
+        assert "warp" not in outbound_tags(env) and "direct" in outbound_tags(env)
+
+        socks.healthy = True
+        monitor.check()
+        assert changes == [True]
+        monitor.check()
+        assert changes == [True, False] and not monitor.failed_over
+        assert manager.get_env("WARP_FAILOVER") == "0"
+        assert "warp" in outbound_tags(env)
+        assert monitor.summary()["checks"] == 5
+    finally:
+        env.close()
+
+def test_failed_switch_is_retried(socks):
+    attempts = []
+
+    def on_change(active):
+        attempts.append(active)
+        if len(attempts) == 1:
+            raise Exception("panel down")
+
+    monitor = WarpHealthMonitor(port=socks.port, timeout=2, fail_after=1, recover_after=1, on_change=on_change)
+    socks.healthy = False
+    monitor.check()
+    assert monitor.failed_over and not monitor.applied
+    assert monitor.last_error == "panel down"
+    monitor.check()
+    assert attempts == [True, True] and monitor.applied and monitor.last_error is None
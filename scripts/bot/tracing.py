@@ -0,0 +1,197 @@
+import os
+import json
+import atexit
+import inspect
+import time
+import functools
+import threading
+import subprocess
+from collections import deque
+
+# Ring entries are plain tuples; dicts are only built when spans are reported or written.
+# Starts are perf_counter_ns values, turned into wall-clock seconds on output.
+FIELDS = ("name", "start", "duration_ns", "parent", "depth", "thread", "error")
+_WALL_OFFSET = time.time() - time.perf_counter_ns() / 1e9
+
+def _as_dict(entry):
+    record = dict(zip(FIELDS, entry))
+    record["start"] = _WALL_OFFSET + record["start"] / 1e9
+    return record
+
+class Tracer:
+    # Nested timing spans. Each thread keeps its own stack of open span names, so nesting
+    # needs no locking; finished spans go to a bounded ring (deque.append is atomic) and,
+    # when `path` is set, to a JSONL file in batches. A batch is taken from the pending list
+    # under `_lock`, so each entry is written exactly once whichever thread flushes it.
+    def __init__(self, ring=5000, path=None, flush_every=256):
+        self.spans = deque(maxlen=ring)
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def configure(self, ring=None, path=None):
+        if ring and ring != self.spans.maxlen:
+            self.spans = deque(self.spans, maxlen=ring)
+        if path != self.path:
+            self.flush()
+            self.path = path or None
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, entry):
+        self.spans.append(entry)
+        if self.path:
+            with self._lock:
+                self._pending.append(entry)
+                if len(self._pending) < self.flush_every:
+                    return
+                pending, self._pending = self._pending, []
+            self._write(pending)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        self._write(pending)
+
+    def _write(self, pending):
+        if not self.path or not pending:
+            return
+        with self._write_lock:
+            with open(self.path, "a") as f:
+                f.write("".join(json.dumps(_as_dict(entry)) + "\n" for entry in pending))
+
+    def records(self):
+        return [_as_dict(entry) for entry in list(self.spans)]
+
+class _Span:
+    __slots__ = ("tracer", "name", "start", "stack")
+
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.stack = stack = self.tracer._stack()
+        stack.append(self.name)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter_ns() - self.start
+        stack = self.stack
+        stack.pop()
+        self.tracer._record((self.name, self.start, duration, stack[-1] if stack else None,
+                             len(stack), threading.get_ident(), exc_type is not None))
+        return False
+
+tracer = Tracer()
+span = tracer.span
+atexit.register(tracer.flush)
+
+def traced(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(tracer, name):
+                return fn(*args, **kwargs)
+        wrapper.__traced__ = True
+        return wrapper
+    return decorate
+
+def instrument(cls, prefix, exclude=()):
+    # Wraps every plain method defined on the class (properties, static/class methods and
+    # dunders are left alone)
+    for attr, value in list(vars(cls).items()):
+        if attr.startswith("__") or attr in exclude or not inspect.isfunction(value):
+            continue
+        if getattr(value, "__traced__", False):
+            continue
+        setattr(cls, attr, traced(f"{prefix}{attr}")(value))
+    return cls
+
+class _TracedSubprocess:
+    # Stands in for the subprocess module inside one instrumented module: run() gets a span
+    # named after the program and its first argument ("exec ufw allow"), everything else is
+    # the real module
+    def __getattr__(self, name):
+        return getattr(subprocess, name)
+
+    @staticmethod
+    def run(args, *rest, **kwargs):
+        argv = args.split() if isinstance(args, str) else [str(a) for a in args]
+        name = "exec " + " ".join([os.path.basename(argv[0])] + argv[1:2]) if argv else "exec"
+        with _Span(tracer, name):
+            return subprocess.run(args, *rest, **kwargs)
+
+def instrument_subprocess(module):
+    # Only `module`'s own subprocess.run calls are traced; the subprocess module itself and
+    # every other importer are left untouched
+    if not isinstance(module.subprocess, _TracedSubprocess):
+        module.subprocess = _TracedSubprocess()
+
+def load_jsonl(path):
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def _quantile(ordered, q):
+    # Nearest-rank: the smallest value with at least q of the samples at or below it
+    return ordered[max(0, -(-int(q * 100) * len(ordered) // 100) - 1)]
+
+def summarize(records, since=None):
+    # {name: {"count", "errors", "p50_ms", "p95_ms", "max_ms", "total_ms"}}
+    durations = {}
+    errors = {}
+    for record in records:
+        if since and record["start"] < since:
+            continue
+        durations.setdefault(record["name"], []).append(record["duration_ns"])
+        errors[record["name"]] = errors.get(record["name"], 0) + bool(record["error"])
+    stats = {}
+    for name, values in durations.items():
+        values.sort()
+        stats[name] = {
+            "count": len(values), "errors": errors[name],
+            "p50_ms": _quantile(values, 0.50) / 1e6, "p95_ms": _quantile(values, 0.95) / 1e6,
+            "max_ms": values[-1] / 1e6, "total_ms": sum(values) / 1e6,
+        }
+    return stats
+
+def format_stats(stats, limit=25):
+    if not stats:
+        return "No spans recorded"
+    rows = sorted(stats.items(), key=lambda kv: kv[1]["total_ms"], reverse=True)[:limit]
+    width = min(40, max(len(name) for name, _ in rows))
+    lines = [f"{'operation':<{width}} {'n':>5} {'p50':>9} {'p95':>9} {'max':>9}"]
+    for name, s in rows:
+        err = f" ({s['errors']} err)" if s["errors"] else ""
+        lines.append(f"{name[:width]:<{width}} {s['count']:>5} {_ms(s['p50_ms']):>9} {_ms(s['p95_ms']):>9} {_ms(s['max_ms']):>9}{err}")
+    return "\n".join(lines)
+
+def _ms(value):
+    return f"{value / 1000:.2f}s" if value >= 1000 else f"{value:.1f}ms" if value >= 1 else f"{value * 1000:.0f}µs"
+
+def overhead_ns(iterations=100_000):
+    # Cost of one empty span on this machine, for checking the "few microseconds" budget
+    probe = Tracer(ring=1000)
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        with _Span(probe, "probe"):
+            pass
+    return (time.perf_counter_ns() - start) / iterations
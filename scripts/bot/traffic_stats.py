@@ -0,0 +1,171 @@
+import os
+import time
+import sqlite3
+import threading
+
+# Rollup tables: name -> (bucket size in seconds, retention in seconds, None = keep forever)
+ROLLUPS = {
+    "rollup_1m": (60, 2 * 86400),
+    "rollup_1h": (3600, 60 * 86400),
+    "rollup_1d": (86400, None),
+}
+
+def format_bytes(num):
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(num) < 1024 or unit == "TB":
+            return f"{num:.0f} {unit}" if unit == "B" else f"{num:.1f} {unit}"
+        num /= 1024
+
+class TrafficStore:
+    # Local time-series of traffic deltas. Raw counters from the panel are only kept as
+    # the last seen value; everything else is pre-aggregated into 1m/1h/1d buckets plus
+    # lifetime totals, so queries never scan more than one window of one table.
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS counters (
+            source TEXT, kind TEXT, name TEXT, up INTEGER, down INTEGER,
+            PRIMARY KEY (source, kind, name))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS totals (
+            source TEXT, kind TEXT, name TEXT, up INTEGER, down INTEGER,
+            PRIMARY KEY (source, kind, name))""")
+        for table in ROLLUPS:
+            self._conn.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+                bucket INTEGER, source TEXT, kind TEXT, name TEXT, up INTEGER, down INTEGER,
+                PRIMARY KEY (bucket, source, kind, name))""")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def record_counters(self, source, kind, counters, ts=None):
+        # counters: {name: (up, down)} absolute values as reported by the source.
+        # A value lower than last time means the counter was reset, so it is the delta itself.
+        ts = int(ts or time.time())
+        with self._lock, self._conn:
+            last = {name: (up, down) for name, up, down in self._conn.execute(
+                "SELECT name, up, down FROM counters WHERE source=? AND kind=?", (source, kind))}
+            deltas = {}
+            for name, (up, down) in counters.items():
+                prev_up, prev_down = last.get(name, (None, None))
+                if prev_up is None:
+                    # First sighting: remember the baseline, don't count history as current usage
+                    d_up, d_down = 0, 0
+                else:
+                    d_up = up - prev_up if up >= prev_up else up
+                    d_down = down - prev_down if down >= prev_down else down
+                if d_up or d_down:
+                    deltas[name] = (d_up, d_down)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO counters (source, kind, name, up, down) VALUES (?, ?, ?, ?, ?)",
+                [(source, kind, name, up, down) for name, (up, down) in counters.items()])
+            self._add_deltas(source, kind, deltas, ts)
+        return deltas
+
+    def record_deltas(self, source, kind, deltas, ts=None):
+        # For sources that already report increments (e.g. counters cleared on read)
+        deltas = {name: d for name, d in deltas.items() if d[0] or d[1]}
+        with self._lock, self._conn:
+            self._add_deltas(source, kind, deltas, int(ts or time.time()))
+        return deltas
+
+    def _add_deltas(self, source, kind, deltas, ts):
+        if not deltas:
+            return
+        rows = [(source, kind, name, up, down) for name, (up, down) in deltas.items()]
+        add = "DO UPDATE SET up = up + excluded.up, down = down + excluded.down"
+        self._conn.executemany(
+            f"INSERT INTO totals (source, kind, name, up, down) VALUES (?, ?, ?, ?, ?) "
+            f"ON CONFLICT (source, kind, name) {add}", rows)
+        for table, (size, _) in ROLLUPS.items():
+            bucket = ts - ts % size
+            self._conn.executemany(
+                f"INSERT INTO {table} (bucket, source, kind, name, up, down) VALUES ({bucket}, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT (bucket, source, kind, name) {add}", rows)
+
+    def prune(self, now=None):
+        now = int(now or time.time())
+        with self._lock, self._conn:
+            for table, (_, retention) in ROLLUPS.items():
+                if retention:
+                    self._conn.execute(f"DELETE FROM {table} WHERE bucket < ?", (now - retention,))
+
+    def top(self, kind="client", window=3600, limit=10, now=None):
+        # Top talkers over the last `window` seconds, from the finest rollup that covers it
+        now = int(now or time.time())
+        table = "rollup_1m" if window <= 2 * 3600 else "rollup_1h" if window <= 7 * 86400 else "rollup_1d"
+        size = ROLLUPS[table][0]
+        since = now - window
+        since -= since % size
+        with self._lock:
+            return self._conn.execute(f"""
+                SELECT name, SUM(up) AS up, SUM(down) AS down FROM {table}
+                WHERE kind=? AND bucket >= ?
+                GROUP BY name ORDER BY SUM(up) + SUM(down) DESC LIMIT ?""", (kind, since, limit)).fetchall()
+
+    def totals(self, kind="client", name=None):
+        with self._lock:
+            if name is not None:
+                row = self._conn.execute(
+                    "SELECT COALESCE(SUM(up), 0), COALESCE(SUM(down), 0) FROM totals WHERE kind=? AND name=?",
+                    (kind, name)).fetchone()
+                return row
+            return self._conn.execute(
+                "SELECT name, SUM(up), SUM(down) FROM totals WHERE kind=? GROUP BY name ORDER BY SUM(up) + SUM(down) DESC",
+                (kind,)).fetchall()
+
+class TrafficCollector:
+    # Polls the 3x-ui inbound list (which carries per-client clientStats) and feeds the store
+    def __init__(self, manager, store, interval=60):
+        self.manager = manager
+        self.store = store
+        self.interval = interval
+        self.last_error = None
+        self.last_run = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def collect_once(self):
+        inbounds = self.manager.xui.list_inbounds()
+        per_inbound = {}
+        per_client = {}
+        for inb in inbounds:
+            per_inbound[inb.get('remark') or str(inb.get('id'))] = (inb.get('up', 0), inb.get('down', 0))
+            for stat in inb.get('clientStats') or []:
+                per_client[stat.get('email')] = (stat.get('up', 0), stat.get('down', 0))
+        now = time.time()
+        self.store.record_counters("xray", "inbound", per_inbound, now)
+        self.store.record_counters("xray", "client", per_client, now)
+        self.last_run = now
+
+    def _loop(self):
+        prune_every = 3600
+        last_prune = 0
+        while not self._stop.is_set():
+            try:
+                self.collect_once()
+                self.last_error = None
+                if time.time() - last_prune > prune_every:
+                    self.store.prune()
+                    last_prune = time.time()
+            except Exception as e:
+                self.last_error = e
+                print(f"Traffic collector error: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="traffic-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
@@ -1,244 +1,917 @@
+import io
 import os
+import sys
 import re
+import fcntl
 import json
 import uuid
 import secrets
+import time
 import base64
+import socket
+import queue
+import hashlib
 import requests
-import tarfile
 import shutil
+import sqlite3
+import tempfile
+import threading
 import subprocess
+from contextlib import contextmanager
 from datetime import datetime
-from dotenv import set_key, load_dotenv
+from dotenv import load_dotenv, dotenv_values
+from requests.adapters import HTTPAdapter
+
+import backup
+import docker_api
+import geodata
+import fleet
+import sni_bench
+import hysteria_config
+import hysteria_stats
+import routing_policy
+import tracing
 
 import urllib.request
 import urllib.error
+from urllib.parse import quote
+
+class XUIClient:
+    # Long-lived 3x-ui API client. Keeps one keep-alive connection pool and reuses
+    # the auth cookie until it expires or the panel rejects it.
+    def __init__(self, base_url, username="admin", password="admin", timeout=15):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        # Optional callable(client) -> bool, used instead of a plain login() when (re)authenticating
+        self.authenticator = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=8, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._auth_lock = threading.Lock()
+        self._authenticated = False
+
+    def login(self, username=None, password=None):
+        username = self.username if username is None else username
+        password = self.password if password is None else password
+        res = self.session.post(f"{self.base_url}/login", data={"username": username, "password": password}, timeout=self.timeout)
+        try:
+            ok = bool(res.json().get('success'))
+        except ValueError:
+            ok = False
+        if ok:
+            self.username, self.password = username, password
+        self._authenticated = ok
+        return ok
+
+    def _has_cookie(self):
+        self.session.cookies.clear_expired_cookies()
+        return len(self.session.cookies) > 0
+
+    def authenticate(self, force=False):
+        with self._auth_lock:
+            if not force and self._authenticated and self._has_cookie():
+                return
+            self.session.cookies.clear()
+            ok = self.authenticator(self) if self.authenticator else self.login()
+            if not ok:
+                self._authenticated = False
+                raise Exception(f"Failed to login to 3x-ui at {self.base_url}")
+            self._authenticated = True
+
+    @staticmethod
+    def _is_auth_failure(res):
+        if res.status_code in (401, 403):
+            return True
+        # Expired sessions get redirected to the HTML login page instead of a JSON error
+        content_type = res.headers.get('Content-Type', '')
+        return res.status_code == 200 and 'text/html' in content_type
+
+    _ID_RE = re.compile(r"/\d+(?=/|$)")
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # IDs are folded so /update/3 and /update/7 report as one operation
+        with tracing.span(f"xui {method} {self._ID_RE.sub('/:id', path)}"):
+            self.authenticate()
+            res = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            if self._is_auth_failure(res):
+                self.authenticate(force=True)
+                res = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        return res
+
+    def api(self, method, path, **kwargs):
+        res = self.request(method, path, **kwargs)
+        if res.status_code == 200 and not res.text.strip():
+            return None  # Some 3x-ui builds answer OK with an empty body
+        try:
+            data = res.json()
+        except ValueError:
+            raise Exception(f"3x-ui {path} returned non-JSON response ({res.status_code}): {res.text[:200]!r}")
+        if not data.get('success'):
+            raise Exception(f"3x-ui {path} failed: {data.get('msg') or res.text[:200]}")
+        return data.get('obj')
+
+    # --- /panel/api/inbounds/* ---
+
+    def list_inbounds(self):
+        return self.api("GET", "/panel/api/inbounds/list") or []
+
+    def add_inbound(self, inbound):
+        return self.api("POST", "/panel/api/inbounds/add", json=inbound)
+
+    def update_inbound(self, inbound_id, inbound):
+        return self.api("POST", f"/panel/api/inbounds/update/{inbound_id}", json=inbound)
+
+    def del_inbound(self, inbound_id):
+        return self.api("POST", f"/panel/api/inbounds/del/{inbound_id}")
+
+    def add_clients(self, inbound_id, clients):
+        return self.api("POST", "/panel/api/inbounds/addClient", json={
+            "id": inbound_id, "settings": json.dumps({"clients": clients})
+        })
+
+    def onlines(self):
+        return self.api("POST", "/panel/api/inbounds/onlines") or []
+
+    # --- Xray template and process ---
+
+    def get_xray_template(self):
+        obj = self.api("POST", "/panel/xray/")
+        if isinstance(obj, str):
+            obj = json.loads(obj)
+        return (obj or {}).get('xraySetting') or None
+
+    def update_xray_template(self, config):
+        return self.api("POST", "/panel/xray/update", data={"xraySetting": json.dumps(config, indent=2)})
+
+    def restart_xray(self):
+        # Restarts only the Xray process inside the panel, not the container
+        return self.api("POST", "/server/restartXrayService")
+
+# Curve25519 field prime and (A - 2) / 4 from RFC 7748
+_X25519_P = 2 ** 255 - 19
+_X25519_A24 = 121665
+
+def _x25519_scalarmult(scalar, u):
+    # Montgomery ladder from RFC 7748, section 5. Used only when `cryptography` is missing.
+    k = int.from_bytes(scalar, "little")
+    x1 = int.from_bytes(u, "little") & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    p = _X25519_P
+    swap = 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        swap ^= bit
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a, b = (x2 + z2) % p, (x2 - z2) % p
+        aa, bb = a * a % p, b * b % p
+        e = (aa - bb) % p
+        c, d = (x3 + z3) % p, (x3 - z3) % p
+        da, cb = d * a % p, c * b % p
+        x3 = (da + cb) ** 2 % p
+        z3 = x1 * (da - cb) ** 2 % p
+        x2 = aa * bb % p
+        z2 = e * (aa + _X25519_A24 * e) % p
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, p - 2, p) % p).to_bytes(32, "little")
+
+def _clamp_x25519(key):
+    key = bytearray(key)
+    key[0] &= 248
+    key[31] &= 127
+    key[31] |= 64
+    return bytes(key)
+
+def generate_x25519_keypair():
+    # Same output as `xray x25519`: clamped private key and public key, raw 32 bytes each,
+    # URL-safe base64 without padding
+    priv_bytes = _clamp_x25519(secrets.token_bytes(32))
+    try:
+        from cryptography.hazmat.primitives.asymmetric import x25519
+        from cryptography.hazmat.primitives import serialization
+        pub_bytes = x25519.X25519PrivateKey.from_private_bytes(priv_bytes).public_key().public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+    except ImportError:
+        pub_bytes = _x25519_scalarmult(priv_bytes, (9).to_bytes(32, "little"))
+    priv_b64 = base64.urlsafe_b64encode(priv_bytes).decode('utf-8').rstrip('=')
+    pub_b64 = base64.urlsafe_b64encode(pub_bytes).decode('utf-8').rstrip('=')
+    return priv_b64, pub_b64
+
+def mint_credentials():
+    priv_key, pub_key = generate_x25519_keypair()
+    return {
+        "private_key": priv_key,
+        "public_key": pub_key,
+        "short_id": secrets.token_hex(4),
+        "uuid": str(uuid.uuid4()),
+        "hysteria_password": secrets.token_urlsafe(18)[:24],
+        "hysteria_obfs": secrets.token_urlsafe(18)[:24],
+    }
+
+class CredentialPool:
+    # A few ready-made credential sets, refilled by a background thread so a rotation
+    # never waits on key generation. Nothing here is persisted: unused sets die with
+    # the process.
+    def __init__(self, size=4):
+        self.size = size
+        self._items = queue.Queue()
+        self._refill = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _fill_loop(self):
+        while True:
+            while self._items.qsize() < self.size:
+                self._items.put(mint_credentials())
+            self._refill.wait()
+            self._refill.clear()
+
+    def start(self):
+        with self._lock:
+            if self.size > 0 and (self._thread is None or not self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._fill_loop, name="credential-pool", daemon=True)
+                self._thread.start()
+
+    def get(self):
+        self.start()
+        try:
+            creds = self._items.get_nowait()
+        except queue.Empty:
+            creds = mint_credentials()
+        self._refill.set()
+        return creds
+
+    def take(self, count):
+        return [self.get() for _ in range(count)]
+
+class EnvFile:
+    # In-memory model of .env. Reads are served from memory and reparsed only when the file
+    # changes on disk. update() rewrites the file once via temp file + fsync + rename under an
+    # exclusive flock, so the bot and the CLI never interleave and a crash leaves either the
+    # old or the new file, never a mix.
+    KEY_RE = re.compile(r"^\s*(?:export\s+)?([A-Za-z_][A-Za-z0-9_.]*)\s*=")
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = os.path.join(os.path.dirname(path) or ".", ".env.lock")
+        self._thread_lock = threading.RLock()
+        self._stamp = None
+        self._lines = []
+        self._values = {}
+
+    @contextmanager
+    def locked(self):
+        with self._thread_lock:
+            with open(self.lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._stamp, self._lines, self._values = None, [], {}
+            return
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if stamp == self._stamp:
+            return
+        with open(self.path, "r") as f:
+            text = f.read()
+        self._lines = text.splitlines()
+        self._values = {k: v for k, v in dotenv_values(stream=io.StringIO(text)).items() if v is not None}
+        self._stamp = stamp
+
+    def get(self, key, default=None):
+        with self._thread_lock:
+            self._load()
+            return self._values.get(key, default)
+
+    def values(self):
+        with self._thread_lock:
+            self._load()
+            return dict(self._values)
+
+    @staticmethod
+    def _format(key, value):
+        # Single quotes like python-dotenv's set_key. dotenv unescapes \\ and \' inside single
+        # quotes, so both are escaped (set_key itself only escapes the quote) and any value
+        # reads back unchanged.
+        escaped = value.replace("\\", "\\\\").replace("'", "\\'")
+        return f"{key}='{escaped}'"
+
+    def _write(self, text):
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".env.")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(self.path):
+                shutil.copymode(self.path, tmp_path)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def update(self, changes):
+        changes = {k: str(v) for k, v in changes.items()}
+        with self.locked():
+            self._stamp = None
+            self._load()
+            pending = dict(changes)
+            lines = []
+            for line in self._lines:
+                match = self.KEY_RE.match(line)
+                if match and match.group(1) in changes:
+                    key = match.group(1)
+                    if key not in pending:
+                        continue  # drop duplicate definitions of an updated key
+                    lines.append(self._format(key, pending.pop(key)))
+                else:
+                    lines.append(line)
+            lines.extend(self._format(k, v) for k, v in pending.items())
+            self._write("\n".join(lines) + "\n")
+            self._stamp = None
+            self._load()
+
+    def replace_with(self, src_path):
+        with open(src_path, "r") as f:
+            text = f.read()
+        with self.locked():
+            self._write(text)
+            self._stamp = None
+
+class ReadinessProbe:
+    # Waits until every check passes, retrying with exponential backoff until the deadline.
+    # Checks are plain callables returning True once their part of the service is up.
+    def __init__(self, timeout=60.0, initial_delay=0.05, max_delay=2.0, factor=2.0):
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+
+    def wait(self, checks, description="service"):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        delay = self.initial_delay
+        pending = list(checks)
+        last_error = None
+        while True:
+            # Checks are ordered cheapest first; once one passes it stays passed
+            while pending:
+                try:
+                    if not pending[0]():
+                        break
+                except Exception as e:
+                    last_error = e
+                    break
+                pending.pop(0)
+            if not pending:
+                return time.monotonic() - start
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                name = getattr(pending[0], '__name__', 'check')
+                raise TimeoutError(f"{description} not ready after {self.timeout:.0f}s (waiting on {name}: {last_error})")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * self.factor, self.max_delay)
+
+    @staticmethod
+    def tcp(host, port, timeout=1.0):
+        def tcp_connect():
+            with socket.create_connection((host, int(port)), timeout=timeout):
+                return True
+        return tcp_connect
+
+    @staticmethod
+    def http(url, timeout=2.0):
+        def http_ok():
+            return requests.get(url, timeout=timeout, allow_redirects=False).status_code == 200
+        return http_ok
+
+    @staticmethod
+    def container_process(docker, container, process):
+        # /containers/{id}/top lists processes inside the container
+        def process_alive():
+            return any(process in " ".join(row) for row in docker.top(container).get("Processes") or [])
+        return process_alive
+
+DEFAULT_XRAY_TEMPLATE = {
+    "log": {"access": "", "error": "", "loglevel": "warning"},
+    "inbounds": [],
+    "outbounds": [
+        {"tag": "direct", "protocol": "freedom", "settings": {"domainStrategy": "UseIP"}},
+        {"tag": "blocked", "protocol": "blackhole", "settings": {}}
+    ],
+    "routing": {
+        "domainStrategy": "AsIs",
+        "rules": [
+            {"type": "field", "inboundTag": ["api"], "outboundTag": "api"},
+            {"type": "field", "outboundTag": "blocked", "ip": ["geoip:private"]},
+            {"type": "field", "outboundTag": "blocked", "protocol": ["bittorrent"]}
+        ]
+    }
+}
+
+class XUIDatabase:
+    # In-process access to the 3x-ui SQLite DB living in the 3xui-db volume.
+    # The panel keeps the file open, so we rely on SQLite's own locking: a busy
+    # timeout instead of failing on SQLITE_BUSY, and BEGIN IMMEDIATE for writes so
+    # we take the write lock up front and never upgrade mid-transaction. The
+    # journal mode the panel chose (rollback or WAL) is left untouched.
+    VOLUME_NAME = "3xui-db"
+
+    def __init__(self, db_path, busy_timeout=10):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+
+    @staticmethod
+    def resolve_volume(docker, volume_name=VOLUME_NAME):
+        try:
+            return docker.volume_mountpoint(volume_name)
+        except Exception as e:
+            print(f"Failed to resolve volume {volume_name}: {e}")
+            return None
+
+    @classmethod
+    def locate(cls, docker, override=None):
+        # override: XUI_DB_PATH, read by the caller through VPNManager.get_env
+        if override:
+            return cls(override)
+        mountpoint = cls.resolve_volume(docker)
+        if not mountpoint:
+            return None
+        return cls(os.path.join(mountpoint, "x-ui.db"))
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def query_one(self, sql, params=()):
+        conn = self.connect()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            conn.close()
+
+    def get_credentials(self):
+        return self.query_one("SELECT username, password FROM users LIMIT 1")
+
+    def delete_inbounds(self, port):
+        with self.transaction() as conn:
+            return conn.execute("DELETE FROM inbounds WHERE port=?", (port,)).rowcount
 
 class VPNManager:
     def __init__(self, project_dir):
         self.project_dir = project_dir
         self.env_path = os.path.join(project_dir, '.env')
         load_dotenv(self.env_path)
+        self.env = EnvFile(self.env_path)
+        self._xui = None
+        self._db = None
+        self._docker = None
+        self._links_cache = None
+        self.credential_pool = CredentialPool(size=int(self.get_env("KEY_POOL_SIZE", "4")))
+        tracing.tracer.configure(ring=int(self.get_env("TRACE_RING", "5000")), path=self.get_env("TRACE_FILE") or None)
+        # Callables(key) notified after set_env() changes a value
+        self.env_listeners = []
     
     def get_env(self, key, default=""):
-        return os.environ.get(key, default)
+        # .env wins over the process environment (the reverse of the old os.environ lookup):
+        # os.environ only holds .env as it was at startup, so reading it first would hide
+        # changes made by another process (CLI vs bot). Keys absent from .env still come
+        # from the environment.
+        value = self.env.get(key)
+        if value is None:
+            value = os.environ.get(key, default)
+        return value
     
     def set_env(self, key, value):
-        set_key(self.env_path, key, value)
-        os.environ[key] = value
+        self.update_env({key: value})
 
-    def _generate_x25519_keys(self):
-        # The most reliable way for Xray is to use Xray's own generator via Docker.
-        # This guarantees 100% compatibility and prevents "reality verification failed" errors.
-        try:
-            output = subprocess.check_output(
-                ["docker", "run", "--rm", "teddysun/xray:latest", "x25519"], 
-                timeout=15, stderr=subprocess.DEVNULL
-            ).decode('utf-8')
-            
-            priv_key = ""
-            pub_key = ""
-            for line in output.split('\n'):
-                if "Private" in line:
-                    priv_key = line.split(':')[-1].strip()
-                elif "Public" in line:
-                    pub_key = line.split(':')[-1].strip()
-            
-            if priv_key and pub_key:
-                return priv_key, pub_key
-        except Exception:
-            pass
-
-        # Fallback to python's cryptography module if available
-        try:
-            from cryptography.hazmat.primitives.asymmetric import x25519
-            from cryptography.hazmat.primitives import serialization
-            private_key = x25519.X25519PrivateKey.generate()
-            public_key = private_key.public_key()
-            
-            # Xray format: raw 32 bytes encoded in URL-safe base64 without padding
-            priv_bytes = private_key.private_bytes(
-                encoding=serialization.Encoding.Raw,
-                format=serialization.PrivateFormat.Raw,
-                encryption_algorithm=serialization.NoEncryption()
-            )
-            pub_bytes = public_key.public_bytes(
-                encoding=serialization.Encoding.Raw,
-                format=serialization.PublicFormat.Raw
-            )
-            
-            priv_b64 = base64.urlsafe_b64encode(priv_bytes).decode('utf-8').rstrip('=')
-            pub_b64 = base64.urlsafe_b64encode(pub_bytes).decode('utf-8').rstrip('=')
-            return priv_b64, pub_b64
-        except ImportError:
-            # Final fallback to openssl
-            priv_pem = "/tmp/reality_priv.pem"
-            pub_pem = "/tmp/reality_pub.pem"
-            subprocess.run(["openssl", "genpkey", "-algorithm", "x25519", "-out", priv_pem], check=True, stderr=subprocess.DEVNULL)
-            subprocess.run(["openssl", "pkey", "-in", priv_pem, "-pubout", "-out", pub_pem], check=True, stderr=subprocess.DEVNULL)
-            
-            priv_der = subprocess.check_output(["openssl", "pkey", "-in", priv_pem, "-outform", "DER"])
-            pub_der = subprocess.check_output(["openssl", "pkey", "-in", pub_pem, "-pubin", "-outform", "DER"])
-            
-            priv_b64 = base64.urlsafe_b64encode(priv_der[-32:]).decode('utf-8').rstrip('=')
-            pub_b64 = base64.urlsafe_b64encode(pub_der[-32:]).decode('utf-8').rstrip('=')
-            
-            os.remove(priv_pem)
-            os.remove(pub_pem)
-            return priv_b64, pub_b64
+    def update_env(self, changes):
+        # All-or-nothing: one atomic write of .env for the whole batch
+        changes = {k: str(v) for k, v in changes.items()}
+        self.env.update(changes)
+        os.environ.update(changes)
+        if any(key in self.LINK_ENV_KEYS for key in changes):
+            self._links_cache = None
+        for key in changes:
+            for listener in self.env_listeners:
+                listener(key)
 
     def generate_keys(self):
-        priv_key, pub_key = self._generate_x25519_keys()
-        
-        vless_uuid = str(uuid.uuid4())
-        short_id = secrets.token_hex(4)
-        hysteria_pwd = secrets.token_urlsafe(18)[:24]
-        hysteria_obfs = secrets.token_urlsafe(18)[:24]
+        creds = self.credential_pool.get()
         
-        self.set_env("REALITY_PRIVATE_KEY", priv_key)
-        self.set_env("REALITY_PUBLIC_KEY", pub_key)
-        self.set_env("REALITY_SHORT_ID", short_id)
-        self.set_env("VLESS_UUID", vless_uuid)
-        self.set_env("HYSTERIA_PASSWORD", hysteria_pwd)
-        self.set_env("HYSTERIA_OBFS_PASSWORD", hysteria_obfs)
+        self.update_env({
+            "REALITY_PRIVATE_KEY": creds["private_key"],
+            "REALITY_PUBLIC_KEY": creds["public_key"],
+            "REALITY_SHORT_ID": creds["short_id"],
+            "VLESS_UUID": creds["uuid"],
+            "HYSTERIA_PASSWORD": creds["hysteria_password"],
+            "HYSTERIA_OBFS_PASSWORD": creds["hysteria_obfs"],
+        })
 
-    def login_xui(self):
+    def rotate_keys(self):
+        # New credentials everywhere: only the VLESS inbound and, if its config changed, hysteria2 reload
+        self.generate_keys()
+        self.reconcile()
+        self.apply_hysteria_config()
+
+    def mint_clients(self, count, email_prefix="user"):
+        # Batch credentials for new roster clients, ready for add_clients(). Numbering continues
+        # after the highest "<prefix>N@vpn" in the roster and on the panel, so a second batch
+        # never reuses an existing email.
+        emails = {c["email"] for c in self.load_roster()}
+        try:
+            emails.update(c.get("email") or "" for c in self.list_clients())
+        except Exception as e:
+            # stderr: --mint-clients prints JSON on stdout
+            print(f"Could not read panel clients, numbering from the roster only: {e}", file=sys.stderr)
+        pattern = re.compile(rf"{re.escape(email_prefix)}(\d+)@vpn")
+        start = max((int(m.group(1)) for m in map(pattern.fullmatch, emails) if m), default=0)
+        return [
+            {"email": f"{email_prefix}{start + i + 1}@vpn", "id": creds["uuid"], "hysteria_password": creds["hysteria_password"]}
+            for i, creds in enumerate(self.credential_pool.take(count))
+        ]
+
+    @property
+    def xui(self):
+        url = f"http://localhost:{self.get_env('XUI_PORT', '2053')}"
+        if self._xui is None or self._xui.base_url != url:
+            self._xui = XUIClient(url, self.get_env("XUI_USERNAME", "admin"), self.get_env("XUI_PASSWORD", "admin"))
+            self._xui.authenticator = self._authenticate_xui
+        return self._xui
+
+    @property
+    def docker(self):
+        sock = self.get_env("DOCKER_SOCK", docker_api.DEFAULT_SOCK)
+        if self._docker is None or self._docker.sock_path != sock:
+            self._docker = docker_api.DockerAPI(sock)
+        return self._docker
+
+    @property
+    def db(self):
+        # The volume mountpoint is resolved once per manager
+        if self._db is None:
+            self._db = XUIDatabase.locate(self.docker, self.get_env("XUI_DB_PATH"))
+        return self._db
+
+    def readiness(self):
+        return ReadinessProbe(timeout=float(self.get_env("READY_TIMEOUT", "60")))
+
+    def wait_xui_ready(self):
         port = self.get_env("XUI_PORT", "2053")
+        print("Waiting for 3x-ui to boot...")
+        elapsed = self.readiness().wait([
+            ReadinessProbe.tcp("localhost", port),
+            ReadinessProbe.http(f"http://localhost:{port}/"),
+            ReadinessProbe.container_process(self.docker, "3x-ui", "xray"),
+        ], description="3x-ui")
+        print(f"3x-ui is ready after {elapsed:.1f}s")
+
+    def restart_xui(self):
+        self.docker.restart("3x-ui")
+        self.wait_xui_ready()
+
+    def restart_services(self, services=None):
+        # Restarts compose services concurrently and waits for their start events.
+        # Returns {container: None or error}. Falls back to the container_name when the
+        # project was started from another directory and has no matching compose labels.
+        docker = self.docker
+        names = []
+        for service in services or [None]:
+            found = list(docker.service_containers(self.project_dir, service))
+            if not found and service:
+                found = [service]
+            names.extend(found)
+        if not names:
+            raise Exception(f"No containers of the compose project in {self.project_dir}")
+        results = docker.restart_many(names)
+        if any(error and "404" in error for error in results.values()):
+            # A container was recreated since the lookup was cached
+            docker.forget_containers()
+        return results
+
+    def _authenticate_xui(self, client):
         username = self.get_env("XUI_USERNAME", "admin")
         password = self.get_env("XUI_PASSWORD", "admin")
-        
-        url = f"http://localhost:{port}"
-        session = requests.Session()
-        res = session.post(f"{url}/login", data={"username": username, "password": password})
-        
-        if not res.json().get('success'):
-            # Fallback to admin/admin
-            res = session.post(f"{url}/login", data={"username": "admin", "password": "admin"})
-            if res.json().get('success'):
-                # Update to secure credentials
-                session.post(f"{url}/panel/setting/updateUser", data={
-                    "oldUsername": "admin", "oldPassword": "admin",
-                    "newUsername": username, "newPassword": password
-                })
-            else:
-                # Our .env is wrong and admin/admin is wrong. The user probably changed it via web UI.
-                # Let's extract the real credentials from the DB and update .env.
-                print("Failed to login with .env credentials. Attempting to recover from SQLite...")
-                volume_out = subprocess.run(["docker", "volume", "ls", "-q"], capture_output=True, text=True)
-                volume_name = None
-                for line in volume_out.stdout.splitlines():
-                    if "3xui-db" in line:
-                        volume_name = line.strip()
-                        break
+        if client.login(username, password):
+            return True
 
-                if volume_name:
-                    import ast
-                    py_extract_script = """
-import sqlite3
-try:
-    conn = sqlite3.connect('/etc/x-ui/x-ui.db')
-    c = conn.cursor()
-    c.execute("SELECT username, password FROM users LIMIT 1")
-    row = c.fetchone()
-    if row:
-        print(repr(row))
-except Exception:
-    pass
-finally:
-    if 'conn' in locals(): conn.close()
-"""
-                    out = subprocess.run([
-                        "docker", "run", "--rm", "-i",
-                        "-v", f"{volume_name}:/etc/x-ui/", 
-                        "alpine", "sh", "-c", "apk add --no-cache python3 sqlite && python3 -"
-                    ], input=py_extract_script, capture_output=True, text=True, check=False)
-                    
-                    found = False
-                    for line in out.stdout.splitlines():
-                        if line.startswith('('):
-                            try:
-                                real_user, real_pass = ast.literal_eval(line.strip())
-                                print(f"Recovered credentials from DB. Updating .env...")
-                                self.set_env("XUI_USERNAME", real_user)
-                                self.set_env("XUI_PASSWORD", real_pass)
-                                # Retry login
-                                res = session.post(f"{url}/login", data={"username": real_user, "password": real_pass})
-                                if res.json().get('success'):
-                                    found = True
-                                break
-                            except Exception:
-                                pass
-                    if not found:
-                        raise Exception("Failed to login to 3x-ui and failed to recover credentials from DB")
-                else:
-                    raise Exception("Failed to login to 3x-ui and could not find 3xui-db volume")
-        
-        return session, url
+        # Fallback to admin/admin
+        if client.login("admin", "admin"):
+            # Update to secure credentials
+            client.session.post(f"{client.base_url}/panel/setting/updateUser", data={
+                "oldUsername": "admin", "oldPassword": "admin",
+                "newUsername": username, "newPassword": password
+            }, timeout=client.timeout)
+            client.username, client.password = username, password
+            return True
+
+        # Our .env is wrong and admin/admin is wrong. The user probably changed it via web UI.
+        # Let's extract the real credentials from the DB and update .env.
+        print("Failed to login with .env credentials. Attempting to recover from SQLite...")
+        db = self.db
+        if not db:
+            raise Exception("Failed to login to 3x-ui and could not find 3xui-db volume")
 
-    def setup_inbound(self):
-        session, url = self.login_xui()
-        
-        # Attempt to delete via API first
-        res = session.get(f"{url}/panel/api/inbounds/list")
-        existing_id = None
         try:
-            for inb in res.json().get('obj', []):
-                if inb.get('port') == 443:
-                    existing_id = inb.get('id')
-                    session.post(f"{url}/panel/api/inbounds/del/{existing_id}")
-        except Exception:
-            pass
+            row = db.get_credentials()
+        except sqlite3.Error as e:
+            print(f"SQLite error: {e}")
+            row = None
+        if row:
+            real_user, real_pass = row
+            print(f"Recovered credentials from DB. Updating .env...")
+            self.update_env({"XUI_USERNAME": real_user, "XUI_PASSWORD": real_pass})
+            # Retry login
+            if client.login(real_user, real_pass):
+                return True
+        raise Exception("Failed to login to 3x-ui and failed to recover credentials from DB")
 
-        # Forcefully delete any stuck 443 port via SQLite (Fallback)
-        volume_out = subprocess.run(["docker", "volume", "ls", "-q"], capture_output=True, text=True)
-        volume_name = None
-        for line in volume_out.stdout.splitlines():
-            if "3xui-db" in line:
-                volume_name = line.strip()
-                break
+    def login_xui(self):
+        # Kept for scripts that want a raw session: the pooled client only logs in
+        # when it has no valid cookie yet.
+        client = self.xui
+        client.authenticate()
+        return client.session, client.base_url
 
-        if volume_name:
-            py_delete_script = """
-import sqlite3
-db_path = '/etc/x-ui/x-ui.db'
-try:
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("DELETE FROM inbounds WHERE port=443")
-    conn.commit()
-except Exception as e:
-    pass
-finally:
-    if 'conn' in locals():
-        conn.close()
-"""
-            subprocess.run([
-                "docker", "run", "--rm", "-i",
-                "-v", f"{volume_name}:/etc/x-ui/", 
-                "alpine", "sh", "-c", "apk add --no-cache python3 sqlite && python3 -"
-            ], input=py_delete_script, text=True, check=False)
-            
-            # Restart to apply deletion before creating new
-            subprocess.run(["docker", "restart", "3x-ui"], check=False)
-            import time
-            import requests
-            print("Waiting for 3x-ui to boot...")
-            for _ in range(30):
-                try:
-                    res = requests.get(f"http://localhost:{self.get_env('XUI_PORT', '2053')}", timeout=2)
-                    if res.status_code == 200 and 'Welcome' in res.text:
-                        break
-                except Exception:
-                    pass
-                time.sleep(1)
-            time.sleep(3)
-            # Re-authenticate because the session is lost on container restart
-            session, url = self.login_xui()
+    # Inbound fields that are JSON documents serialized into strings by the panel
+    INBOUND_JSON_FIELDS = ("settings", "streamSettings", "sniffing")
+    INBOUND_FIELDS = ("remark", "enable", "expiryTime", "listen", "port", "protocol", "total") + INBOUND_JSON_FIELDS
+
+    @classmethod
+    def _project(cls, have, want):
+        # Keep only the parts of `have` that `want` describes: the panel adds its own
+        # defaults (client flags, timestamps...) that must not count as drift
+        if isinstance(have, dict) and isinstance(want, dict):
+            return {k: cls._project(have.get(k), v) for k, v in want.items()}
+        if isinstance(have, list) and isinstance(want, list) and len(have) == len(want):
+            return [cls._project(h, w) for h, w in zip(have, want)]
+        return have
+
+    @classmethod
+    def _diff_paths(cls, have, want, path=""):
+        # Leaf-level differences as {dotted.path: (have, want)}
+        if isinstance(have, dict) and isinstance(want, dict):
+            changes = {}
+            for key in list(want) + [k for k in have if k not in want]:
+                changes.update(cls._diff_paths(have.get(key), want.get(key), f"{path}.{key}" if path else key))
+            return changes
+        if isinstance(have, list) and isinstance(want, list) and len(have) == len(want):
+            changes = {}
+            for i, (h, w) in enumerate(zip(have, want)):
+                changes.update(cls._diff_paths(h, w, f"{path}[{i}]"))
+            return changes
+        return {} if have == want else {path: (have, want)}
+
+    @classmethod
+    def _inbound_changes(cls, current, desired):
+        changes = {}
+        for field in cls.INBOUND_FIELDS:
+            if field not in desired:
+                continue
+            have, want = current.get(field), desired[field]
+            if field in cls.INBOUND_JSON_FIELDS:
+                have = json.loads(have) if isinstance(have, str) and have else have
+                want = json.loads(want) if isinstance(want, str) and want else want
+            changes.update(cls._diff_paths(cls._project(have, want), want, field))
+        return changes
+
+    # --- Desired-state reconciliation ---
+
+    WARP_OUTBOUND = {
+        'protocol': 'socks',
+        'tag': 'warp',
+        'settings': {
+            'servers': [{'address': '127.0.0.1', 'port': 1080}]
+        }
+    }
 
+    @property
+    def fleet_path(self):
+        return self.get_env("FLEET_FILE", os.path.join(self.project_dir, "fleet.json"))
+
+    @property
+    def routing_policy_path(self):
+        return self.get_env("ROUTING_POLICY", os.path.join(self.project_dir, "configs", "routing.json"))
+
+    def load_routing_policy(self):
+        return routing_policy.RoutingPolicy(self.routing_policy_path)
+
+    # ./logs/3x-ui is mounted at /etc/x-ui/access.log in the 3x-ui container. Xray logs go to a
+    # subdirectory so the panel jail's *.log glob does not scan them.
+    XRAY_LOG_DIR = "/etc/x-ui/access.log/xray"
+
+    @property
+    def xray_logs_enabled(self):
+        return self.get_env("XRAY_ACCESS_LOG") == "1"
+
+    def xray_log_paths(self):
+        # Host-side paths of the Xray logs and of the ban-candidate feed for fail2ban
+        logs_dir = os.path.join(self.project_dir, "logs")
+        return {
+            "access": os.path.join(logs_dir, "3x-ui", "xray", "access.log"),
+            "error": os.path.join(logs_dir, "3x-ui", "xray", "error.log"),
+            "bans": os.path.join(logs_dir, "xray-abuse.log"),
+        }
+
+    def desired_state(self):
+        # Everything the panel should hold, derived from .env, the roster and the routing policy.
+        # Policy rules go first; rules the policy does not own are left alone.
+        overrides = {}
+        if self.get_env("WARP_FAILOVER") == "1":
+            overrides["warp"] = self.get_env("WARP_FAILOVER_OUTBOUND", "direct")
+        rules, _ = self.load_routing_policy().compile(overrides)
+        state = {
+            "inbound": self.build_inbound(),
+            "outbounds": [self.WARP_OUTBOUND],
+            "rules": rules,
+        }
+        if self.xray_logs_enabled:
+            state["log"] = {
+                "access": f"{self.XRAY_LOG_DIR}/access.log",
+                "error": f"{self.XRAY_LOG_DIR}/error.log",
+                "loglevel": self.get_env("XRAY_LOGLEVEL", "warning"),
+            }
+        return state
+
+    def _desired_template(self, current, state):
+        template = json.loads(json.dumps(current))
+        outbounds = template.setdefault('outbounds', [])
+        for want in state["outbounds"]:
+            index = next((i for i, o in enumerate(outbounds) if o.get('tag') == want['tag']), None)
+            if index is None:
+                outbounds.append(want)
+            elif self._project(outbounds[index], want) != want:
+                outbounds[index] = want
+
+        routing = template.setdefault('routing', {})
+        kept = [r for r in routing.get('rules', []) if not routing_policy.is_managed_rule(r)]
+        routing['rules'] = list(state["rules"]) + kept
+        if state.get("log"):
+            template.setdefault('log', {}).update(state["log"])
+        return template
+
+    def plan(self, state=None):
+        # Compares the desired state with the live panel and returns the minimal list of
+        # actions; an empty list means the system is already correct. Only reads: anything
+        # that has to exist on the host before applying is created by execute_plan().
+        state = state or self.desired_state()
+        xui = self.xui
+        actions = []
+
+        desired = state["inbound"]
+        matches = [inb for inb in xui.list_inbounds() if inb.get('port') == desired['port']]
+        if not matches:
+            actions.append({"action": "add_inbound", "target": desired['remark'], "payload": desired, "changes": {}})
+        else:
+            current = matches[0]
+            desired = self._with_live_clients(desired, current)
+            for dup in matches[1:]:
+                actions.append({"action": "delete_inbound", "target": f"{dup.get('remark')} (id {dup['id']})", "id": dup['id'], "changes": {}})
+            changes = self._inbound_changes(current, desired)
+            if changes:
+                # Keep the ID and traffic counters: the panel hot-swaps just this inbound in Xray
+                payload = dict(desired)
+                payload.update({"id": current['id'], "up": current.get('up', 0), "down": current.get('down', 0)})
+                actions.append({"action": "update_inbound", "target": f"{current.get('remark')} (id {current['id']})",
+                                "id": current['id'], "payload": payload, "changes": changes})
+
+        current_template = xui.get_xray_template() or DEFAULT_XRAY_TEMPLATE
+        desired_template = self._desired_template(current_template, state)
+        changes = self._diff_paths(current_template, desired_template)
+        if changes:
+            actions.append({"action": "update_template", "target": "xrayTemplateConfig", "payload": desired_template, "changes": changes})
+            # Outbound/routing changes need an Xray process restart (not a container restart)
+            actions.append({"action": "restart_xray", "target": "xray", "changes": {}})
+        return actions
+
+    def _add_inbound(self, desired):
+        xui = self.xui
+        try:
+            xui.add_inbound(desired)
+        except Exception as e:
+            # A row stuck in the DB but invisible to the API blocks the port: purge and retry once
+            db = self.db
+            if not db:
+                raise
+            print(f"Failed to add inbound ({e}); purging port {desired['port']} via SQLite...")
+            db.delete_inbounds(desired['port'])
+            self.restart_xui()
+            xui.add_inbound(desired)
+
+    def execute_plan(self, actions):
+        xui = self.xui
+        if self.xray_logs_enabled:
+            # Xray does not create missing directories
+            os.makedirs(os.path.dirname(self.xray_log_paths()["access"]), exist_ok=True)
+        for action in actions:
+            kind = action["action"]
+            if kind == "add_inbound":
+                self._add_inbound(action["payload"])
+            elif kind == "delete_inbound":
+                xui.del_inbound(action["id"])
+            elif kind == "update_inbound":
+                xui.update_inbound(action["id"], action["payload"])
+            elif kind == "update_template":
+                xui.update_xray_template(action["payload"])
+            elif kind == "restart_xray":
+                self.reload_xray()
+
+    def reconcile(self, dry_run=False):
+        actions = self.plan()
+        if not dry_run:
+            self.execute_plan(actions)
+        return actions
+
+    SECRET_FIELDS = ("privateKey", "password", "id")
+
+    @classmethod
+    def format_plan(cls, actions):
+        if not actions:
+            return "No changes. Panel state matches .env."
+        symbols = {"add_inbound": "+", "delete_inbound": "-", "update_inbound": "~", "update_template": "~", "restart_xray": "!"}
+        lines = []
+        for action in actions:
+            lines.append(f"{symbols.get(action['action'], '*')} {action['action']} {action['target']}")
+            for path, (have, want) in action["changes"].items():
+                leaf = re.split(r"[.\[]", path)[-1]
+                if leaf in cls.SECRET_FIELDS:
+                    have, want = ("***" if have else have), ("***" if want else want)
+                lines.append(f"    {path}: {json.dumps(have)} -> {json.dumps(want)}")
+        return "\n".join(lines)
+
+    def reload_xray(self):
+        try:
+            self.xui.restart_xray()
+        except Exception as e:
+            print(f"Xray restart via API failed ({e}), restarting the container...")
+            self.restart_xui()
+            return
+        self.readiness().wait([ReadinessProbe.container_process(self.docker, "3x-ui", "xray")], description="xray")
+
+    def reality_server_names(self):
         sni = self.get_env("REALITY_SNI", "www.microsoft.com")
-        
-        # Create new inbound
-        inbound_data = {
+        extra = [name.strip() for name in self.get_env("REALITY_SERVER_NAMES").split(",") if name.strip()]
+        return [sni] + [name for name in extra if name != sni]
+
+    def bench_sni(self, candidates=None, attempts=3):
+        candidates = candidates or [c.strip() for c in self.get_env("SNI_CANDIDATES").split(",") if c.strip()] or list(sni_bench.DEFAULT_CANDIDATES)
+        current = self.get_env("REALITY_SNI", "www.microsoft.com")
+        if current not in candidates:
+            candidates = [current] + candidates
+        return sni_bench.benchmark(candidates, attempts=attempts)
+
+    def apply_sni(self, ranking, limit=4):
+        # Fastest valid target becomes dest (and the Hysteria masquerade); names its certificate
+        # also covers are added as extra serverNames
+        dest, extra = sni_bench.pick_server_names(ranking, limit)
+        if not dest:
+            raise Exception("No candidate supports TLS 1.3 with X25519 and h2")
+        self.update_env({"REALITY_SNI": dest, "REALITY_SERVER_NAMES": ",".join(extra)})
+        self.reconcile()
+        self.apply_hysteria_config()
+        return dest, extra
+
+    def build_inbound(self):
+        sni = self.get_env("REALITY_SNI", "www.microsoft.com")
+        return {
             "up": 0, "down": 0, "total": 0,
             "remark": "VLESS-REALITY-AUTO",
             "enable": True,
@@ -247,14 +920,14 @@ finally:
             "port": 443,
             "protocol": "vless",
             "settings": json.dumps({
-                "clients": [{"id": self.get_env("VLESS_UUID"), "flow": "xtls-rprx-vision", "email": "client@vpn"}],
+                "clients": self.desired_clients(),
                 "decryption": "none", "fallbacks": []
             }),
             "streamSettings": json.dumps({
                 "network": "tcp", "security": "reality",
                 "realitySettings": {
                     "show": False, "dest": f"{sni}:443", "proxyProtocol": 0,
-                    "serverNames": [sni],
+                    "serverNames": self.reality_server_names(),
                     "privateKey": self.get_env("REALITY_PRIVATE_KEY"),
                     "minClient": "", "maxClient": "", "format": "",
                     "shortIds": [self.get_env("REALITY_SHORT_ID")]
@@ -263,134 +936,222 @@ finally:
             }),
             "sniffing": json.dumps({"enabled": True, "destOverride": ["http", "tls"]})
         }
-        res = session.post(f"{url}/panel/api/inbounds/add", json=inbound_data)
-        try:
-            if res.status_code == 200 and not res.text.strip():
-                pass # Success! (Workaround for empty OK response)
-            elif not res.json().get('success'):
-                raise Exception(f"Failed to add inbound: {res.text}")
-        except json.decoder.JSONDecodeError:
-            print(f"Failed to parse JSON for inbounds/add. Status: {res.status_code}, Response: {repr(res.text[:500])}")
-            # If we got HTML, it means login was incomplete or session is invalid. Let's force a login and retry once.
-            print("Retrying login and add...")
-            session, url = self.login_xui()
-            res = session.post(f"{url}/panel/api/inbounds/add", json=inbound_data)
-            if res.status_code == 200 and not res.text.strip():
-                pass
-            elif not res.json().get('success'):
-                raise Exception(f"Failed to add inbound on retry: {res.text}")
-            
-        # Warp Outbound Setup
-        print("Configuring Warp outbound via SQLite...")
-        
-        # We need to find the exact volume name for 3xui-db
-        volume_out = subprocess.run(["docker", "volume", "ls", "-q"], capture_output=True, text=True)
-        volume_name = None
-        for line in volume_out.stdout.splitlines():
-            if "3xui-db" in line:
-                volume_name = line.strip()
-                break
-                
-        if volume_name:
-            # We run python script inside the running 3x-ui container, which already has sqlite3
-            # or we can use alpine. However, running inside 3x-ui is the safest since it's already pulled and running.
-            py_script = """
-import sqlite3
-import json
 
-db_path = '/etc/x-ui/x-ui.db'
-try:
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key='xrayTemplateConfig'")
-    row = c.fetchone()
-    
-    is_new = False
-    if row and row[0]:
-        config = json.loads(row[0])
-    else:
-        config = {
-          "log": {"access": "", "error": "", "loglevel": "warning"},
-          "inbounds": [],
-          "outbounds": [
-            {"tag": "direct", "protocol": "freedom", "settings": {"domainStrategy": "UseIP"}},
-            {"tag": "blocked", "protocol": "blackhole", "settings": {}}
-          ],
-          "routing": {
-            "domainStrategy": "AsIs",
-            "rules": [
-              {"type": "field", "inboundTag": ["api"], "outboundTag": "api"},
-              {"type": "field", "outboundTag": "blocked", "ip": ["geoip:private"]},
-              {"type": "field", "outboundTag": "blocked", "protocol": ["bittorrent"]}
-            ]
-          }
+    def update_routing(self, rule_set, add=(), remove=(), outbound=None):
+        # Edits one rule set and applies it; only the routing template is touched if it changed
+        policy = self.load_routing_policy()
+        added = policy.add_entries(rule_set, add, outbound) if add else []
+        removed = policy.remove_entries(rule_set, remove) if remove else []
+        if added or removed:
+            policy.save()
+        return added, removed, self.reconcile()
+
+    def set_warp_failover(self, active):
+        # Recorded in .env so a later --setup-inbound keeps the failover instead of undoing it
+        self.set_env("WARP_FAILOVER", "1" if active else "0")
+        return self.reconcile()
+
+    def setup_inbound(self):
+        actions = self.reconcile()
+        print(self.format_plan(actions))
+        return actions
+
+    # --- Client roster ---
+
+    DEFAULT_CLIENT_EMAIL = "client@vpn"
+    # Client fields owned by the roster; anything else the panel stores is left alone
+    CLIENT_FIELDS = ("id", "email", "flow", "totalGB", "expiryTime", "enable", "limitIp", "subId")
+
+    @property
+    def roster_path(self):
+        return self.get_env("CLIENTS_FILE", os.path.join(self.project_dir, "clients.json"))
+
+    def load_roster(self):
+        if not os.path.exists(self.roster_path):
+            return []
+        with open(self.roster_path, 'r') as f:
+            return [self._client_entry(c) for c in json.load(f)]
+
+    def roster_hysteria_passwords(self):
+        # Hysteria credentials live in the roster next to the panel fields but never go to the panel
+        if not os.path.exists(self.roster_path):
+            return {}
+        with open(self.roster_path, 'r') as f:
+            return {c["email"]: c["hysteria_password"] for c in json.load(f) if c.get("hysteria_password")}
+
+    def save_roster(self, clients):
+        passwords = self.roster_hysteria_passwords()
+        entries = []
+        for c in clients:
+            entry = {k: c[k] for k in self.CLIENT_FIELDS if k in c}
+            password = c.get("hysteria_password") or passwords.get(c["email"]) or secrets.token_urlsafe(16)
+            entry["hysteria_password"] = password
+            entries.append(entry)
+        tmp_path = f"{self.roster_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, self.roster_path)
+        if self.hysteria_userpass:
+            self.apply_hysteria_config()
+
+    @classmethod
+    def _client_entry(cls, client):
+        # totalGB is a byte limit in 3x-ui despite the name; expiryTime is a unix time in ms
+        if not client.get("email"):
+            raise Exception(f"Client without email: {client}")
+        return {
+            "id": client.get("id") or str(uuid.uuid4()),
+            "email": client["email"],
+            "flow": client.get("flow", "xtls-rprx-vision"),
+            "totalGB": int(client.get("totalGB", 0)),
+            "expiryTime": int(client.get("expiryTime", 0)),
+            "enable": bool(client.get("enable", True)),
+            "limitIp": int(client.get("limitIp", 0)),
+            "subId": client.get("subId", ""),
         }
-        is_new = True
-        
-    # Add warp outbound
-    outbounds = config.setdefault('outbounds', [])
-    if not any(o.get('tag') == 'warp' for o in outbounds):
-        outbounds.append({
-            'protocol': 'socks',
-            'tag': 'warp',
-            'settings': {
-                'servers': [{'address': '127.0.0.1', 'port': 1080}]
-            }
-        })
-        
-    # Add routing rules
-    routing = config.setdefault('routing', {})
-    rules = routing.setdefault('rules', [])
-    
-    if not any(r.get('outboundTag') == 'warp' for r in rules):
-        rules.insert(0, {
-            'type': 'field',
-            'outboundTag': 'warp',
-            'domain': [
-                'geosite:openai',
-                'geosite:netflix',
-                'geosite:disney',
-                'geosite:primevideo',
-                'geosite:twitter',
-                'geosite:instagram',
-                'geosite:meta',
-                'domain:chatgpt.com',
-                'domain:antigravity.com'
-            ]
-        })
-        
-    if is_new:
-        c.execute("INSERT INTO settings (key, value) VALUES ('xrayTemplateConfig', ?)", (json.dumps(config, indent=2),))
-    else:
-        c.execute("UPDATE settings SET value=? WHERE key='xrayTemplateConfig'", (json.dumps(config, indent=2),))
-    
-    conn.commit()
-    print('Warp settings configured in template DB.')
-except Exception as e:
-    print(f'SQLite error: {e}')
-finally:
-    if 'conn' in locals():
-        conn.close()
-"""
-            # Install python3 in 3x-ui if it's missing (it usually has it or we can install it)
-            # Actually, Alpine might not have python3 by default, but it does have sqlite3 and jq.
-            # Even better: The host machine running this script HAS python3 and sqlite3!
-            # The docker volume is usually located at /var/lib/docker/volumes/3xui-db/_data/x-ui.db
-            # Let's use docker run with Alpine (which is guaranteed locally from previous steps) to install python3 and run it,
-            # Pass the python script via standard input to avoid any shell quoting/escape issues.
-            subprocess.run([
-                "docker", "run", "--rm", "-i",
-                "-v", f"{volume_name}:/etc/x-ui/", 
-                "alpine", "sh", "-c", "apk add --no-cache python3 sqlite && python3 -"
-            ], input=py_script, text=True, check=False)
-            
-            subprocess.run(["docker", "restart", "3x-ui"], check=False)
-            print("Restarted 3x-ui to apply Warp routing.")
-        else:
-            print("Warning: Could not find 3xui-db volume to configure Warp.")
+
+    def desired_clients(self):
+        default = self._client_entry({"id": self.get_env("VLESS_UUID"), "email": self.DEFAULT_CLIENT_EMAIL})
+        roster = [c for c in self.load_roster() if c["email"] != self.DEFAULT_CLIENT_EMAIL]
+        return [default] + roster
+
+    def _managed_inbound(self):
+        for inb in self.xui.list_inbounds():
+            if inb.get('port') == 443:
+                return inb
+        raise Exception("VLESS inbound on port 443 not found, run --setup-inbound first")
+
+    @staticmethod
+    def _inbound_clients(inbound):
+        return json.loads(inbound.get('settings') or '{}').get('clients', [])
+
+    @staticmethod
+    def _merge_clients(live, desired):
+        # Roster fields over the live client dicts, so fields only the panel sets (tgId,
+        # comment, reset...) survive an update
+        live = {c.get('email'): c for c in live}
+        merged = []
+        for client in desired:
+            entry = dict(live.get(client["email"], {}))
+            entry.update(client)
+            merged.append(entry)
+        return merged
+
+    def _with_live_clients(self, desired, current):
+        settings = json.loads(desired['settings'])
+        settings['clients'] = self._merge_clients(self._inbound_clients(current), settings['clients'])
+        return dict(desired, settings=json.dumps(settings))
+
+    def _push_clients(self, inbound, clients):
+        # One inbounds/update call carries the whole client list, however many changed
+        settings = json.loads(inbound.get('settings') or '{}')
+        settings['clients'] = clients
+        update = dict(inbound)
+        update['settings'] = json.dumps(settings)
+        update.pop('clientStats', None)
+        self.xui.update_inbound(inbound['id'], update)
+
+    def list_clients(self):
+        return self._inbound_clients(self._managed_inbound())
+
+    def add_clients(self, clients):
+        # Batch add: all new clients go to the panel in a single addClient call. Emails already
+        # on the panel or in the roster are skipped, never replaced: their UUID and Hysteria
+        # password are what existing links carry (use update_clients() to change fields).
+        passwords = {c["email"]: c["hysteria_password"] for c in clients if c.get("hysteria_password")}
+        clients = [self._client_entry(c) for c in clients]
+        inbound = self._managed_inbound()
+        taken = {c.get('email') for c in self._inbound_clients(inbound)}
+        taken.update(c["email"] for c in self.load_roster())
+        taken.add(self.DEFAULT_CLIENT_EMAIL)
+        new, skipped = [], []
+        for client in clients:
+            if client["email"] in taken:
+                skipped.append(client["email"])
+                continue
+            taken.add(client["email"])
+            new.append(client)
+        if skipped:
+            print(f"Skipping {len(skipped)} existing clients: {', '.join(skipped)}")
+        if new:
+            self.xui.add_clients(inbound['id'], new)
+            roster = self.load_roster()
+            roster += [dict(c, hysteria_password=passwords.get(c["email"])) for c in new]
+            self.save_roster(roster)
+        return new
+
+    def update_clients(self, clients):
+        # Patches only the given fields of each client (matched by email)
+        changes = {c["email"]: c for c in clients}
+        inbound = self._managed_inbound()
+        live = self._inbound_clients(inbound)
+        updated = []
+        for client in live:
+            patch = changes.get(client.get('email'))
+            if patch:
+                client.update({k: v for k, v in patch.items() if k in self.CLIENT_FIELDS})
+                updated.append(client)
+        if updated:
+            self._push_clients(inbound, live)
+        roster = self.load_roster()
+        for client in roster:
+            if client["email"] in changes:
+                client.update({k: v for k, v in changes[client["email"]].items() if k in self.CLIENT_FIELDS})
+        self.save_roster(roster)
+        return updated
+
+    def remove_clients(self, emails):
+        emails = set(emails) - {self.DEFAULT_CLIENT_EMAIL}
+        inbound = self._managed_inbound()
+        live = self._inbound_clients(inbound)
+        kept = [c for c in live if c.get('email') not in emails]
+        if len(kept) != len(live):
+            self._push_clients(inbound, kept)
+        self.save_roster([c for c in self.load_roster() if c["email"] not in emails])
+        if self.hysteria_userpass and emails:
+            try:
+                self.kick_hysteria(emails)
+            except Exception as e:
+                print(f"Could not kick removed users from Hysteria2: {e}")
+        return len(live) - len(kept)
+
+    def sync_clients(self):
+        # Idempotent: makes the inbound's client list match the roster file, with at most
+        # one API call and none when already in sync. Unknown live fields are preserved.
+        inbound = self._managed_inbound()
+        live = self._inbound_clients(inbound)
+        desired = self._merge_clients(live, self.desired_clients())
+        if desired == live:
+            return False
+        self._push_clients(inbound, desired)
+        return True
+
+    # Everything get_client_links() reads from .env; the roster file is hashed separately
+    LINK_ENV_KEYS = (
+        "VLESS_UUID", "REALITY_PUBLIC_KEY", "REALITY_SHORT_ID", "REALITY_SNI", "SERVER_IP",
+        "HYSTERIA_PASSWORD", "HYSTERIA_OBFS_PASSWORD", "HYSTERIA_PORT", "HYSTERIA_AUTH",
+    )
+
+    def links_fingerprint(self):
+        h = hashlib.sha256()
+        for key in self.LINK_ENV_KEYS:
+            h.update(f"{key}={self.get_env(key)}\0".encode())
+        try:
+            st = os.stat(self.roster_path)
+            h.update(f"{self.roster_path}:{st.st_mtime_ns}:{st.st_size}".encode())
+        except FileNotFoundError:
+            pass
+        return h.hexdigest()
 
     def get_client_links(self):
-        vless_uuid = self.get_env("VLESS_UUID")
+        fingerprint = self.links_fingerprint()
+        if self._links_cache and self._links_cache[0] == fingerprint:
+            return [dict(item) for item in self._links_cache[1]]
+        links = self._build_client_links()
+        self._links_cache = (fingerprint, links)
+        return [dict(item) for item in links]
+
+    def _build_client_links(self):
         pub_key = self.get_env("REALITY_PUBLIC_KEY")
         short_id = self.get_env("REALITY_SHORT_ID")
         sni = self.get_env("REALITY_SNI", "www.microsoft.com")
@@ -405,83 +1166,229 @@ finally:
         else:
             uri_ip = server_ip
             
-        vless_link = f"vless://{vless_uuid}@{uri_ip}:443?type=tcp&security=reality&pbk={pub_key}&fp=chrome&sni={sni}&sid={short_id}&spx=%2F&flow=xtls-rprx-vision#VPN-VLESS-REALITY"
+        links = []
+        for client in self.desired_clients():
+            if not client["enable"]:
+                continue
+            if client["email"] == self.DEFAULT_CLIENT_EMAIL:
+                name, label = "VPN-VLESS-REALITY", "VLESS + REALITY"
+            else:
+                name, label = f"VPN-VLESS-{client['email']}", f"VLESS + REALITY ({client['email']})"
+            vless_link = f"vless://{client['id']}@{uri_ip}:443?type=tcp&security=reality&pbk={pub_key}&fp=chrome&sni={sni}&sid={short_id}&spx=%2F&flow={client['flow']}#{name}"
+            links.append({"link": vless_link, "label": label, "email": client["email"]})
+
         hysteria_link = f"hysteria2://{hysteria_pwd}@{uri_ip}:{hysteria_port}?insecure=1&sni={sni}&obfs=salamander&obfs-password={hysteria_obfs}#VPN-Hysteria2"
-        
+        if self.hysteria_userpass:
+            # Per-user logins: each client gets its own Hysteria2 link
+            for email, password in self.hysteria_users().items():
+                name = "VPN-Hysteria2" if email == self.DEFAULT_CLIENT_EMAIL else f"VPN-Hysteria2-{email}"
+                label = "Hysteria 2" if email == self.DEFAULT_CLIENT_EMAIL else f"Hysteria 2 ({email})"
+                auth = f"{quote(email, safe='')}:{quote(password, safe='')}"
+                link = f"hysteria2://{auth}@{uri_ip}:{hysteria_port}?insecure=1&sni={sni}&obfs=salamander&obfs-password={hysteria_obfs}#{name}"
+                links.append({"link": link, "label": label, "email": email})
+            return links
+        # One shared Hysteria2 credential: it belongs in every client's subscription
+        links.append({"link": hysteria_link, "label": "Hysteria 2", "email": self.DEFAULT_CLIENT_EMAIL, "shared": True})
+        return links
+
+    def subscription_token(self, client):
+        # The roster's subId if set, else derived from the client's UUID (stable and as secret as the UUID)
+        return client["subId"] or hashlib.sha256(f"sub:{client['id']}".encode()).hexdigest()[:24]
+
+    def subscription_url(self, client):
+        server_ip = self.get_env("SERVER_IP", "127.0.0.1")
+        host = f"[{server_ip}]" if ":" in server_ip else server_ip
+        base = self.get_env("SUB_PUBLIC_URL") or f"http://{host}:{self.get_env('SUB_PORT', '2097')}"
+        return f"{base.rstrip('/')}/sub/{self.subscription_token(client)}"
+
+    def open_subscription_port(self):
+        # Same ufw handling as change_port. A loopback SUB_HOST sits behind a reverse proxy and stays closed.
+        if self.get_env("SUB_HOST", "0.0.0.0") in ("127.0.0.1", "::1", "localhost") or not shutil.which("ufw"):
+            return
+        subprocess.run(["ufw", "allow", f"{self.get_env('SUB_PORT', '2097')}/tcp", "comment", "Subscriptions (Auto)"], check=False)
+
+    # Where backups were written before BACKUP_DIR existed. If BACKUP_DIR points elsewhere,
+    # archives left there are still listed, rotated and searched for incremental bases.
+    LEGACY_BACKUP_DIR = "/root/VPN-backups"
+
+    @property
+    def backup_dir(self):
+        return self.get_env("BACKUP_DIR", self.LEGACY_BACKUP_DIR)
+
+    def backup_dirs(self):
+        dirs = [self.backup_dir]
+        legacy = self.get_env("BACKUP_LEGACY_DIR", self.LEGACY_BACKUP_DIR)
+        if legacy and os.path.abspath(legacy) != os.path.abspath(self.backup_dir):
+            dirs.append(legacy)
+        return [d for d in dirs if os.path.isdir(d)]
+
+    def _backup_sources(self):
         return [
-            {"link": vless_link, "label": "VLESS + REALITY"},
-            {"link": hysteria_link, "label": "Hysteria 2"}
+            (".env", self.env_path),
+            ("hysteria2", os.path.join(self.project_dir, "hysteria2")),
+            ("fail2ban", os.path.join(self.project_dir, "configs", "fail2ban")),
+            ("clients.json", self.roster_path),
         ]
 
-    def create_backup(self):
-        backup_dir = "/root/VPN-backups"
+    def _db_volume_sources(self):
+        # Everything in the 3xui-db volume except the live DB, which is snapshotted separately
+        db = self.db
+        if not db:
+            return [], None
+        db_dir = os.path.dirname(db.db_path)
+        db_name = os.path.basename(db.db_path)
+        sources = []
+        if os.path.isdir(db_dir):
+            for name in sorted(os.listdir(db_dir)):
+                if name.startswith(db_name):
+                    continue
+                sources.append((f"3xui-db/{name}", os.path.join(db_dir, name)))
+        return sources, db.db_path
+
+    def list_backups(self):
+        archives = [os.path.join(d, f) for d in self.backup_dirs() for f in os.listdir(d) if f.endswith(backup.ARCHIVE_EXTENSIONS)]
+        return sorted(archives, key=os.path.getmtime)
+
+    def _find_backup(self, name, search_dirs):
+        for directory in search_dirs:
+            for ext in backup.ARCHIVE_EXTENSIONS:
+                path = os.path.join(directory, name + ext)
+                if os.path.exists(path):
+                    return path
+        return None
+
+    def create_backup(self, incremental=False, compression=None):
+        # Streams sources directly into a compressed tar (zstd when available); the DB is
+        # captured with SQLite's online backup API. Incremental backups store only files and
+        # DB pages changed since the last full backup.
+        backup_dir = self.backup_dir
         os.makedirs(backup_dir, exist_ok=True)
+        compression = compression or self.get_env("BACKUP_COMPRESSION", "") or backup.default_compression()
+
+        base_manifest = None
+        if incremental:
+            for path in reversed(self.list_backups()):
+                manifest = backup.load_manifest(path)
+                if manifest and manifest["type"] == "full":
+                    base_manifest = manifest
+                    break
+            if not base_manifest:
+                print("No full backup with a manifest found, creating a full backup instead.")
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"VPN-backup-{timestamp}"
-        backup_path = os.path.join(backup_dir, backup_name)
-        
-        os.makedirs(backup_path, exist_ok=True)
-        
-        # .env
-        shutil.copy(self.env_path, os.path.join(backup_path, ".env"))
-        
-        # hysteria2
-        shutil.copytree(os.path.join(self.project_dir, "hysteria2"), os.path.join(backup_path, "hysteria2"), dirs_exist_ok=True)
-        
-        # fail2ban
-        fail2ban_source = os.path.join(self.project_dir, "configs", "fail2ban")
-        if os.path.exists(fail2ban_source):
-            shutil.copytree(fail2ban_source, os.path.join(backup_path, "fail2ban"), dirs_exist_ok=True)
-            
-        # 3xui-db
-        db_path_dest = os.path.join(backup_path, "3xui-db")
-        os.makedirs(db_path_dest, exist_ok=True)
-        subprocess.run(["docker", "run", "--rm", "-v", "3xui-db:/source:ro", "-v", f"{db_path_dest}:/backup", "alpine", "sh", "-c", "cp -a /source/* /backup/"], check=False)
-        
-        # Archive
-        archive_path = f"{backup_path}.tar.gz"
-        with tarfile.open(archive_path, "w:gz") as tar:
-            tar.add(backup_path, arcname=os.path.basename(backup_path))
-            
-        shutil.rmtree(backup_path)
-        
-        # Clean old
-        backups = sorted([os.path.join(backup_dir, f) for f in os.listdir(backup_dir) if f.endswith(".tar.gz")], key=os.path.getmtime)
-        while len(backups) > 5:
-            os.remove(backups.pop(0))
-            
+        backup_name = f"VPN-backup-{timestamp}" + ("-inc" if base_manifest else "")
+        archive_path = os.path.join(backup_dir, backup_name + backup.archive_extension(compression))
+
+        volume_sources, db_path = self._db_volume_sources()
+        if not db_path:
+            print("Warning: Could not find 3xui-db volume, the panel DB is not included.")
+        backup.write_backup(archive_path, backup_name, self._backup_sources() + volume_sources,
+                            db_path=db_path, compression=compression, base_manifest=base_manifest)
+        self._prune_backups(keep=5)
         return archive_path
 
+    def _prune_backups(self, keep=5):
+        archives = self.list_backups()
+        kept = archives[-keep:]
+        # Never drop the full backup a kept incremental depends on
+        needed = set()
+        for path in kept:
+            manifest = backup.load_manifest(path)
+            if manifest and manifest.get("base"):
+                needed.add(manifest["base"])
+        for path in archives[:-keep]:
+            name = os.path.basename(backup.strip_extension(path))
+            if name in needed:
+                continue
+            os.remove(path)
+            if os.path.exists(backup.sidecar_path(path)):
+                os.remove(backup.sidecar_path(path))
+
     def restore_backup(self, archive_path):
-        temp_dir = f"/tmp/VPN-restore-{int(datetime.now().timestamp())}"
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        with tarfile.open(archive_path, "r:gz") as tar:
-            tar.extractall(path=temp_dir)
-            
-        inner_dirs = os.listdir(temp_dir)
-        if not inner_dirs:
-            raise Exception("Archive is empty")
-        
-        restore_src = os.path.join(temp_dir, inner_dirs[0])
-        
+        temp_dir = tempfile.mkdtemp(prefix="VPN-restore-")
+        try:
+            restore_src, manifest = backup.extract_backup(archive_path, os.path.join(temp_dir, "archive"))
+            if manifest and manifest["type"] == "incremental":
+                base_path = self._find_backup(manifest["base"], [os.path.dirname(os.path.abspath(archive_path))] + self.backup_dirs())
+                if not base_path:
+                    raise Exception(f"Incremental backup needs its full backup {manifest['base']}, which was not found")
+                base_src, _ = backup.extract_backup(base_path, os.path.join(temp_dir, "base"))
+                backup.apply_incremental(base_src, restore_src, manifest)
+                restore_src = base_src
+            self._restore_tree(restore_src)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            # Also after a failed restore: the panel was stopped for the DB swap
+            subprocess.run(["docker", "compose", "up", "-d", "--remove-orphans"], cwd=self.project_dir, check=False)
+
+    def _restore_tree(self, restore_src):
         if os.path.exists(os.path.join(restore_src, ".env")):
-            shutil.copy(os.path.join(restore_src, ".env"), self.env_path)
+            self.env.replace_with(os.path.join(restore_src, ".env"))
+            load_dotenv(self.env_path, override=True)
+            self._links_cache = None
             
         if os.path.exists(os.path.join(restore_src, "hysteria2")):
             shutil.copytree(os.path.join(restore_src, "hysteria2"), os.path.join(self.project_dir, "hysteria2"), dirs_exist_ok=True)
+
+        if os.path.exists(os.path.join(restore_src, "clients.json")):
+            shutil.copy(os.path.join(restore_src, "clients.json"), self.roster_path)
             
-        if os.path.exists(os.path.join(restore_src, "3xui-db")):
-            subprocess.run(["docker", "volume", "create", "3xui-db"], check=False)
-            subprocess.run(["docker", "run", "--rm", "-v", "3xui-db:/dest", "-v", f"{os.path.join(restore_src, '3xui-db')}:/source", "alpine", "sh", "-c", "cp -a /source/* /dest/"], check=False)
+        db_src = os.path.join(restore_src, "3xui-db")
+        if os.path.exists(db_src):
+            docker = self.docker
+            try:
+                docker.create_volume("3xui-db")
+            except Exception as e:
+                print(f"Failed to create volume 3xui-db: {e}")
+            self._db = None
+            db = self.db
+            if db:
+                # Swap the DB file with the panel stopped; stale WAL/SHM files would corrupt it
+                try:
+                    docker.stop("3x-ui")
+                except Exception as e:
+                    print(f"Failed to stop 3x-ui: {e}")
+                try:
+                    db_dir = os.path.dirname(db.db_path)
+                    os.makedirs(db_dir, exist_ok=True)
+                    for name in self._restorable_db_files(db_src):
+                        dest = os.path.join(db_dir, name)
+                        shutil.copy2(os.path.join(db_src, name), f"{dest}.restore")
+                        os.replace(f"{dest}.restore", dest)
+                    for suffix in backup.DB_SIDE_SUFFIXES:
+                        if os.path.exists(db.db_path + suffix):
+                            os.remove(db.db_path + suffix)
+                finally:
+                    try:
+                        docker.start("3x-ui")
+                    except Exception as e:
+                        print(f"Failed to start 3x-ui: {e}")
+            else:
+                subprocess.run(["docker", "run", "--rm", "-v", "3xui-db:/dest", "-v", f"{db_src}:/source", "alpine", "sh", "-c", "cp -a /source/* /dest/"], check=False)
             
         if os.path.exists(os.path.join(restore_src, "fail2ban")):
             fail2ban_dest = os.path.join(self.project_dir, "configs", "fail2ban")
             os.makedirs(fail2ban_dest, exist_ok=True)
             shutil.copytree(os.path.join(restore_src, "fail2ban"), fail2ban_dest, dirs_exist_ok=True)
-            
-        shutil.rmtree(temp_dir)
-        subprocess.run(["docker", "compose", "up", "-d", "--remove-orphans"], cwd=self.project_dir, check=False)
+
+    @staticmethod
+    def _restorable_db_files(db_src):
+        # Archives from the old `cp -a /source/*` backup hold the whole volume: the bind-mounted
+        # access.log directory and possibly WAL/SHM files. Only the database files are restored;
+        # a copied WAL is checkpointed into its DB first so its committed pages are not lost.
+        names = []
+        for name in sorted(os.listdir(db_src)):
+            path = os.path.join(db_src, name)
+            if not name.endswith(".db") or not os.path.isfile(path):
+                continue
+            if os.path.exists(path + "-wal"):
+                conn = sqlite3.connect(path)
+                try:
+                    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                finally:
+                    conn.close()
+            names.append(name)
+        return names
 
     def change_port(self, new_port):
         old_port = self.get_env("HYSTERIA_PORT", "443")
@@ -492,36 +1399,119 @@ finally:
         subprocess.run(["ufw", "allow", f"{new_port}/udp", "comment", "Hysteria2 (Auto)"], check=False)
         
         # Reality inbound might be affected if SNI changes, but here we only changed Hysteria PORT
-        # Hysteria Config update
+        self.apply_hysteria_config()
+
+    def hysteria_model(self):
+        return hysteria_config.HysteriaConfig(
+            port=int(self.get_env("HYSTERIA_PORT", "443")),
+            auth=hysteria_config.AuthConfig(password=self.get_env("HYSTERIA_PASSWORD"), userpass=self.hysteria_users()),
+            masquerade=hysteria_config.MasqueradeConfig(target=self.get_env("REALITY_SNI", "www.microsoft.com")),
+            bandwidth=hysteria_config.BandwidthConfig(
+                up_mbps=int(self.get_env("HYSTERIA_UP_MBPS", "100")),
+                down_mbps=int(self.get_env("HYSTERIA_DOWN_MBPS", "100")),
+            ),
+            quic=hysteria_config.QUICConfig(
+                stream_window=int(self.get_env("HYSTERIA_STREAM_WINDOW", str(8 * hysteria_config.MIB))),
+                conn_window=int(self.get_env("HYSTERIA_CONN_WINDOW", str(20 * hysteria_config.MIB))),
+            ),
+            obfs=hysteria_config.ObfsConfig(password=self.get_env("HYSTERIA_OBFS_PASSWORD")),
+            traffic_stats=hysteria_config.TrafficStatsConfig(
+                listen=self.get_env("HYSTERIA_STATS_LISTEN", "127.0.0.1:25413"),
+                secret=self.hysteria_stats_secret(),
+            ),
+        )
+
+    def hysteria_stats_secret(self):
+        secret = self.get_env("HYSTERIA_STATS_SECRET")
+        if not secret:
+            secret = secrets.token_urlsafe(24)
+            self.set_env("HYSTERIA_STATS_SECRET", secret)
+        return secret
+
+    @property
+    def hysteria_userpass(self):
+        return self.get_env("HYSTERIA_AUTH", "password") == "userpass"
+
+    def hysteria_users(self):
+        # userpass mode: one Hysteria login per enabled client, named by email, so the stats
+        # API reports traffic under the same names as Xray
+        if not self.hysteria_userpass:
+            return {}
+        users = {self.DEFAULT_CLIENT_EMAIL: self.get_env("HYSTERIA_PASSWORD")}
+        passwords = self.roster_hysteria_passwords()
+        for client in self.load_roster():
+            if client["enable"] and passwords.get(client["email"]):
+                users[client["email"]] = passwords[client["email"]]
+        return users
+
+    def hysteria_stats(self):
+        return hysteria_stats.HysteriaStatsClient(
+            f"http://{self.get_env('HYSTERIA_STATS_LISTEN', '127.0.0.1:25413')}", self.hysteria_stats_secret())
+
+    def kick_hysteria(self, emails):
+        # Drops live sessions; a client that is still in the roster can reconnect. Only userpass
+        # auth names sessions by email: with password auth every session is the shared "user".
+        if not self.hysteria_userpass:
+            raise Exception("Kicking needs HYSTERIA_AUTH=userpass; password auth has no per-user sessions")
+        self.hysteria_stats().kick(emails)
+
+    def render_hysteria_config(self):
+        # Returns True when config.yaml content changed; an invalid model raises before anything is written
         h2_config = os.path.join(self.project_dir, "hysteria2", "config.yaml")
-        h2_template = f"{h2_config}.template"
-        
-        if os.path.exists(h2_template):
-            with open(h2_template, 'r') as f:
-                content = f.read()
-            content = content.replace("__HYSTERIA_PASSWORD__", self.get_env("HYSTERIA_PASSWORD"))
-            content = content.replace("__HYSTERIA_UP__", f"{self.get_env('HYSTERIA_UP_MBPS', '100')} mbps")
-            content = content.replace("__HYSTERIA_DOWN__", f"{self.get_env('HYSTERIA_DOWN_MBPS', '100')} mbps")
-            content = content.replace("__HYSTERIA_MASQUERADE__", self.get_env("REALITY_SNI", "www.microsoft.com"))
-            content = content.replace("__HYSTERIA_OBFS_PASSWORD__", self.get_env("HYSTERIA_OBFS_PASSWORD", ""))
-            content = content.replace("__HYSTERIA_PORT__", str(new_port))
-            with open(h2_config, 'w') as f:
-                f.write(content)
-        else:
-            if os.path.exists(h2_config):
-                with open(h2_config, 'r') as f:
-                    content = f.read()
-                content = content.replace(f"listen: :{old_port}", f"listen: :{new_port}")
-                with open(h2_config, 'w') as f:
-                    f.write(content)
-                    
-        subprocess.run(["docker", "compose", "--env-file", ".env", "restart", "hysteria2"], cwd=self.project_dir, check=False)
+        content = self.hysteria_model().to_yaml()
+
+        previous = None
+        if os.path.exists(h2_config):
+            with open(h2_config, 'r') as f:
+                previous = f.read()
+        if content == previous:
+            return False
+        tmp_path = f"{h2_config}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(content)
+        os.replace(tmp_path, h2_config)
+        return True
+
+    def apply_hysteria_config(self):
+        # Restart hysteria2 only if its rendered config changed
+        if not self.render_hysteria_config():
+            return False
+        failed = {name: error for name, error in self.restart_services(["hysteria2"]).items() if error}
+        if failed:
+            raise Exception(f"Failed to restart hysteria2: {failed}")
+        self.readiness().wait([ReadinessProbe.container_process(self.docker, "hysteria2", "hysteria")], description="hysteria2")
+        return True
+
+    def tune_hysteria(self, apply=True):
+        # Measures link capacity and client RTTs, derives bandwidth hints and BDP-sized QUIC
+        # windows, and only rewrites .env (and reloads hysteria2) on a material change
+        link_mbps = int(self.get_env("HYSTERIA_LINK_MBPS", "0")) or hysteria_config.link_capacity_mbps()
+        rtts = hysteria_config.client_rtts_ms()
+        if len(rtts) < 5:
+            rtts += hysteria_config.probe_rtts_ms([("1.1.1.1", 443), ("8.8.8.8", 443), ("9.9.9.9", 443)])
+        tuned = hysteria_config.autotune(link_mbps, rtts, share=float(self.get_env("HYSTERIA_BANDWIDTH_SHARE", "0.9")))
+        if not tuned:
+            raise Exception("Could not measure link capacity or RTT; set HYSTERIA_LINK_MBPS")
+        model = self.hysteria_model()
+        current = {"up_mbps": model.bandwidth.up_mbps, "down_mbps": model.bandwidth.down_mbps,
+                   "stream_window": model.quic.stream_window, "conn_window": model.quic.conn_window}
+        tuned["link_mbps"] = link_mbps
+        tuned["changed"] = hysteria_config.material_change(current, tuned, float(self.get_env("HYSTERIA_TUNE_THRESHOLD", "0.2")))
+        if apply and tuned["changed"]:
+            self.update_env({
+                "HYSTERIA_UP_MBPS": str(tuned["up_mbps"]),
+                "HYSTERIA_DOWN_MBPS": str(tuned["down_mbps"]),
+                "HYSTERIA_STREAM_WINDOW": str(tuned["stream_window"]),
+                "HYSTERIA_CONN_WINDOW": str(tuned["conn_window"]),
+            })
+            self.apply_hysteria_config()
+        return tuned
 
     def change_xui_port(self, new_port):
         old_port = self.get_env("XUI_PORT", "2053")
         self.set_env("XUI_PORT", str(new_port))
         
-        subprocess.run(["docker", "exec", "3x-ui", "/app/x-ui", "setting", "-port", str(new_port)], check=False)
+        self.docker.exec_run("3x-ui", ["/app/x-ui", "setting", "-port", str(new_port)])
         
         subprocess.run(["ufw", "allow", f"{new_port}/tcp", "comment", "3x-ui Panel (new)"], check=False)
         subprocess.run(["ufw", "delete", "allow", f"{old_port}/tcp"], check=False)
@@ -535,28 +1525,82 @@ finally:
                 f.write(content)
             subprocess.run(["systemctl", "restart", "fail2ban"], check=False)
             
-        subprocess.run(["docker", "restart", "3x-ui"], check=False)
+        self.restart_xui()
 
-    def update_geodata(self):
-        geoip_url = "https://github.com/Loyalsoldier/v2ray-rules-dat/releases/latest/download/geoip.dat"
-        geosite_url = "https://github.com/Loyalsoldier/v2ray-rules-dat/releases/latest/download/geosite.dat"
-        
-        subprocess.run(["docker", "exec", "3x-ui", "bash", "-c", 
-            f"wget -O /usr/local/x-ui/bin/geoip.dat {geoip_url} && "
-            f"wget -O /usr/local/x-ui/bin/geosite.dat {geosite_url} && "
-            f"wget -O /usr/local/x-ui/bin/v2ray-rules-dat/geoip.dat {geoip_url} && "
-            f"wget -O /usr/local/x-ui/bin/v2ray-rules-dat/geosite.dat {geosite_url}"
+    # Xray in the 3x-ui image reads geodata from both directories
+    GEODATA_DIRS = ("/usr/local/x-ui/bin", "/usr/local/x-ui/bin/v2ray-rules-dat")
+
+    def _installed_geodata_hashes(self):
+        paths = [f"{d}/{name}" for d in self.GEODATA_DIRS for name in geodata.GEODATA_FILES]
+        _, stdout, _ = self.docker.exec_run("3x-ui", ["sha256sum"] + paths)
+        hashes = {}
+        for line in stdout.decode().splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                hashes[parts[1]] = parts[0]
+        return hashes
+
+    def _install_geodata(self, name, src):
+        # Copy once into the container under a temp name, then rename into place and hardlink
+        # the second location, so Xray never sees a half-written file
+        primary, secondary = (f"{d}/{name}" for d in self.GEODATA_DIRS)
+        self.docker.put_file("3x-ui", self.GEODATA_DIRS[0], f"{name}.new", src)
+        self.docker.exec_run("3x-ui", ["sh", "-c",
+            f"mv -f {primary}.new {primary} && mkdir -p {self.GEODATA_DIRS[1]} && "
+            f"(ln -f {primary} {secondary}.new 2>/dev/null || cp {primary} {secondary}.new) && "
+            f"mv -f {secondary}.new {secondary}"
         ], check=True)
-        
-        subprocess.run(["docker", "restart", "3x-ui"], check=False)
+
+    def update_geodata(self):
+        updater = geodata.GeoDataUpdater(
+            os.path.join(self.project_dir, "data", "geodata"),
+            base_url=self.get_env("GEODATA_BASE_URL", geodata.DEFAULT_BASE_URL),
+        )
+        updater.update()
+
+        # Install whatever differs from the container, which also covers a recreated container
+        installed = self._installed_geodata_hashes()
+        updated = []
+        for name in geodata.GEODATA_FILES:
+            want = updater.sha256(name)
+            if all(installed.get(f"{d}/{name}") == want for d in self.GEODATA_DIRS):
+                continue
+            self._install_geodata(name, updater.path(name))
+            updated.append(name)
+
+        if updated:
+            self.reload_xray()
+        return updated
+
+# Every manager step, panel request and subprocess gets a timing span (see --perf and the bot's /perf)
+tracing.instrument(VPNManager, "manager.", exclude=("get_env",))
+tracing.instrument_subprocess(sys.modules[__name__])
 
 if __name__ == "__main__":
     import argparse
     parser = argparse.ArgumentParser(description="VPN Manager")
     parser.add_argument("--generate-keys", action="store_true")
+    parser.add_argument("--rotate-keys", action="store_true", help="Generate new keys and apply them to the panel and Hysteria2")
     parser.add_argument("--setup-inbound", action="store_true")
+    parser.add_argument("--plan", action="store_true", help="Show what --setup-inbound would change, without applying")
     parser.add_argument("--update-geodata", action="store_true")
     parser.add_argument("--show-clients", action="store_true")
+    parser.add_argument("--sync-clients", action="store_true", help="Push the clients.json roster to the inbound")
+    parser.add_argument("--add-clients", metavar="FILE", help="Add clients from a JSON list in one API call")
+    parser.add_argument("--remove-clients", metavar="EMAIL", nargs="+")
+    parser.add_argument("--mint-clients", type=int, metavar="N", help="Print N new client credentials as JSON (for --add-clients)")
+    parser.add_argument("--route-add", metavar=("SET", "ENTRY"), nargs="+", help="Add domains, geosite:/geoip: tags or CIDRs to a routing rule set and apply")
+    parser.add_argument("--route-remove", metavar=("SET", "ENTRY"), nargs="+", help="Remove entries from a routing rule set and apply")
+    parser.add_argument("--route-outbound", default=None, help="Outbound tag for a new rule set created by --route-add")
+    parser.add_argument("--show-routing", action="store_true", help="Print the compiled routing rules")
+    parser.add_argument("--backup", choices=["full", "incremental"], help="Create a backup in BACKUP_DIR")
+    parser.add_argument("--serve-subscriptions", action="store_true", help="Serve client subscriptions on SUB_HOST:SUB_PORT (blocks)")
+    parser.add_argument("--bench-sni", metavar="HOST", nargs="*", help="Benchmark REALITY dest candidates (default: SNI_CANDIDATES or a built-in list)")
+    parser.add_argument("--apply-sni", action="store_true", help="With --bench-sni: switch to the fastest valid dest and its extra serverNames")
+    parser.add_argument("--render-hysteria", action="store_true", help="Write hysteria2/config.yaml from .env without restarting the container")
+    parser.add_argument("--tune-hysteria", action="store_true", help="Measure link/RTT and retune Hysteria2 bandwidth and QUIC windows")
+    parser.add_argument("--fleet", choices=sorted(fleet.OPERATIONS), help="Run an operation on every node in FLEET_FILE in parallel")
+    parser.add_argument("--perf", action="store_true", help="Print p50/p95 timings per operation (from TRACE_FILE if set, else this run)")
     
     args = parser.parse_args()
     
@@ -566,13 +1610,73 @@ if __name__ == "__main__":
     if args.generate_keys:
         manager.generate_keys()
         print("Keys generated.")
+    if args.rotate_keys:
+        manager.rotate_keys()
+        print("Keys rotated.")
+    if args.plan:
+        print(manager.format_plan(manager.reconcile(dry_run=True)))
     if args.setup_inbound:
         manager.setup_inbound()
         print("Inbound configured.")
     if args.update_geodata:
-        manager.update_geodata()
-        print("Geodata updated.")
+        updated = manager.update_geodata()
+        print(f"Geodata updated: {', '.join(updated)}." if updated else "Geodata already up to date.")
+    if args.mint_clients:
+        print(json.dumps(manager.mint_clients(args.mint_clients), indent=2))
+    if args.add_clients:
+        with open(args.add_clients, 'r') as f:
+            added = manager.add_clients(json.load(f))
+        print(f"Added {len(added)} clients.")
+    if args.remove_clients:
+        print(f"Removed {manager.remove_clients(args.remove_clients)} clients.")
+    if args.sync_clients:
+        print("Clients synced." if manager.sync_clients() else "Clients already in sync.")
+    if args.route_add or args.route_remove:
+        rule_set, *entries = args.route_add or args.route_remove
+        if args.route_add:
+            changed, _, actions = manager.update_routing(rule_set, add=entries, outbound=args.route_outbound)
+        else:
+            _, changed, actions = manager.update_routing(rule_set, remove=entries)
+        print(f"{rule_set}: {', '.join(changed) if changed else 'no entries changed'}")
+        print(manager.format_plan(actions))
+    if args.show_routing:
+        rules, stats = manager.load_routing_policy().compile()
+        print(json.dumps(rules, indent=2))
+        print(f"{stats['input']} entries compiled into {stats['output']}")
+    if args.backup:
+        print(f"Backup created: {manager.create_backup(incremental=args.backup == 'incremental')}")
+    if args.bench_sni is not None:
+        ranking = manager.bench_sni(args.bench_sni)
+        print(sni_bench.format_ranking(ranking))
+        if args.apply_sni:
+            dest, extra = manager.apply_sni(ranking)
+            print(f"REALITY dest: {dest}:443, serverNames: {', '.join([dest] + extra)}")
+    if args.render_hysteria:
+        print("Hysteria2 config rendered." if manager.render_hysteria_config() else "Hysteria2 config already up to date.")
+    if args.tune_hysteria:
+        tuned = manager.tune_hysteria()
+        print(f"Link {tuned['link_mbps']} Mbps, p90 RTT {tuned['rtt_ms']:.0f} ms over {tuned['samples']} samples -> "
+              f"bandwidth {tuned['up_mbps']} mbps, windows {tuned['stream_window'] >> 20}/{tuned['conn_window'] >> 20} MiB"
+              + (" (applied)" if tuned["changed"] else " (no material change)"))
+    if args.fleet:
+        nodes = fleet.Fleet.load(manager.fleet_path, manager)
+        results = nodes.run(args.fleet, progress=lambda name, status, result: print(f"[{name}] {status}"))
+        print(nodes.format_results(args.fleet, results))
     if args.show_clients:
         links = manager.get_client_links()
         for link in links:
             print(f"--- {link['label']} ---\n{link['link']}\n")
+        if manager.get_env("SUB_PORT"):
+            for client in manager.desired_clients():
+                print(f"Subscription ({client['email']}): {manager.subscription_url(client)}")
+    if args.perf:
+        tracing.tracer.flush()
+        trace_file = manager.get_env("TRACE_FILE")
+        records = tracing.load_jsonl(trace_file) if trace_file and os.path.exists(trace_file) else tracing.tracer.records()
+        print(tracing.format_stats(tracing.summarize(records)))
+    if args.serve_subscriptions:
+        import subscription
+        server = subscription.SubscriptionServer(manager, host=manager.get_env("SUB_HOST", "0.0.0.0"), port=manager.get_env("SUB_PORT", "2097"))
+        manager.open_subscription_port()
+        print(f"Serving subscriptions on port {server.port}")
+        server.httpd.serve_forever()
@@ -0,0 +1,167 @@
+import time
+import socket
+import threading
+from collections import deque
+
+SPARK = "▁▂▃▄▅▆▇█"
+
+def _recv_exact(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise Exception("SOCKS proxy closed the connection")
+        data += chunk
+    return data
+
+def socks5_connect(host, port, target_host, target_port, timeout=5):
+    # Returns (socket tunnelled to target, handshake latency in ms). No auth, domain ATYP.
+    start = time.perf_counter()
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        sock.sendall(b"\x05\x01\x00")
+        if _recv_exact(sock, 2) != b"\x05\x00":
+            raise Exception("SOCKS proxy refused the no-auth method")
+        handshake_ms = (time.perf_counter() - start) * 1000
+        name = target_host.encode()
+        sock.sendall(b"\x05\x01\x00\x03" + bytes([len(name)]) + name + target_port.to_bytes(2, "big"))
+        reply = _recv_exact(sock, 4)
+        if reply[1] != 0:
+            raise Exception(f"SOCKS CONNECT to {target_host}:{target_port} failed (code {reply[1]})")
+        # Skip the bound address
+        if reply[3] == 1:
+            _recv_exact(sock, 4 + 2)
+        elif reply[3] == 4:
+            _recv_exact(sock, 16 + 2)
+        else:
+            _recv_exact(sock, _recv_exact(sock, 1)[0] + 2)
+        return sock, handshake_ms
+    except BaseException:
+        sock.close()
+        raise
+
+def probe(host, port, fetch_host, fetch_port=80, fetch_path="/cdn-cgi/trace", timeout=5):
+    # One check: SOCKS handshake latency plus a small HTTP fetch through the tunnel
+    start = time.perf_counter()
+    result = {"ts": time.time(), "ok": False, "handshake_ms": None, "fetch_ms": None, "error": None}
+    try:
+        sock, result["handshake_ms"] = socks5_connect(host, port, fetch_host, fetch_port, timeout)
+        with sock:
+            sock.sendall(f"GET {fetch_path} HTTP/1.1\r\nHost: {fetch_host}\r\nConnection: close\r\n\r\n".encode())
+            status = sock.recv(64)
+            if not status.startswith(b"HTTP/1."):
+                raise Exception(f"Unexpected response through Warp: {status[:32]!r}")
+        result["fetch_ms"] = (time.perf_counter() - start) * 1000
+        result["ok"] = True
+    except Exception as e:
+        result["error"] = str(e) or e.__class__.__name__
+    return result
+
+class WarpHealthMonitor:
+    # Probes the Warp SOCKS proxy on a fixed period. After `fail_after` consecutive bad
+    # checks (error or fetch slower than `max_latency_ms`) it calls on_change(True) to fail
+    # over; after `recover_after` consecutive good checks it calls on_change(False).
+    # The gap between the two thresholds keeps a flapping proxy from toggling routing.
+    # If on_change raises, the switch is retried on the next check.
+    def __init__(self, host="127.0.0.1", port=1080, fetch_host="www.cloudflare.com", fetch_port=80,
+                 fetch_path="/cdn-cgi/trace", interval=30, timeout=5, max_latency_ms=3000,
+                 fail_after=3, recover_after=5, history=120, on_change=None, failed_over=False):
+        self.host = host
+        self.port = int(port)
+        self.fetch_host = fetch_host
+        self.fetch_port = int(fetch_port)
+        self.fetch_path = fetch_path
+        self.interval = interval
+        self.timeout = timeout
+        self.max_latency_ms = max_latency_ms
+        self.fail_after = fail_after
+        self.recover_after = recover_after
+        self.on_change = on_change
+        self.history = deque(maxlen=history)
+        self.failed_over = failed_over
+        self.applied = failed_over
+        self.bad_streak = 0
+        self.good_streak = 0
+        self.last_error = None
+        self.last_switch = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_good(self, result):
+        return result["ok"] and result["fetch_ms"] <= self.max_latency_ms
+
+    def check(self):
+        result = probe(self.host, self.port, self.fetch_host, self.fetch_port, self.fetch_path, self.timeout)
+        with self._lock:
+            self.history.append(result)
+            if self.is_good(result):
+                self.good_streak += 1
+                self.bad_streak = 0
+            else:
+                self.bad_streak += 1
+                self.good_streak = 0
+            if not self.failed_over and self.bad_streak >= self.fail_after:
+                self.failed_over = True
+                self.last_switch = time.time()
+            elif self.failed_over and self.good_streak >= self.recover_after:
+                self.failed_over = False
+                self.last_switch = time.time()
+            target = self.failed_over
+        if target != self.applied:
+            try:
+                if self.on_change:
+                    self.on_change(target)
+                self.applied = target
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Warp failover switch failed: {e}")
+        return result
+
+    def latencies(self, window=20):
+        with self._lock:
+            return [r["fetch_ms"] if r["ok"] else None for r in list(self.history)[-window:]]
+
+    def sparkline(self, window=20):
+        values = self.latencies(window)
+        ok = [v for v in values if v is not None]
+        if not ok:
+            return "✖" * len(values)
+        top = max(max(ok), 1)
+        return "".join("✖" if v is None else SPARK[min(int(v / top * (len(SPARK) - 1)), len(SPARK) - 1)] for v in values)
+
+    def summary(self):
+        with self._lock:
+            last = self.history[-1] if self.history else None
+            good = [r["fetch_ms"] for r in self.history if r["ok"]]
+            return {
+                "failed_over": self.failed_over,
+                "applied": self.applied,
+                "last": last,
+                "checks": len(self.history),
+                "success_rate": len(good) / len(self.history) if self.history else None,
+                "avg_ms": sum(good) / len(good) if good else None,
+                "last_switch": self.last_switch,
+                "last_error": self.last_error,
+            }
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Warp monitor error: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="warp-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)